@@ -0,0 +1,143 @@
+# action_parser.py - Incremental parser for the "Actions:" block in chat replies
+import json
+from typing import List
+from models import ChatAction
+
+ACTIONS_MARKER = "Actions:"
+
+
+class ActionStreamParser:
+    """
+    Consumes a chat completion piece by piece (or all at once) and splits it into
+    the user-facing reply and the ChatActions in the JSON array after "Actions:".
+
+    Each action is parsed as soon as its closing brace arrives, so callers can
+    start applying actions while the model is still writing. Code fences around
+    the array are ignored. If the reply is cut off, every action completed
+    before the cut is kept, and close() tries to salvage the last one by closing
+    its open brackets.
+    """
+
+    def __init__(self):
+        self.raw = ""
+        self.actions: List[ChatAction] = []
+        self.marker_pos = -1     # Index of "Actions:" in raw, once seen
+        self.array_closed = False
+        self._scan_pos = 0       # Next index of raw to scan
+        self._array_started = False
+        self._stack = []         # Open '[' / '{' inside the array
+        self._in_string = False
+        self._escape = False
+        self._object_start = -1  # Index in raw of the action object being read
+
+    def feed(self, text: str) -> List[ChatAction]:
+        """Add the next piece of the completion; returns actions completed by it"""
+        self.raw += text
+        if self.marker_pos == -1:
+            # Search a little before the new text in case the marker was split
+            start = max(0, len(self.raw) - len(text) - len(ACTIONS_MARKER))
+            self.marker_pos = self.raw.find(ACTIONS_MARKER, start)
+            if self.marker_pos == -1:
+                return []
+            self._scan_pos = self.marker_pos + len(ACTIONS_MARKER)
+        return self._scan()
+
+    def _scan(self) -> List[ChatAction]:
+        completed = []
+        raw = self.raw
+        i = self._scan_pos
+        while i < len(raw) and not self.array_closed:
+            char = raw[i]
+            if not self._array_started:
+                # Skip whitespace, code fences etc. up to the opening bracket
+                if char == '[':
+                    self._array_started = True
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '[{':
+                if not self._stack and char == '{':
+                    self._object_start = i
+                self._stack.append(char)
+            elif char in ']}':
+                if not self._stack:
+                    if char == ']':
+                        self.array_closed = True  # End of the actions array
+                else:
+                    self._stack.pop()
+                    if not self._stack and self._object_start != -1:
+                        action = self._parse_action(raw[self._object_start:i + 1])
+                        self._object_start = -1
+                        if action is not None:
+                            completed.append(action)
+            i += 1
+        self._scan_pos = i
+        self.actions.extend(completed)
+        return completed
+
+    @staticmethod
+    def _parse_action(object_str: str):
+        try:
+            return ChatAction(**json.loads(object_str))
+        except Exception as e:
+            print(f"Error parsing action JSON: {e}")
+            print(f"Action string (first 1000 chars): {object_str[:1000]}")
+            return None
+
+    def close(self) -> List[ChatAction]:
+        """
+        End of the completion. If it stopped inside an action, try to complete it by
+        closing its open brackets. Returns the salvaged action, if any.
+        """
+        if self.array_closed or self._object_start == -1 or self._in_string:
+            return []
+        closers = ''.join('}' if c == '{' else ']' for c in reversed(self._stack))
+        try:
+            action = ChatAction(**json.loads(self.raw[self._object_start:] + closers))
+        except Exception as e:
+            print(f"Failed to fix truncated action JSON: {e}")
+            return []
+        print("Recovered truncated action from AI response")
+        self._object_start = -1
+        self._stack = []
+        self.actions.append(action)
+        return [action]
+
+    @property
+    def streamable_length(self) -> int:
+        """
+        How much of raw can be shown to the user so far: everything before "Actions:",
+        holding back a tail that might be the start of that marker.
+        """
+        if self.marker_pos != -1:
+            return self.marker_pos
+        for n in range(min(len(ACTIONS_MARKER) - 1, len(self.raw)), 0, -1):
+            if self.raw.endswith(ACTIONS_MARKER[:n]):
+                return len(self.raw) - n
+        return len(self.raw)
+
+    @property
+    def response_text(self) -> str:
+        """
+        The reply without the Actions section. If there is no parseable Actions
+        section, the raw completion is returned unchanged.
+        """
+        if self.marker_pos != -1 and (self.actions or self.array_closed):
+            return self.raw[:self.marker_pos].strip()
+        return self.raw
+
+
+def parse_actions(raw_response: str):
+    """Parse a complete reply. Returns (response_text, actions)."""
+    parser = ActionStreamParser()
+    parser.feed(raw_response)
+    parser.close()
+    if parser.actions:
+        print(f"Successfully extracted {len(parser.actions)} actions from AI response")
+    return parser.response_text, parser.actions
@@ -1,155 +1,708 @@
 # ai_client.py
-from typing import List
+from typing import Dict, List, Optional
+import asyncio
 import hashlib
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
 from cachetools import TTLCache
 from google import genai
-from config import GEMINI_API_KEY, GEMINI_MODEL
+from google.genai import types
+from config import (
+    GEMINI_API_KEY, GEMINI_MODEL, GEMINI_MAX_CONCURRENCY, EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_DTYPE,
+    EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_BATCH_MAX, GEMINI_CONTEXT_CACHE, GEMINI_CONTEXT_CACHE_TTL_S
+)
+from embedding_store import embedding_store
 
 # Initialize Google GenAI client
+# genai_client.models is the blocking transport (use from sync routes / threads),
+# genai_client.aio.models is the async transport (use from async routes)
 genai_client = genai.Client(api_key=GEMINI_API_KEY)
 
+EMBEDDING_MODEL = "text-embedding-004"
+EMBEDDING_DIM = 768
+FALLBACK_MODEL = "gemini-2.5-flash-lite"
+
 # Embedding cache: Cache embeddings for 7 days (604800 seconds)
-# Max 10,000 cached embeddings to prevent memory bloat
-embedding_cache = TTLCache(maxsize=10000, ttl=604800)
+# Entries are contiguous numpy vectors (EMBEDDING_CACHE_DTYPE: float32, float16 or
+# int8) instead of lists of boxed floats - ~3 KB per 768-d float32 vector instead of
+# ~25 KB, so the default cap is 40,000 (raise EMBEDDING_CACHE_SIZE as memory allows)
+# Second tier: embedding_store (persistent, shared across workers and restarts)
+embedding_cache = TTLCache(maxsize=EMBEDDING_CACHE_SIZE, ttl=604800)
 
 # LLM response cache: Cache responses for 1 hour (3600 seconds)
 # Max 1000 cached responses
 llm_cache = TTLCache(maxsize=1000, ttl=3600)
 
-def gemini_embedding(texts: List[str]) -> List[List[float]]:
-    """
-    Use genai embeddings API with caching to reduce API calls.
-    Caches embeddings for 7 days to avoid regenerating same embeddings.
-    """
-    cached_results = {}
-    uncached_texts = []
-    uncached_indices = []
-    
-    # Check cache for each text
-    for i, text in enumerate(texts):
-        # Create cache key from text hash (normalize whitespace)
-        normalized_text = ' '.join(text.split())
-        cache_key = hashlib.md5(normalized_text.encode('utf-8')).hexdigest()
-        
-        if cache_key in embedding_cache:
-            cached_results[i] = embedding_cache[cache_key]
-        else:
-            uncached_texts.append(text)
-            uncached_indices.append(i)
-    
-    # Generate embeddings only for uncached texts
-    if uncached_texts:
+# Shared bound on in-flight async generate calls for this worker
+# (embeddings are bounded by the batcher's flush pool instead).
+# Requests beyond the limit wait here instead of opening more connections
+# (the SDK opens one HTTP connection per call, so this is the effective pool size;
+# ai_service sizes the loop's default executor to match)
+_gemini_slots = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+# Single-flight: cache key -> Future of the upstream call currently in flight.
+# Concurrent identical requests (sync or async) wait on that call instead of
+# issuing their own. Keys are the same md5 keys used by the caches above.
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+# Gemini context caches for static system instructions:
+# md5(model + instruction) -> (cache name, valid until). A None name means caching
+# failed for that model (unsupported, too short, quota) and the instruction is sent
+# inline until the entry expires; Gemini 2.5 still discounts the repeated prefix.
+_context_caches: Dict[str, tuple] = {}
+_context_cache_lock = threading.Lock()
+
+
+def _claim(key: str):
+    """Return (future, is_leader). The leader must publish a result when done."""
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        if fut is not None:
+            return fut, False
+        fut = Future()
+        _inflight[key] = fut
+        return fut, True
+
+
+def _settle(key: str, fut: Future, result) -> None:
+    """Publish the leader's result to waiters and stop coalescing on key"""
+    with _inflight_lock:
+        _inflight.pop(key, None)
+    fut.set_result(result)
+
+
+def _embedding_cache_key(text: str) -> str:
+    """Cache key for an embedding: md5 of the whitespace-normalized text"""
+    normalized_text = ' '.join(text.split())
+    return hashlib.md5(normalized_text.encode('utf-8')).hexdigest()
+
+
+def _llm_cache_key(model: str, prompt: str, system_instruction: Optional[str] = None) -> str:
+    """Cache key for a generation: md5 of model + system instruction + whitespace-normalized prompt"""
+    normalized_prompt = ' '.join(prompt.split())
+    if system_instruction:
+        normalized_prompt = f"{_context_cache_key(model, system_instruction)}:{normalized_prompt}"
+    return hashlib.md5(f"{model}:{normalized_prompt}".encode('utf-8')).hexdigest()
+
+
+def _context_cache_key(model: str, system_instruction: str) -> str:
+    return hashlib.md5(f"{model}:{system_instruction}".encode('utf-8')).hexdigest()
+
+
+def _lookup_context_cache(key: str):
+    """(known, cache name). known is False when the cache has to be (re)created."""
+    entry = _context_caches.get(key)
+    if entry is None or entry[1] <= time.time():
+        return False, None
+    return True, entry[0]
+
+
+def _create_context_cache(key: str, model: str, system_instruction: str) -> Optional[str]:
+    """Upload the instruction as a Gemini cached content (blocking). Returns its name or None."""
+    with _context_cache_lock:
+        # Another request may have created it while this one waited
+        known, name = _lookup_context_cache(key)
+        if known:
+            return name
         try:
-            res = genai_client.models.embed_content(
-                model="text-embedding-004",
-                contents=uncached_texts
+            cache = genai_client.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=system_instruction,
+                    ttl=f"{GEMINI_CONTEXT_CACHE_TTL_S}s"
+                )
             )
-            # Extract embedding values from response
-            new_embeddings = []
-            for emb_obj in res.embeddings:
-                if hasattr(emb_obj, 'values'):
-                    new_embeddings.append(emb_obj.values)
-                else:
-                    # Fallback if structure is different
-                    new_embeddings.append(list(emb_obj))
-            
-            # Cache the new embeddings
-            for text, emb in zip(uncached_texts, new_embeddings):
-                normalized_text = ' '.join(text.split())
-                cache_key = hashlib.md5(normalized_text.encode('utf-8')).hexdigest()
-                embedding_cache[cache_key] = emb
+            # Stop using it a minute before Gemini expires it
+            _context_caches[key] = (cache.name, time.time() + GEMINI_CONTEXT_CACHE_TTL_S - 60)
+            print(f"Created context cache for {model}: {cache.name}")
+            return cache.name
         except Exception as e:
-            print(f"Embedding error: {e}")
-            # Return zero embeddings as fallback for failed ones
-            new_embeddings = [[0.0] * 768 for _ in uncached_texts]
-            for text, emb in zip(uncached_texts, new_embeddings):
-                normalized_text = ' '.join(text.split())
-                cache_key = hashlib.md5(normalized_text.encode('utf-8')).hexdigest()
-                embedding_cache[cache_key] = emb
-    
-    # Combine cached and new results in correct order
-    result = []
-    uncached_idx = 0
-    for i in range(len(texts)):
-        if i in cached_results:
-            result.append(cached_results[i])
+            print(f"Context caching unavailable for {model} ({e}); sending system instruction inline")
+            # Don't retry on every request
+            _context_caches[key] = (None, time.time() + 600)
+            return None
+
+
+def _forget_context_cache(model: str, system_instruction: Optional[str]) -> None:
+    """Drop a cache entry after a failed call so the next request recreates it"""
+    if system_instruction:
+        _context_caches.pop(_context_cache_key(model, system_instruction), None)
+
+
+def _generate_config(cached_content: Optional[str], system_instruction: Optional[str]):
+    if cached_content:
+        return types.GenerateContentConfig(cached_content=cached_content)
+    if system_instruction:
+        return types.GenerateContentConfig(system_instruction=system_instruction)
+    return None
+
+
+def _context_config(model: str, system_instruction: Optional[str], use_cache: bool = True):
+    """
+    Generation config carrying the system instruction: a reference to its context
+    cache when available, otherwise the instruction itself. Blocking on first use.
+    """
+    if not system_instruction:
+        return None
+    if not (use_cache and GEMINI_CONTEXT_CACHE):
+        return _generate_config(None, system_instruction)
+    key = _context_cache_key(model, system_instruction)
+    known, name = _lookup_context_cache(key)
+    if not known:
+        name = _create_context_cache(key, model, system_instruction)
+    return _generate_config(name, system_instruction)
+
+
+async def _acontext_config(model: str, system_instruction: Optional[str], use_cache: bool = True):
+    """Async version of _context_config (cache creation runs on a worker thread)"""
+    if system_instruction and use_cache and GEMINI_CONTEXT_CACHE:
+        key = _context_cache_key(model, system_instruction)
+        known, name = _lookup_context_cache(key)
+        if not known:
+            name = await asyncio.to_thread(_create_context_cache, key, model, system_instruction)
+        return _generate_config(name, system_instruction)
+    return _context_config(model, system_instruction, use_cache)
+
+
+def warm_up_context_cache(system_instruction: str) -> None:
+    """Create the context caches for both chat models ahead of the first request"""
+    if GEMINI_CONTEXT_CACHE:
+        for model in (GEMINI_MODEL, FALLBACK_MODEL):
+            _context_config(model, system_instruction)
+
+
+def _as_vector(emb) -> np.ndarray:
+    """Contiguous, read-only float32 vector (shared between callers, so never mutated)"""
+    vec = np.ascontiguousarray(emb, dtype=np.float32)
+    vec.setflags(write=False)
+    return vec
+
+
+def _zero_vectors(n: int) -> List[np.ndarray]:
+    """Fallback embeddings for failed calls"""
+    return [_as_vector(np.zeros(EMBEDDING_DIM, dtype=np.float32)) for _ in range(n)]
+
+
+def _pack(vec: np.ndarray):
+    """Compact a float32 vector for the in-memory tier according to EMBEDDING_CACHE_DTYPE"""
+    if EMBEDDING_CACHE_DTYPE == "float16":
+        return vec.astype(np.float16)
+    if EMBEDDING_CACHE_DTYPE == "int8":
+        # Symmetric per-vector quantization: int8 codes plus one float scale
+        scale = float(np.abs(vec).max()) / 127.0
+        if scale == 0.0:
+            return np.zeros(vec.shape, dtype=np.int8), 0.0
+        return np.round(vec / scale).astype(np.int8), scale
+    return vec
+
+
+def _unpack(entry) -> np.ndarray:
+    """Inverse of _pack: always hand callers a float32 vector"""
+    if isinstance(entry, tuple):
+        codes, scale = entry
+        return _as_vector(codes.astype(np.float32) * scale)
+    if entry.dtype != np.float32:
+        return _as_vector(entry)
+    return entry
+
+
+def to_chroma_embeddings(embeddings) -> List[List[float]]:
+    """Convert embeddings to the plain float lists ChromaDB expects (do this only at the Chroma call)"""
+    return [np.asarray(emb, dtype=np.float32).tolist() for emb in embeddings]
+
+
+def _extract_embeddings(res) -> List[np.ndarray]:
+    """Extract embedding values from an embed_content response"""
+    embeddings = []
+    for emb_obj in res.embeddings:
+        if hasattr(emb_obj, 'values'):
+            embeddings.append(_as_vector(emb_obj.values))
         else:
-            normalized_text = ' '.join(uncached_texts[uncached_idx].split())
-            cache_key = hashlib.md5(normalized_text.encode('utf-8')).hexdigest()
-            result.append(embedding_cache[cache_key])
-            uncached_idx += 1
-    
-    return result
+            # Fallback if structure is different
+            embeddings.append(_as_vector(list(emb_obj)))
+    return embeddings
+
+
+def _extract_text(resp) -> str:
+    """Extract text from a generate_content response"""
+    if hasattr(resp, 'text') and resp.text:
+        return resp.text
+    # Fallback extraction methods
+    if hasattr(resp, 'candidates') and resp.candidates:
+        for candidate in resp.candidates:
+            if hasattr(candidate, 'content') and candidate.content:
+                if hasattr(candidate.content, 'parts') and candidate.content.parts:
+                    for part in candidate.content.parts:
+                        if hasattr(part, 'text') and part.text:
+                            return part.text
+    return str(resp)
+
 
-def call_gemini_generate(prompt: str, use_fast_model: bool = False) -> str:
+def _lookup_embeddings(texts: List[str]):
     """
-    Generate content using Gemini with caching and fallback to lite model if rate limited.
-    use_fast_model: If True, use faster lite model for speed-critical operations like skill creation.
-    
-    Caches responses for 1 hour to reduce API calls for similar prompts.
+    Check the in-memory tier.
+    Returns (keys, found, missing): keys in input order, key -> cached embedding,
+    and key -> text for the texts still needed (each distinct text once).
     """
-    fallback_model = "gemini-2.5-flash-lite"
-    model_to_use = fallback_model if use_fast_model else GEMINI_MODEL
-    
-    # Create cache key from prompt and model
-    # Normalize whitespace for better cache hits
-    normalized_prompt = ' '.join(prompt.split())
-    cache_key = hashlib.md5(f"{model_to_use}:{normalized_prompt}".encode('utf-8')).hexdigest()
-    
-    # Check cache first
-    if cache_key in llm_cache:
-        print(f"Cache hit for LLM request (model: {model_to_use})")
-        return llm_cache[cache_key]
-    
+    keys = [_embedding_cache_key(text) for text in texts]
+    found = {}
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key in found or key in missing:
+            continue  # Same text repeated within this call
+        if key in embedding_cache:
+            found[key] = _unpack(embedding_cache[key])
+        else:
+            missing[key] = text
+    return keys, found, missing
+
+
+def _load_persisted(missing: dict, found: dict) -> None:
+    """Read-through to the persistent tier; hits are promoted to the in-memory tier"""
+    if embedding_store is None or not missing:
+        return
+    hits = embedding_store.get_many(EMBEDDING_MODEL, list(missing))
+    for key, emb in hits.items():
+        embedding_cache[key] = _pack(emb)
+        found[key] = emb
+        del missing[key]
+
+
+def _persist_embeddings(lead_keys: List[str], new_embeddings: List[np.ndarray]) -> None:
+    """Write freshly generated embeddings through to the persistent tier"""
+    if embedding_store is None:
+        return
+    embedding_store.put_many(EMBEDDING_MODEL, dict(zip(lead_keys, new_embeddings)))
+
+
+def _claim_embeddings(missing: dict):
+    """
+    Join or lead the single-flight for each missing text.
+    Returns (lead_keys, lead_texts, waiting):
+    - lead_keys/lead_texts: texts this caller must embed (it leads their single-flight)
+    - waiting: key -> Future of another caller's in-flight request
+    """
+    lead_keys, lead_texts = [], []
+    waiting = {}
+    for key, text in missing.items():
+        fut, is_leader = _claim(key)
+        if is_leader:
+            lead_keys.append(key)
+            lead_texts.append(text)
+        else:
+            waiting[key] = fut
+    return lead_keys, lead_texts, waiting
+
+
+def _publish_embeddings(lead_keys: List[str], new_embeddings: List[np.ndarray], found: dict, cache: bool = True) -> None:
+    """Cache embeddings this caller led and release their waiters"""
+    for key, emb in zip(lead_keys, new_embeddings):
+        if cache:
+            embedding_cache[key] = _pack(emb)
+        found[key] = emb
+    for key, emb in zip(lead_keys, new_embeddings):
+        with _inflight_lock:
+            fut = _inflight.pop(key, None)
+        if fut is not None:
+            fut.set_result(emb)
+
+
+def _publish_results(lead_keys: List[str], results, found: dict) -> None:
+    """Publish batcher results ((embedding, ok) per key) and persist the successful ones"""
+    ok_keys = [key for key, (_, ok) in zip(lead_keys, results) if ok]
+    failed_keys = [key for key, (_, ok) in zip(lead_keys, results) if not ok]
+    _publish_embeddings(ok_keys, [emb for emb, ok in results if ok], found)
+    # Zero-vector fallbacks (one batch failed) are neither cached nor persisted
+    _publish_embeddings(failed_keys, [emb for emb, ok in results if not ok], found, cache=False)
+    if ok_keys:
+        _persist_embeddings(ok_keys, [found[key] for key in ok_keys])
+
+
+def _embed_upstream(texts: List[str]):
+    """Blocking embed_content call. Returns (embeddings, ok); zero vectors on failure"""
+    try:
+        res = genai_client.models.embed_content(
+            model=EMBEDDING_MODEL,
+            contents=texts
+        )
+        return _extract_embeddings(res), True
+    except Exception as e:
+        print(f"Embedding error: {e}")
+        # Return zero embeddings as fallback for failed ones
+        return _zero_vectors(len(texts)), False
+
+
+class _EmbeddingBatcher:
+    """
+    Collects texts from all concurrent callers (sync and async) and sends them
+    as shared embed_content requests. A batch is flushed once it holds
+    max_batch texts or window seconds after its first text arrived.
+    Each text gets its own Future resolving to (embedding, ok).
+    """
+
+    def __init__(self, window: float, max_batch: int, max_parallel: int):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []  # [(text, Future)]
+        self._cond = threading.Condition()
+        self._thread = None
+        # Flushes run here so one slow request doesn't hold up the next batch
+        self._pool = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="embed-batch")
+
+    def submit(self, texts: List[str]) -> List[Future]:
+        futures = [Future() for _ in texts]
+        with self._cond:
+            self._pending.extend(zip(texts, futures))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return futures
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Give other callers a moment to join this batch
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            self._pool.submit(self._flush, batch)
+
+    def _flush(self, batch) -> None:
+        # Claim each future first, as the reranker does: texts of cancelled callers (an
+        # async caller that is cancelled also cancels its future) are dropped, and the
+        # rest can't be cancelled any more, so setting their results below can't fail
+        batch = [(text, fut) for text, fut in batch if fut.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        embeddings, ok = _embed_upstream([text for text, _ in batch])
+        for (_, fut), emb in zip(batch, embeddings):
+            fut.set_result((emb, ok))
+        # Upstream returned fewer vectors than texts: fail the rest rather than leave callers waiting
+        for _, fut in batch[len(embeddings):]:
+            fut.set_exception(RuntimeError(f"Embedding response had {len(embeddings)} vectors for {len(batch)} texts"))
+
+
+# Shared batcher (None when EMBEDDING_BATCH_WINDOW_MS is 0: every call goes straight upstream)
+_embedding_batcher = (
+    _EmbeddingBatcher(EMBEDDING_BATCH_WINDOW_MS / 1000.0, EMBEDDING_BATCH_MAX, GEMINI_MAX_CONCURRENCY)
+    if EMBEDDING_BATCH_WINDOW_MS > 0 else None
+)
+
+
+def _submit_embeddings(texts: List[str]) -> List[Future]:
+    """Queue texts on the shared batcher, or embed them right away when batching is off"""
+    if _embedding_batcher is not None:
+        return _embedding_batcher.submit(texts)
+    futures = []
+    for i in range(0, len(texts), EMBEDDING_BATCH_MAX):
+        chunk = texts[i:i + EMBEDDING_BATCH_MAX]
+        embeddings, ok = _embed_upstream(chunk)
+        for emb in embeddings:
+            fut = Future()
+            fut.set_result((emb, ok))
+            futures.append(fut)
+        for _ in chunk[len(embeddings):]:
+            fut = Future()
+            fut.set_exception(RuntimeError(f"Embedding response had {len(embeddings)} vectors for {len(chunk)} texts"))
+            futures.append(fut)
+    return futures
+
+
+def gemini_embedding(texts: List[str]) -> List[np.ndarray]:
+    """
+    Use genai embeddings API with caching to reduce API calls.
+    Caches embeddings for 7 days in memory, backed by the persistent embedding store.
+    Returns read-only float32 vectors; use to_chroma_embeddings when passing them to Chroma.
+    Texts already being embedded by a concurrent request are waited on, not re-sent.
+    Blocking - async routes should use agemini_embedding instead.
+    """
+    keys, found, missing = _lookup_embeddings(texts)
+    _load_persisted(missing, found)
+    lead_keys, lead_texts, waiting = _claim_embeddings(missing)
+
+    # Generate embeddings only for uncached texts nobody else is fetching,
+    # batched together with whatever other callers are embedding right now
+    if lead_texts:
+        try:
+            results = [fut.result() for fut in _submit_embeddings(lead_texts)]
+        except BaseException:
+            # Never leave waiters hanging on a call that will not complete
+            _publish_embeddings(lead_keys, _zero_vectors(len(lead_keys)), {}, cache=False)
+            raise
+        _publish_results(lead_keys, results, found)
+
+    for key, fut in waiting.items():
+        found[key] = fut.result()
+
+    return [found[key] for key in keys]
+
+
+async def agemini_embedding(texts: List[str]) -> List[np.ndarray]:
+    """
+    Async version of gemini_embedding.
+    Shares the same cache tiers, single-flight table and batcher, but awaits
+    the batched request so the event loop stays free while it is in flight.
+    """
+    keys, found, missing = _lookup_embeddings(texts)
+    if missing and embedding_store is not None:
+        await asyncio.to_thread(_load_persisted, missing, found)
+    lead_keys, lead_texts, waiting = _claim_embeddings(missing)
+
+    if lead_texts:
+        try:
+            futures = _submit_embeddings(lead_texts)
+            results = await asyncio.gather(*(asyncio.wrap_future(fut) for fut in futures))
+        except BaseException:
+            # Cancelled mid-call: release waiters rather than leave them hanging
+            _publish_embeddings(lead_keys, _zero_vectors(len(lead_keys)), {}, cache=False)
+            raise
+        if embedding_store is not None:
+            await asyncio.to_thread(_publish_results, lead_keys, results, found)
+        else:
+            _publish_results(lead_keys, results, found)
+
+    for key, fut in waiting.items():
+        found[key] = await asyncio.wrap_future(fut)
+
+    return [found[key] for key in keys]
+
+
+def _generate(model_to_use: str, prompt: str, cache_key: str, system_instruction: Optional[str] = None) -> str:
+    """Blocking upstream generation with lite-model fallback (no single-flight)"""
     try:
         # Use faster model for skill creation or primary model otherwise
         # Using gemini-2.5-flash-lite for skill creation (faster, optimized for speed)
         resp = genai_client.models.generate_content(
             model=model_to_use,
-            contents=prompt
+            contents=prompt,
+            config=_context_config(model_to_use, system_instruction)
         )
-        
-        # Extract text from response
-        response_text = None
-        if hasattr(resp, 'text') and resp.text:
-            response_text = resp.text
-        else:
-            # Fallback extraction methods
-            if hasattr(resp, 'candidates') and resp.candidates:
-                for candidate in resp.candidates:
-                    if hasattr(candidate, 'content') and candidate.content:
-                        if hasattr(candidate.content, 'parts') and candidate.content.parts:
-                            for part in candidate.content.parts:
-                                if hasattr(part, 'text') and part.text:
-                                    response_text = part.text
-                                    break
-                    if response_text:
-                        break
-        
-        if not response_text:
-            response_text = str(resp)
-        
+        response_text = _extract_text(resp)
+
         # Cache the response
         llm_cache[cache_key] = response_text
         return response_text
-        
+
     except Exception as e:
-        print(f"Primary model ({GEMINI_MODEL}) failed: {e}")
-        print(f"Retrying with fallback model: {fallback_model}")
-        
+        print(f"Primary model ({model_to_use}) failed: {e}")
+        print(f"Retrying with fallback model: {FALLBACK_MODEL}")
+        _forget_context_cache(model_to_use, system_instruction)
+
         try:
             # Try fallback model (don't cache fallback responses to avoid caching errors)
+            # The instruction goes inline in case the context cache was the problem
             resp = genai_client.models.generate_content(
-                model=fallback_model,
-                contents=prompt
+                model=FALLBACK_MODEL,
+                contents=prompt,
+                config=_context_config(FALLBACK_MODEL, system_instruction, use_cache=False)
             )
-            
+
             if hasattr(resp, 'text') and resp.text:
                 return resp.text
-            
+
             return str(resp)
-            
+
         except Exception as fallback_error:
             print(f"Fallback model also failed: {fallback_error}")
             return "Error: Unable to generate response from Gemini API"
 
+
+async def _agenerate(model_to_use: str, prompt: str, cache_key: str, system_instruction: Optional[str] = None) -> str:
+    """Async upstream generation with lite-model fallback (no single-flight)"""
+    try:
+        config = await _acontext_config(model_to_use, system_instruction)
+        async with _gemini_slots:
+            resp = await genai_client.aio.models.generate_content(
+                model=model_to_use,
+                contents=prompt,
+                config=config
+            )
+        response_text = _extract_text(resp)
+        llm_cache[cache_key] = response_text
+        return response_text
+
+    except Exception as e:
+        print(f"Primary model ({model_to_use}) failed: {e}")
+        print(f"Retrying with fallback model: {FALLBACK_MODEL}")
+        _forget_context_cache(model_to_use, system_instruction)
+
+        try:
+            # Don't cache fallback responses to avoid caching errors
+            async with _gemini_slots:
+                resp = await genai_client.aio.models.generate_content(
+                    model=FALLBACK_MODEL,
+                    contents=prompt,
+                    config=_context_config(FALLBACK_MODEL, system_instruction, use_cache=False)
+                )
+
+            if hasattr(resp, 'text') and resp.text:
+                return resp.text
+
+            return str(resp)
+
+        except Exception as fallback_error:
+            print(f"Fallback model also failed: {fallback_error}")
+            return "Error: Unable to generate response from Gemini API"
+
+
+def call_gemini_generate(prompt: str, use_fast_model: bool = False, system_instruction: Optional[str] = None) -> str:
+    """
+    Generate content using Gemini with caching and fallback to lite model if rate limited.
+    use_fast_model: If True, use faster lite model for speed-critical operations like skill creation.
+    system_instruction: Optional static instructions. Sent through a Gemini context cache
+    (uploaded once, then referenced by name), so only prompt is new input per call.
+
+    Caches responses for 1 hour to reduce API calls for similar prompts.
+    Identical prompts already in flight share that call's result (single-flight).
+    Blocking - async routes should use acall_gemini_generate instead.
+    """
+    model_to_use = FALLBACK_MODEL if use_fast_model else GEMINI_MODEL
+
+    # Create cache key from prompt and model
+    # Normalize whitespace for better cache hits
+    cache_key = _llm_cache_key(model_to_use, prompt, system_instruction)
+
+    # Check cache first
+    if cache_key in llm_cache:
+        print(f"Cache hit for LLM request (model: {model_to_use})")
+        return llm_cache[cache_key]
+
+    fut, is_leader = _claim(cache_key)
+    if not is_leader:
+        print(f"Joined in-flight LLM request (model: {model_to_use})")
+        return fut.result()
+
+    response_text = "Error: Unable to generate response from Gemini API"
+    try:
+        response_text = _generate(model_to_use, prompt, cache_key, system_instruction)
+        return response_text
+    finally:
+        _settle(cache_key, fut, response_text)
+
+
+async def acall_gemini_generate(prompt: str, use_fast_model: bool = False, system_instruction: Optional[str] = None) -> str:
+    """
+    Async version of call_gemini_generate (same caching, fallback and single-flight).
+    Runs on the SDK's async transport, bounded by GEMINI_MAX_CONCURRENCY, so many
+    LLM calls can be in flight on a single worker without blocking the event loop.
+    """
+    model_to_use = FALLBACK_MODEL if use_fast_model else GEMINI_MODEL
+    cache_key = _llm_cache_key(model_to_use, prompt, system_instruction)
+
+    if cache_key in llm_cache:
+        print(f"Cache hit for LLM request (model: {model_to_use})")
+        return llm_cache[cache_key]
+
+    fut, is_leader = _claim(cache_key)
+    if not is_leader:
+        print(f"Joined in-flight LLM request (model: {model_to_use})")
+        return await asyncio.wrap_future(fut)
+
+    response_text = "Error: Unable to generate response from Gemini API"
+    try:
+        response_text = await _agenerate(model_to_use, prompt, cache_key, system_instruction)
+        return response_text
+    finally:
+        _settle(cache_key, fut, response_text)
+
+
+def _stream_chunk_text(chunk) -> str:
+    """Text of one streamed chunk ('' for chunks that only carry metadata)"""
+    try:
+        return chunk.text or ""
+    except Exception:
+        return ""
+
+
+async def _astream_model(model_to_use: str, prompt: str, config=None):
+    """
+    Stream text pieces from one model.
+    The SDK's async stream reads the HTTP response synchronously on the event loop,
+    so the blocking stream runs on a worker thread and pieces are handed over
+    through a queue instead.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def pump():
+        try:
+            for chunk in genai_client.models.generate_content_stream(model=model_to_use, contents=prompt, config=config):
+                if stop.is_set():
+                    break
+                text = _stream_chunk_text(chunk)
+                if text:
+                    loop.call_soon_threadsafe(queue.put_nowait, ("text", text))
+            loop.call_soon_threadsafe(queue.put_nowait, ("done", None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+
+    async with _gemini_slots:
+        loop.run_in_executor(None, pump)
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == "text":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    break
+        finally:
+            # Consumer gone (client disconnected) or finished: the worker stops at its next chunk
+            stop.set()
+
+
+async def astream_gemini_generate(prompt: str, use_fast_model: bool = False, system_instruction: Optional[str] = None):
+    """
+    Streaming version of acall_gemini_generate: yields text pieces as Gemini produces them.
+    A cached response is yielded in one piece. If the primary model fails before
+    producing any text, the lite model is streamed instead; the complete primary-model
+    response is cached under the same key as the non-streaming call.
+    """
+    model_to_use = FALLBACK_MODEL if use_fast_model else GEMINI_MODEL
+    cache_key = _llm_cache_key(model_to_use, prompt, system_instruction)
+
+    if cache_key in llm_cache:
+        print(f"Cache hit for LLM request (model: {model_to_use})")
+        yield llm_cache[cache_key]
+        return
+
+    pieces = []
+    try:
+        config = await _acontext_config(model_to_use, system_instruction)
+        async for piece in _astream_model(model_to_use, prompt, config):
+            pieces.append(piece)
+            yield piece
+        llm_cache[cache_key] = "".join(pieces)
+        return
+    except Exception as e:
+        print(f"Primary model ({model_to_use}) stream failed: {e}")
+        _forget_context_cache(model_to_use, system_instruction)
+        if pieces:
+            # Text already reached the client; end the stream rather than start over
+            return
+
+    print(f"Retrying with fallback model: {FALLBACK_MODEL}")
+    produced = False
+    try:
+        # Don't cache fallback responses to avoid caching errors
+        fallback_config = _context_config(FALLBACK_MODEL, system_instruction, use_cache=False)
+        async for piece in _astream_model(FALLBACK_MODEL, prompt, fallback_config):
+            produced = True
+            yield piece
+    except Exception as fallback_error:
+        print(f"Fallback model also failed: {fallback_error}")
+    if not produced:
+        yield "Error: Unable to generate response from Gemini API"
@@ -7,14 +7,83 @@ os.environ["LANGCHAIN_ENDPOINT"] = ""
 # ChromaDB telemetry (PostHog)
 os.environ["ANONYMIZED_TELEMETRY"] = "False"
 
+import time
+_import_started = time.perf_counter()
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from config import PORT, GEMINI_MODEL, ALLOWED_ORIGINS
+from fastapi.responses import JSONResponse
+from config import PORT, GEMINI_MODEL, ALLOWED_ORIGINS, GEMINI_MAX_CONCURRENCY, WARMUP_ON_STARTUP, STARTUP_PROFILE
 from websocket_manager import ws_manager
 from routes import ingest, planning, onboarding, chat, skill_generation, notification
+import database
+from reranker import warm_up_reranker
+from ai_client import warm_up_context_cache
+from token_budget import get_tokenizer
+from memory_writer import chat_memory_writer
+
+# Heavy dependencies (chromadb, langchain, the reranker, the policy model) are
+# loaded on first use, so importing the app stays fast
+if STARTUP_PROFILE:
+    print(f"[startup] imports: {time.perf_counter() - _import_started:.2f}s")
+
+# False while the optional warm-up is still running (see /health)
+_ready = not WARMUP_ON_STARTUP
+
+
+# (label, step) pairs run in order by _warm_up
+_WARMUP_STEPS = [
+    ("chroma", lambda: database.get_collection().count()),
+    # First predict call initializes the runtime; keep it off the first chat request
+    ("reranker", warm_up_reranker),
+    ("text splitters", lambda: (ingest.get_text_splitter(), chat.get_conversation_splitter())),
+    ("policy model", planning.get_policy_model),
+    # Uploads the static chat rules so the first chat turn doesn't create the cache
+    ("chat context cache", lambda: warm_up_context_cache(chat.CHAT_SYSTEM_INSTRUCTION)),
+]
+
+
+async def _warm_up():
+    """Load everything the first requests would otherwise stall on, then report ready"""
+    global _ready
+    started = time.perf_counter()
+    for label, step in _WARMUP_STEPS:
+        step_started = time.perf_counter()
+        try:
+            await asyncio.to_thread(step)
+        except Exception as e:
+            print(f"Warm-up step '{label}' failed: {e}")
+        if STARTUP_PROFILE:
+            print(f"[startup] warm-up {label}: {time.perf_counter() - step_started:.2f}s")
+    _ready = True
+    print(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The GenAI SDK's async transport and our asyncio.to_thread calls (Chroma, reranker)
+    # run on the loop's default executor, which is only min(32, cpus + 4) threads.
+    # Size it so GEMINI_MAX_CONCURRENCY LLM calls can really be in flight at once.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY + 8, thread_name_prefix="momentum-io")
+    )
+    # Local file (if configured), but keep even that read off the loop and out of the first /chat
+    await asyncio.to_thread(get_tokenizer)
+    # Warm up in the background so the port opens immediately; /health says when it's done
+    warmup_task = asyncio.create_task(_warm_up()) if WARMUP_ON_STARTUP else None
+    if STARTUP_PROFILE:
+        print(f"[startup] serving after {time.perf_counter() - _import_started:.2f}s")
+    yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    # Write out chat memory still waiting in the write-behind queue
+    await chat_memory_writer.drain()
 
 # Create FastAPI app
-app = FastAPI(title="Momentum AI microservice")
+app = FastAPI(title="Momentum AI microservice", lifespan=lifespan)
 
 # Add CORS middleware - restrict to specific origins for security
 app.add_middleware(
@@ -60,6 +129,9 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
 @app.get("/health")
 def health():
     import os
+    # Not ready until the startup warm-up (if enabled) has finished
+    if not _ready:
+        return JSONResponse(status_code=503, content={"status": "warming"})
     # Only expose model name in development
     if os.getenv("ENVIRONMENT", "development") == "development":
         return {"status": "ok", "model": GEMINI_MODEL}
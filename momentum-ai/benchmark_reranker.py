@@ -0,0 +1,118 @@
+# benchmark_reranker.py
+"""
+Compare the reranker backends (PyTorch vs ONNX Runtime) on latency and ranking agreement.
+
+    python benchmark_reranker.py
+    python benchmark_reranker.py --onnx-file onnx/model_quint8_avx2.onnx --runs 20
+
+Latency is measured per rerank call (one query against all its candidates, like
+_rerank_documents). Agreement compares each backend's ordering of the same
+candidates against the PyTorch ordering: Spearman rank correlation, whether the
+top document matches, and the overlap of the top 3.
+"""
+import argparse
+import os
+import time
+import numpy as np
+
+# reranker imports config, which requires these to be set
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+import reranker
+
+# Student-dashboard style queries with a mix of relevant and irrelevant candidates
+SAMPLES = [
+    ("when is my data structures exam", [
+        "Data Structures midterm is on March 14 covering trees, heaps and hash tables.",
+        "Remember to buy groceries after the gym on Thursday.",
+        "CSE220 syllabus: week 6 binary search trees, week 7 heaps, week 8 hashing.",
+        "I prefer studying in the morning before classes start.",
+        "The algorithms final exam is scheduled for the last week of the semester.",
+        "Lab report for physics due Friday at midnight.",
+        "Chat: User asked how to balance an AVL tree; explained rotations step by step.",
+        "Club meeting moved to Wednesday evening.",
+    ]),
+    ("how should I plan my study time this week", [
+        "Average daily completion rate is 70%, typical capacity 5 tasks per day.",
+        "User said they get distracted after 9pm and study best between 8 and 11am.",
+        "Linear algebra problem set 4 is due Tuesday.",
+        "Favourite food: ramen.",
+        "Plan for Monday: 2 hours calculus review, 1 hour reading, gym at 6pm.",
+        "Onboarding: goal is to raise GPA to 3.7 while working part time 15 hours a week.",
+        "The library closes at 10pm on weekdays.",
+        "Skill goal: learn React fundamentals over the next month.",
+    ]),
+    ("what skills should I learn for a machine learning internship", [
+        "Career goal: land a machine learning internship next summer.",
+        "Currently learning Python and NumPy, completed an intro statistics course.",
+        "Weekly chores: laundry on Sunday.",
+        "Chat: discussed building a portfolio project with scikit-learn and a public dataset.",
+        "Linear algebra and probability are core prerequisites for ML interviews.",
+        "Reminder: dentist appointment next Tuesday.",
+        "Enrolled in Database Systems this semester.",
+        "Interested in computer vision and deep learning with PyTorch.",
+    ]),
+]
+
+
+def spearman(a, b) -> float:
+    """Spearman rank correlation (no ties expected between float scores)"""
+    ra = np.argsort(np.argsort(a))
+    rb = np.argsort(np.argsort(b))
+    if len(a) < 2:
+        return 1.0
+    return float(np.corrcoef(ra, rb)[0, 1])
+
+
+def time_backend(model, runs: int):
+    """Per-call latencies in ms over all samples, after one warm-up pass"""
+    for query, docs in SAMPLES:
+        model.predict([(query, d) for d in docs])
+    latencies = []
+    for _ in range(runs):
+        for query, docs in SAMPLES:
+            started = time.perf_counter()
+            model.predict([(query, d) for d in docs])
+            latencies.append((time.perf_counter() - started) * 1000)
+    return np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reranker backends")
+    parser.add_argument("--runs", type=int, default=10, help="timed passes over the samples")
+    parser.add_argument("--onnx-file", default=None, help="ONNX export to test (default: RERANKER_ONNX_FILE)")
+    args = parser.parse_args()
+    if args.onnx_file:
+        reranker.RERANKER_ONNX_FILE = args.onnx_file
+
+    backends = {}
+    for name in ("torch", "onnx"):
+        started = time.perf_counter()
+        try:
+            backends[name] = reranker.load_reranker(name)
+        except Exception as e:
+            print(f"{name}: unavailable ({e})")
+            continue
+        print(f"{name}: loaded in {time.perf_counter() - started:.2f}s")
+    if not backends:
+        return
+
+    print(f"\nLatency per rerank call ({len(SAMPLES[0][1])} candidates, {args.runs} runs)")
+    for name, model in backends.items():
+        ms = time_backend(model, args.runs)
+        print(f"  {name:6s} mean {ms.mean():7.2f} ms   p50 {np.percentile(ms, 50):7.2f} ms   p95 {np.percentile(ms, 95):7.2f} ms")
+
+    if "torch" in backends and "onnx" in backends:
+        print("\nRanking agreement (onnx vs torch)")
+        for query, docs in SAMPLES:
+            pairs = [(query, d) for d in docs]
+            ref = np.asarray(backends["torch"].predict(pairs), dtype=np.float32)
+            test = np.asarray(backends["onnx"].predict(pairs), dtype=np.float32)
+            top3 = len(set(np.argsort(-ref)[:3]) & set(np.argsort(-test)[:3]))
+            print(f"  {query[:45]:45s} spearman {spearman(ref, test):.3f}   "
+                  f"top-1 {'same' if ref.argmax() == test.argmax() else 'DIFF'}   "
+                  f"top-3 overlap {top3}/3   max |score diff| {np.abs(ref - test).max():.4f}")
+
+
+if __name__ == "__main__":
+    main()
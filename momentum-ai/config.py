@@ -16,9 +16,88 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
 # Use Render persistent disk path in production, local path for development
 VECTOR_DIR = os.getenv("VECTOR_DIR", "/opt/render/project/src/chroma_db" if os.getenv("RENDER") else "./chroma_db")
+# Persistent embedding cache shared across workers/restarts: "sqlite" or "none".
+# Lives on the same persistent disk as the Chroma data by default
+EMBEDDING_STORE = os.getenv("EMBEDDING_STORE", "sqlite")
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", os.path.join(VECTOR_DIR, "embedding_cache.sqlite3"))
+EMBEDDING_STORE_MAX_MB = int(os.getenv("EMBEDDING_STORE_MAX_MB", "512"))
+# Where each user's context generation lives, so a write in one worker invalidates
+# cached retrieval results in all of them: "sqlite" (shared file) or "none" (this
+# process only; for a single worker). If the file can't be opened, context isn't cached.
+CONTEXT_GENERATION_STORE = os.getenv("CONTEXT_GENERATION_STORE", "sqlite")
+CONTEXT_GENERATION_PATH = os.getenv("CONTEXT_GENERATION_PATH", os.path.join(VECTOR_DIR, "context_generations.sqlite3"))
+# In-memory embedding cache: max entries and storage dtype ("float32", "float16" or "int8")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "40000"))
+EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float32").lower()
+# Chroma sharding: "none" (one shared collection), "user" (a collection per user)
+# or "bucket" (users hashed into CHROMA_SHARD_BUCKETS collections).
+# Existing data is moved with: python migrate_chroma_shards.py
+CHROMA_SHARDING = os.getenv("CHROMA_SHARDING", "none").lower()
+CHROMA_SHARD_BUCKETS = int(os.getenv("CHROMA_SHARD_BUCKETS", "64"))
+# Startup: WARMUP_ON_STARTUP loads the reranker, opens Chroma and loads other lazy
+# dependencies in the background after boot (/health answers 503 "warming" until
+# done). STARTUP_PROFILE prints how long imports and each warm-up step took.
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "false").lower() in ("1", "true", "yes")
+# Reranker: time budget per rerank (0 = no limit; over budget keeps vector-score
+# order) and max (query, doc) pairs scored in one batched forward pass
+RERANK_TIMEOUT_MS = float(os.getenv("RERANK_TIMEOUT_MS", "1500"))
+RERANK_MAX_BATCH_PAIRS = int(os.getenv("RERANK_MAX_BATCH_PAIRS", "64"))
+# Max cached (query, doc) rerank scores (LRU)
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+# Reranker backend: "torch" (sentence-transformers CrossEncoder) or "onnx" (ONNX Runtime,
+# no torch needed). RERANKER_ONNX_FILE picks the export from the model repo, e.g.
+# onnx/model.onnx (fp32) or onnx/model_quint8_avx2.onnx (int8-quantized, x86 AVX2)
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "torch").lower()
+RERANKER_ONNX_FILE = os.getenv("RERANKER_ONNX_FILE", "onnx/model.onnx")
+# Chat memory write-behind: flush after this many queued documents or this many ms
+CHAT_MEMORY_BATCH_SIZE = int(os.getenv("CHAT_MEMORY_BATCH_SIZE", "64"))
+CHAT_MEMORY_FLUSH_MS = float(os.getenv("CHAT_MEMORY_FLUSH_MS", "500"))
+# Prompt token budgets, in estimated Gemini tokens. By default ~4 characters per token
+# (Gemini's rule of thumb). PROMPT_TOKENIZER_PATH can point at a local Hugging Face
+# tokenizer.json (never downloaded); its counts are multiplied by PROMPT_TOKENIZER_SCALE,
+# Gemini tokens per tokenizer token, calibrated against the API's count_tokens.
+# The chat estimate covers the per-request context: structured context, memory,
+# syllabus and history.
+PROMPT_TOKENIZER_PATH = os.getenv("PROMPT_TOKENIZER_PATH", "")
+PROMPT_TOKENIZER_SCALE = float(os.getenv("PROMPT_TOKENIZER_SCALE", "1.0"))
+CHAT_CONTEXT_EST_TOKENS = int(os.getenv("CHAT_CONTEXT_EST_TOKENS", "4000"))
+# Rolling conversation summary: the chat prompt carries the session summary plus the
+# last CHAT_HISTORY_RAW_TURNS history messages; older messages are folded into the
+# summary in the background once CHAT_SUMMARY_EVERY of them are unsummarized
+CHAT_HISTORY_RAW_TURNS = int(os.getenv("CHAT_HISTORY_RAW_TURNS", "6"))
+CHAT_SUMMARY_EVERY = int(os.getenv("CHAT_SUMMARY_EVERY", "4"))
+# Semantic response cache for side-effect-free endpoints: a request whose normalized
+# inputs embed within SEMANTIC_CACHE_THRESHOLD cosine similarity of an earlier
+# request from the same user gets that response. TTLs are per endpoint (seconds).
+# Notification summaries are only reused for exactly the same notifications.
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "true").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.97"))
+SEMANTIC_CACHE_TTL_NOTIFICATIONS = int(os.getenv("SEMANTIC_CACHE_TTL_NOTIFICATIONS", "600"))
+SEMANTIC_CACHE_TTL_INSIGHTS = int(os.getenv("SEMANTIC_CACHE_TTL_INSIGHTS", "1800"))
+SEMANTIC_CACHE_TTL_SKILL_SUGGESTIONS = int(os.getenv("SEMANTIC_CACHE_TTL_SKILL_SUGGESTIONS", "3600"))
+# /plan and /rebalance build the schedule with the local planner (scheduler.local_plan)
+# for up to this many tasks and only ask the LLM for the summary (0 = always use the LLM)
+PLANNER_LOCAL_MAX_TASKS = int(os.getenv("PLANNER_LOCAL_MAX_TASKS", "40"))
+# Longest date range /plan/range plans in one request
+PLAN_RANGE_MAX_DAYS = int(os.getenv("PLAN_RANGE_MAX_DAYS", "31"))
+# Length of a class block when a class has a start time but no end time
+CLASS_DEFAULT_MINUTES = int(os.getenv("CLASS_DEFAULT_MINUTES", "60"))
 POLICY_MODEL_PATH = os.getenv("POLICY_MODEL_PATH", "./models/policy_model.pkl")
 TEMPERATURE = float(os.getenv("TEMPERATURE", "0.1"))
 PORT = int(os.getenv("PORT", "8001"))
+# Max concurrent in-flight Gemini calls per worker on the async client
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "32"))
+# Gemini context caching for static system instructions (the chat rules): the
+# instruction is uploaded once per model and referenced by name for
+# GEMINI_CONTEXT_CACHE_TTL_S seconds. If off or unavailable, it is sent inline.
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "true").lower() in ("1", "true", "yes")
+GEMINI_CONTEXT_CACHE_TTL_S = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_S", "3600"))
+# Embedding micro-batching: texts from concurrent callers are collected for up to
+# EMBEDDING_BATCH_WINDOW_MS (0 disables batching) or EMBEDDING_BATCH_MAX texts
+# (the embed_content per-request limit) and sent as one request
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+EMBEDDING_BATCH_MAX = int(os.getenv("EMBEDDING_BATCH_MAX", "100"))
 
 # CORS Configuration - restrict to specific origins for security
 # Use CORS_ORIGINS if set, otherwise fallback to default localhost origins
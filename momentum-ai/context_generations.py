@@ -0,0 +1,85 @@
+# context_generations.py - Per-user context generations shared by worker processes
+import os
+import sqlite3
+import threading
+from typing import Optional
+from config import CONTEXT_GENERATION_STORE, CONTEXT_GENERATION_PATH
+
+
+class SQLiteGenerationStore:
+    """
+    Each user's context generation: a counter bumped on every write to their
+    documents (see utils.invalidate_user_context). Kept in a small SQLite file so
+    a write handled by one worker invalidates cached context in all of them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # One connection per process, serialized by _lock. WAL lets other
+        # uvicorn workers read while one of them writes.
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS user_generations (
+                user_id TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def get(self, user_id: str) -> Optional[int]:
+        """A user's generation (0 if never bumped), or None if the store can't be read"""
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT generation FROM user_generations WHERE user_id = ?", (user_id,)
+                ).fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            print(f"Context generation store read error: {e}")
+            return None
+
+    def bump(self, user_id: str) -> Optional[int]:
+        """Increment a user's generation; returns the new value (None on error)"""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO user_generations (user_id, generation) VALUES (?, 1) "
+                    "ON CONFLICT(user_id) DO UPDATE SET generation = generation + 1",
+                    (user_id,)
+                )
+                self._conn.commit()
+                return self._conn.execute(
+                    "SELECT generation FROM user_generations WHERE user_id = ?", (user_id,)
+                ).fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Context generation store write error: {e}")
+            return None
+
+
+def _create_store():
+    """
+    Build the configured store. Returns (store, shared): store is None for "none"
+    (generations live in this process only) or if the shared store can't be opened;
+    shared is False in that last case, and context must then not be cached at all.
+    """
+    backend = (CONTEXT_GENERATION_STORE or "none").lower()
+    if backend == "none":
+        return None, True
+    if backend != "sqlite":
+        print(f"Warning: unknown CONTEXT_GENERATION_STORE '{CONTEXT_GENERATION_STORE}'. Context caching disabled.")
+        return None, False
+    try:
+        return SQLiteGenerationStore(CONTEXT_GENERATION_PATH), True
+    except Exception as e:
+        print(f"Warning: could not open context generation store at {CONTEXT_GENERATION_PATH}: {e}. Context caching disabled.")
+        return None, False
+
+
+# Global instance (None when per-process or unavailable); context_cache_enabled is
+# False when generations can't be shared as configured
+generation_store, context_cache_enabled = _create_store()
@@ -0,0 +1,135 @@
+# conversation_summary.py - Rolling summaries of long chat sessions
+import asyncio
+import hashlib
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple
+from cachetools import TTLCache
+from config import CHAT_HISTORY_RAW_TURNS, CHAT_SUMMARY_EVERY
+from database import get_user_collection
+from ai_client import acall_gemini_generate, agemini_embedding, to_chroma_embeddings
+from utils import invalidate_user_context
+
+
+class ConversationSummarizer:
+    """
+    Keeps one rolling summary per chat session, so the chat prompt carries the
+    summary plus the last raw_turns messages instead of the whole history.
+    Older messages are folded into the summary in the background, summarize_every
+    at a time, so each message is summarized once and the reply never waits on it.
+    Summaries are cached here and stored in ChromaDB next to the chat chunks
+    (type "chat_summary"), so other workers and restarts pick them up.
+    """
+
+    def __init__(self, raw_turns: int, summarize_every: int):
+        self.raw_turns = raw_turns
+        self.summarize_every = max(1, summarize_every)
+        # session key -> (covered message count, digest of those messages, summary)
+        self._summaries = TTLCache(maxsize=5000, ttl=86400)
+        self._tasks = {}  # session key -> running update (one per session)
+
+    @staticmethod
+    def session_key(user_id: str, history: List[dict], session_id: Optional[str] = None) -> str:
+        """The client's session_id, or a key derived from the session's opening messages"""
+        if session_id:
+            return hashlib.md5(f"{user_id}:{session_id}".encode('utf-8')).hexdigest()
+        return hashlib.md5(f"{user_id}:{ConversationSummarizer._digest(history[:2])}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _digest(messages: List[dict]) -> str:
+        pairs = [(m.get('role', 'user'), m.get('content', '')) for m in messages]
+        return hashlib.md5(json.dumps(pairs).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _doc_id(user_id: str, key: str) -> str:
+        return f"chat_summary_{user_id}_{key}"
+
+    async def _load(self, user_id: str, key: str) -> tuple:
+        """Cached summary for a session, falling back to the copy stored in ChromaDB"""
+        entry = self._summaries.get(key)
+        if entry is not None:
+            return entry
+        entry = (0, "", "")
+        try:
+            res = await asyncio.to_thread(
+                get_user_collection(user_id).get,
+                ids=[self._doc_id(user_id, key)],
+                include=["documents", "metadatas"]
+            )
+            if res['ids']:
+                meta = res['metadatas'][0] or {}
+                entry = (meta.get('covered_turns', 0), meta.get('covered_digest', ""), res['documents'][0])
+        except Exception as e:
+            print(f"Error loading conversation summary: {e}")
+        self._summaries[key] = entry
+        return entry
+
+    async def history_for_prompt(self, user_id: str, history: List[dict], session_id: Optional[str] = None) -> Tuple[str, List[dict]]:
+        """
+        Returns (summary, messages): the session summary ("" if there is none yet) and
+        the history messages it doesn't cover. Starts a background update once
+        enough messages older than the last raw_turns are unsummarized.
+        """
+        history = history or []
+        if len(history) <= self.raw_turns:
+            return "", history
+
+        key = self.session_key(user_id, history, session_id)
+        covered, digest, summary = await self._load(user_id, key)
+        # Ignore a summary of different messages (key collision or edited history)
+        if covered > len(history) or (covered and self._digest(history[:covered]) != digest):
+            covered, summary = 0, ""
+
+        older = len(history) - self.raw_turns
+        if older - covered >= self.summarize_every and key not in self._tasks:
+            task = asyncio.create_task(self._update(user_id, key, summary, covered, history[:older]))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+
+        return summary, history[covered:]
+
+    async def _update(self, user_id: str, key: str, summary: str, covered: int, messages: List[dict]) -> None:
+        """Fold messages[covered:] into summary, then cache and store the result"""
+        new_messages = "\n".join(
+            f"{m.get('role', 'user').capitalize()}: {m.get('content', '')}" for m in messages[covered:]
+        )
+        prompt = f"""Summarize this conversation between a student and the Momentum AI assistant so it can be used as context for later messages.
+Keep facts, decisions, numbers, dates, names, and anything the user asked to create or change. Drop greetings and small talk. At most 150 words.
+
+Summary so far:
+{summary or "(none)"}
+
+New messages:
+{new_messages}
+
+Updated summary:"""
+        try:
+            text = (await acall_gemini_generate(prompt, use_fast_model=True)).strip()
+            if not text or text.startswith("Error:"):
+                return
+            digest = self._digest(messages)
+            self._summaries[key] = (len(messages), digest, text)
+
+            embeddings = to_chroma_embeddings(await agemini_embedding([text]))
+            await asyncio.to_thread(
+                get_user_collection(user_id).upsert,
+                ids=[self._doc_id(user_id, key)],
+                documents=[text],
+                embeddings=embeddings,
+                metadatas=[{
+                    "user_id": user_id,
+                    "type": "chat_summary",
+                    "session": key,
+                    "covered_turns": len(messages),
+                    "covered_digest": digest,
+                    "timestamp": datetime.now().isoformat()
+                }]
+            )
+            invalidate_user_context(user_id)
+            print(f"Updated conversation summary ({len(messages)} messages covered)")
+        except Exception as e:
+            print(f"Error updating conversation summary: {e}")
+
+
+# Global instance
+conversation_summarizer = ConversationSummarizer(CHAT_HISTORY_RAW_TURNS, CHAT_SUMMARY_EVERY)
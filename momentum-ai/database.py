@@ -3,15 +3,84 @@ import os
 # Disable ChromaDB telemetry before importing chromadb
 os.environ["ANONYMIZED_TELEMETRY"] = "False"
 
-import chromadb
-from config import VECTOR_DIR
+import hashlib
+import threading
+from config import VECTOR_DIR, CHROMA_SHARDING, CHROMA_SHARD_BUCKETS
 
-# Chroma client (updated for new API) with telemetry disabled
-chroma_client = chromadb.PersistentClient(path=VECTOR_DIR)
 COLLECTION_NAME = "momentum_docs"
 
-try:
-    collection = chroma_client.get_collection(name=COLLECTION_NAME)
-except:
-    collection = chroma_client.create_collection(name=COLLECTION_NAME)
+# Chroma client and shared collection are opened on first use (or during startup
+# warm-up) rather than at import, which keeps chromadb off the cold-start path.
+# `from database import chroma_client, collection` still works via __getattr__.
+_chroma_client = None
+_collection = None
+_open_lock = threading.Lock()
 
+
+def get_collection():
+    """Open the Chroma client and shared collection if needed and return the collection"""
+    global _chroma_client, _collection
+    if _collection is None:
+        with _open_lock:
+            if _collection is None:
+                import chromadb
+                # Chroma client (updated for new API) with telemetry disabled
+                _chroma_client = chromadb.PersistentClient(path=VECTOR_DIR)
+                try:
+                    _collection = _chroma_client.get_collection(name=COLLECTION_NAME)
+                except:
+                    _collection = _chroma_client.create_collection(name=COLLECTION_NAME)
+    return _collection
+
+
+def __getattr__(name):
+    if name == "collection":
+        return get_collection()
+    if name == "chroma_client":
+        get_collection()
+        return _chroma_client
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+if CHROMA_SHARDING not in ("none", "user", "bucket"):
+    print(f"Warning: unknown CHROMA_SHARDING '{CHROMA_SHARDING}'. Using the shared collection.")
+
+# Shard collections opened so far: name -> Collection
+_shard_handles = {}
+_shard_lock = threading.Lock()
+
+
+def shard_name(user_id: str) -> str:
+    """
+    Name of the collection holding user_id's documents.
+    User IDs are hashed so any ID yields a valid Chroma collection name.
+    """
+    digest = hashlib.md5(str(user_id).encode('utf-8')).hexdigest()
+    if CHROMA_SHARDING == "user":
+        return f"{COLLECTION_NAME}_u_{digest}"
+    if CHROMA_SHARDING == "bucket":
+        return f"{COLLECTION_NAME}_b{int(digest, 16) % CHROMA_SHARD_BUCKETS:03d}"
+    return COLLECTION_NAME
+
+
+def get_user_collection(user_id: str):
+    """
+    Collection to read and write user_id's documents in.
+    With sharding off this is the shared collection. Otherwise the user's shard
+    is created on first use (same settings as the shared collection) and its
+    handle cached. Keep filtering on user_id: bucket shards hold several users.
+    """
+    collection = get_collection()
+    name = shard_name(user_id)
+    if name == COLLECTION_NAME:
+        return collection
+    handle = _shard_handles.get(name)
+    if handle is None:
+        with _shard_lock:
+            handle = _shard_handles.get(name)
+            if handle is None:
+                handle = _chroma_client.get_or_create_collection(
+                    name=name,
+                    metadata=collection.metadata
+                )
+                _shard_handles[name] = handle
+    return handle
@@ -0,0 +1,149 @@
+# embedding_store.py - Persistent second-tier embedding cache
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+import numpy as np
+from config import EMBEDDING_STORE, EMBEDDING_STORE_PATH, EMBEDDING_STORE_MAX_MB
+
+
+class SQLiteEmbeddingStore:
+    """
+    Disk-backed embedding cache shared by every worker process and kept across restarts.
+    Vectors are stored as float32 blobs keyed by "<model>:<text md5>".
+    When the live data grows past max_bytes, the least recently used rows are evicted.
+    """
+
+    # Run the size check after this many writes instead of on every put
+    EVICTION_CHECK_INTERVAL = 200
+    # Evict down to this fraction below max_bytes
+    EVICTION_HEADROOM = 0.1
+    # Stay under SQLite's bound-parameter limit (999 on older builds)
+    MAX_QUERY_KEYS = 500
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._writes_since_check = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # One connection per process, serialized by _lock. WAL lets other
+        # uvicorn workers read while one of them writes.
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                vec BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)"
+        )
+        self._conn.commit()
+
+    def get_many(self, model: str, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Return {key: float32 embedding} for the keys present in the store"""
+        if not keys:
+            return {}
+        store_keys = {f"{model}:{key}": key for key in keys}
+        lookup = list(store_keys)
+        found = {}
+        try:
+            with self._lock:
+                rows = []
+                for i in range(0, len(lookup), self.MAX_QUERY_KEYS):
+                    batch = lookup[i:i + self.MAX_QUERY_KEYS]
+                    rows.extend(self._conn.execute(
+                        f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                        batch
+                    ).fetchall())
+                if rows:
+                    # Touch hits so eviction stays least-recently-used
+                    now = time.time()
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                        [(now, row[0]) for row in rows]
+                    )
+                    self._conn.commit()
+            for store_key, blob in rows:
+                found[store_keys[store_key]] = np.frombuffer(blob, dtype=np.float32)
+        except sqlite3.Error as e:
+            print(f"Embedding store read error: {e}")
+        return found
+
+    def put_many(self, model: str, items: Dict[str, np.ndarray]) -> None:
+        """Insert or replace embeddings for the given keys"""
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, emb in items.items():
+            vec = np.asarray(emb, dtype=np.float32)
+            rows.append((f"{model}:{key}", int(vec.shape[0]), vec.tobytes(), now))
+        try:
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, dim, vec, last_access) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.commit()
+                self._writes_since_check += len(rows)
+                if self._writes_since_check >= self.EVICTION_CHECK_INTERVAL:
+                    self._writes_since_check = 0
+                    self._evict_if_needed()
+        except sqlite3.Error as e:
+            print(f"Embedding store write error: {e}")
+
+    def _live_bytes(self) -> int:
+        """Bytes used by live pages (freed pages are reused, so the file itself never shrinks)"""
+        page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+        page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        return (page_count - freelist_count) * page_size
+
+    def _evict_if_needed(self) -> None:
+        """Drop least recently used rows until the store is back under max_bytes (caller holds _lock)"""
+        live = self._live_bytes()
+        evicted = 0
+        while live > self.max_bytes:
+            total = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if total == 0:
+                break
+            # Remove the overshoot plus some headroom so we don't evict on every check
+            target = self.max_bytes * (1 - self.EVICTION_HEADROOM)
+            batch = max(1, int(total * (1 - target / live)) + 1)
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (batch,)
+            )
+            self._conn.commit()
+            evicted += batch
+            live = self._live_bytes()
+        if evicted:
+            print(f"Embedding store: evicted {evicted} least recently used embeddings")
+
+
+def _create_store() -> Optional[SQLiteEmbeddingStore]:
+    """Build the configured store backend ("sqlite" or "none")"""
+    backend = (EMBEDDING_STORE or "none").lower()
+    if backend == "none":
+        return None
+    if backend != "sqlite":
+        print(f"Warning: unknown EMBEDDING_STORE '{EMBEDDING_STORE}'. Persistent embedding cache disabled.")
+        return None
+    try:
+        return SQLiteEmbeddingStore(EMBEDDING_STORE_PATH, EMBEDDING_STORE_MAX_MB * 1024 * 1024)
+    except Exception as e:
+        print(f"Warning: could not open embedding store at {EMBEDDING_STORE_PATH}: {e}. Persistent embedding cache disabled.")
+        return None
+
+
+# Global instance (None when disabled)
+embedding_store = _create_store()
@@ -0,0 +1,111 @@
+# memory_writer.py - Write-behind queue for chat memory
+import asyncio
+from collections import defaultdict
+from config import CHAT_MEMORY_BATCH_SIZE, CHAT_MEMORY_FLUSH_MS
+from database import get_user_collection, shard_name
+from ai_client import agemini_embedding, to_chroma_embeddings
+from utils import invalidate_user_context
+
+
+class ChatMemoryWriter:
+    """
+    Persists chat memory off the response path.
+    Routes enqueue documents and return immediately; a background task embeds
+    everything queued (from all users) in one call and writes it with one
+    collection.add per collection. A flush happens once batch_size documents are
+    waiting or flush_interval seconds after the first one arrived.
+    drain() writes whatever is left (called on shutdown).
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []  # [(user_id, doc_id, text, meta)]
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        # Held while a batch is out of the queue but not yet written
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    def enqueue(self, user_id: str, ids: list, documents: list, metadatas: list) -> None:
+        """Queue documents for a user (must be called on the event loop)"""
+        for doc_id, text, meta in zip(ids, documents, metadatas):
+            self._pending.append((user_id, doc_id, text, meta))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._has_items.set()
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_items.wait()
+            # Give more writes time to arrive unless the batch is already full
+            if len(self._pending) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush()
+
+    async def _flush(self) -> None:
+        async with self._flush_lock:
+            await self._write_next_batch()
+
+    async def _write_next_batch(self) -> None:
+        batch = self._pending[:self.batch_size]
+        del self._pending[:self.batch_size]
+        if len(self._pending) < self.batch_size:
+            self._full.clear()
+        if not self._pending:
+            self._has_items.clear()
+        if not batch:
+            return
+
+        try:
+            # One embedding call for every user's documents
+            embeddings = to_chroma_embeddings(await agemini_embedding([text for _, _, text, _ in batch]))
+
+            # One add per collection (a single add unless Chroma sharding is on)
+            groups = defaultdict(lambda: {"user_id": None, "ids": [], "documents": [], "embeddings": [], "metadatas": []})
+            for (user_id, doc_id, text, meta), emb in zip(batch, embeddings):
+                group = groups[shard_name(user_id)]
+                group["user_id"] = user_id
+                group["ids"].append(doc_id)
+                group["documents"].append(text)
+                group["embeddings"].append(emb)
+                group["metadatas"].append(meta)
+            for group in groups.values():
+                await asyncio.to_thread(
+                    get_user_collection(group["user_id"]).add,
+                    ids=group["ids"],
+                    documents=group["documents"],
+                    embeddings=group["embeddings"],
+                    metadatas=group["metadatas"]
+                )
+
+            # New chat memory changes what retrieval should return
+            for user_id in {user_id for user_id, _, _, _ in batch}:
+                invalidate_user_context(user_id)
+        except Exception as e:
+            print(f"Error storing chat conversations ({len(batch)} documents): {e}")
+
+    async def drain(self) -> None:
+        """Stop the background task and write everything still queued"""
+        if self._task is not None:
+            # Let an in-progress write finish, then stop the task while it's idle
+            async with self._flush_lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pending:
+            print(f"Flushing {len(self._pending)} queued chat memory documents")
+        while self._pending:
+            await self._flush()
+
+
+# Global instance
+chat_memory_writer = ChatMemoryWriter(CHAT_MEMORY_BATCH_SIZE, CHAT_MEMORY_FLUSH_MS / 1000.0)
@@ -0,0 +1,77 @@
+# migrate_chroma_shards.py
+"""
+Move documents from the shared momentum_docs collection into per-user shards.
+
+Run after setting CHROMA_SHARDING=user or CHROMA_SHARDING=bucket (and, for
+bucket mode, the final CHROMA_SHARD_BUCKETS) while the service is stopped:
+
+    python migrate_chroma_shards.py             # copy into shards
+    python migrate_chroma_shards.py --delete    # copy, then remove from the shared collection
+
+Documents are copied with their stored embeddings, so nothing is re-embedded.
+Copies use upsert, so an interrupted run can simply be repeated.
+Documents without a user_id stay in the shared collection.
+"""
+import argparse
+from collections import defaultdict
+from config import CHROMA_SHARDING
+from database import collection, get_user_collection, shard_name, COLLECTION_NAME
+
+PAGE_SIZE = 500
+
+
+def migrate(delete_source: bool = False):
+    if CHROMA_SHARDING not in ("user", "bucket"):
+        print("CHROMA_SHARDING is not 'user' or 'bucket' - nothing to migrate.")
+        return
+
+    total = collection.count()
+    print(f"Migrating {total} documents from '{COLLECTION_NAME}' (CHROMA_SHARDING={CHROMA_SHARDING})")
+
+    moved_ids = []
+    skipped = 0
+    shard_counts = defaultdict(int)
+
+    # Page through the shared collection; the source isn't modified until the end
+    for offset in range(0, total, PAGE_SIZE):
+        page = collection.get(
+            limit=PAGE_SIZE,
+            offset=offset,
+            include=["documents", "metadatas", "embeddings"]
+        )
+
+        # Group the page by user so each shard gets one upsert
+        by_user = defaultdict(lambda: {"ids": [], "documents": [], "metadatas": [], "embeddings": []})
+        for doc_id, doc, meta, emb in zip(page['ids'], page['documents'], page['metadatas'], page['embeddings']):
+            user_id = (meta or {}).get('user_id')
+            if not user_id:
+                skipped += 1
+                continue
+            batch = by_user[user_id]
+            batch["ids"].append(doc_id)
+            batch["documents"].append(doc)
+            batch["metadatas"].append(meta)
+            batch["embeddings"].append(emb)
+
+        for user_id, batch in by_user.items():
+            get_user_collection(user_id).upsert(**batch)
+            shard_counts[shard_name(user_id)] += len(batch["ids"])
+            moved_ids.extend(batch["ids"])
+
+        print(f"  {min(offset + PAGE_SIZE, total)}/{total} processed")
+
+    print(f"Copied {len(moved_ids)} documents into {len(shard_counts)} shard collections")
+    if skipped:
+        print(f"Left {skipped} documents without user_id in '{COLLECTION_NAME}'")
+
+    if delete_source and moved_ids:
+        for i in range(0, len(moved_ids), PAGE_SIZE):
+            collection.delete(ids=moved_ids[i:i + PAGE_SIZE])
+        print(f"Deleted {len(moved_ids)} migrated documents from '{COLLECTION_NAME}'")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move momentum_docs into per-user Chroma shards")
+    parser.add_argument("--delete", action="store_true", help="remove migrated documents from the shared collection")
+    args = parser.parse_args()
+    migrate(delete_source=args.delete)
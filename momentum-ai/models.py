@@ -38,6 +38,10 @@ class Task(BaseModel):
     daysAllocated: Optional[int] = None
     currentDay: Optional[int] = None
     sourceId: Optional[str] = None
+    # Class schedule entries (PlanRequest.classes) carry their slot as day + "HH:MM" times
+    day: Optional[str] = None
+    time: Optional[str] = None
+    end_time: Optional[str] = None
     
     @model_validator(mode='before')
     @classmethod
@@ -78,6 +82,28 @@ class PlanResponse(BaseModel):
     shifted_tasks: List[dict] = []  # Tasks shifted to next day with new dates
     metadata: dict
 
+class PlanRangeRequest(BaseModel):
+    user_id: str
+    start_date_iso: str
+    end_date_iso: str  # Inclusive
+    available_times: List[TimeRange] = []  # Windows on any day of the range
+    tasks: List[Task]
+    classes: Optional[List[Task]] = []
+    preferences: Optional[dict] = {}
+    user_profile: Optional[dict] = {}
+    task_patterns: Optional[List[dict]] = []
+    completion_history: Optional[dict] = {}
+
+class PlanRangeResponse(BaseModel):
+    user_id: str
+    start_date_iso: str
+    end_date_iso: str
+    summary: str
+    suggestions: List[str]
+    days: List[PlanResponse]
+    shifted_tasks: List[dict] = []  # Tasks shifted past the end of the range
+    metadata: dict
+
 class CompleteReq(BaseModel):
     user_id: str
     task_id: str
@@ -108,6 +134,7 @@ class ChatRequest(BaseModel):
     message: str
     conversation_history: Optional[List[dict]] = []
     structured_context: Optional[str] = None
+    session_id: Optional[str] = None  # Stable id of the chat session (keys the rolling summary)
 
 class ChatAction(BaseModel):
     type: str  # "update_user", "add_course", "add_skill", etc.
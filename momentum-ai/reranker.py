@@ -0,0 +1,236 @@
+# reranker.py - Cross-encoder reranking service
+import hashlib
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import List, Optional, Tuple
+import numpy as np
+from cachetools import LRUCache
+from config import RERANK_TIMEOUT_MS, RERANK_MAX_BATCH_PAIRS, RERANK_CACHE_SIZE, RERANKER_BACKEND, RERANKER_ONNX_FILE
+
+RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANKER_MAX_LENGTH = 512
+
+# Lazy import for reranker (only load when needed)
+_reranker = None
+_reranker_lock = threading.Lock()
+
+# Score cache: (query hash, text hash) -> score. Follow-up questions rerank the
+# same memory chunks against near-identical queries, so most pairs repeat.
+# Keys are content hashes, so edited or re-ingested text never hits a stale score.
+_score_cache = LRUCache(maxsize=RERANK_CACHE_SIZE)
+_score_cache_lock = threading.Lock()
+
+
+class OnnxCrossEncoder:
+    """
+    The same cross-encoder run through ONNX Runtime instead of PyTorch.
+    Uses the ONNX export and tokenizer.json published in the model repo, so neither
+    torch nor sentence-transformers is needed. predict() matches CrossEncoder.predict
+    for this model: one score per (query, text) pair, same activation.
+    """
+
+    def __init__(self, model_name: str, onnx_file: str, max_length: int = RERANKER_MAX_LENGTH):
+        import json
+        import onnxruntime as ort
+        from huggingface_hub import hf_hub_download
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(hf_hub_download(model_name, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            hf_hub_download(model_name, onnx_file),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        # Same default activation rule as sentence-transformers' CrossEncoder
+        with open(hf_hub_download(model_name, "config.json"), encoding="utf-8") as f:
+            model_config = json.load(f)
+        activation = model_config.get("sbert_ce_default_activation_function")
+        num_labels = len(model_config.get("id2label") or {0: 0, 1: 1})  # transformers defaults to 2
+        self.apply_sigmoid = "Sigmoid" in activation if activation else num_labels == 1
+
+    def predict(self, pairs, batch_size: int = 32) -> np.ndarray:
+        scores = []
+        for i in range(0, len(pairs), batch_size):
+            encodings = self.tokenizer.encode_batch([tuple(p) for p in pairs[i:i + batch_size]])
+            feeds = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            logits = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+            scores.append(logits[:, 0])
+        scores = np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+        if self.apply_sigmoid:
+            scores = 1 / (1 + np.exp(-scores))
+        return scores
+
+
+def load_reranker(backend: str):
+    """Build the reranker for a backend ("torch" or "onnx"); raises if it can't be loaded"""
+    if backend == "onnx":
+        return OnnxCrossEncoder(RERANKER_MODEL, RERANKER_ONNX_FILE)
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(RERANKER_MODEL)
+
+
+def get_reranker():
+    """Lazy load reranker to avoid loading on import (False if unavailable)"""
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                backend = RERANKER_BACKEND if RERANKER_BACKEND in ("torch", "onnx") else "torch"
+                if backend == "onnx":
+                    try:
+                        _reranker = load_reranker("onnx")
+                        print(f"Reranker model loaded successfully (ONNX Runtime, {RERANKER_ONNX_FILE})")
+                        return _reranker
+                    except Exception as e:
+                        print(f"Warning: ONNX reranker unavailable ({e}). Falling back to PyTorch.")
+                try:
+                    _reranker = load_reranker("torch")
+                    print("Reranker model loaded successfully")
+                except ImportError:
+                    print("Warning: sentence-transformers not installed. Reranking disabled.")
+                    print("Install with: pip install sentence-transformers")
+                    _reranker = False  # Mark as unavailable
+    return _reranker
+
+
+class RerankerService:
+    """
+    Runs the cross-encoder on one dedicated worker thread that owns the model.
+    Requests queue up while a forward pass is running and the next pass scores
+    all of them together (up to max_batch_pairs pairs), so concurrent requests
+    share batches instead of contending for the CPU. The forward pass releases
+    the GIL, so the event loop and other request threads keep running.
+    """
+
+    def __init__(self, max_batch_pairs: int):
+        self.max_batch_pairs = max_batch_pairs
+        self._pending = []  # [(pairs, Future)]
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, pairs: List[Tuple[str, str]]) -> Future:
+        """Queue pairs for scoring. The future resolves to a list of scores (or None if unavailable)."""
+        fut = Future()
+        with self._cond:
+            self._pending.append((pairs, fut))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="reranker", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return fut
+
+    def score(self, pairs: List[Tuple[str, str]], timeout: Optional[float]) -> Optional[List[float]]:
+        """
+        Score (query, text) pairs, waiting at most timeout seconds (None waits indefinitely).
+        Returns None if the reranker is unavailable or the budget runs out;
+        callers should then keep their existing order.
+        """
+        if not pairs or _reranker is False:
+            return None
+        fut = self.submit(pairs)
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Skip the work if it hasn't started yet
+            fut.cancel()
+            print(f"Reranking skipped: exceeded {timeout:.2f}s budget")
+            return None
+
+    def _next_batch(self):
+        """Take queued requests until the pair budget is used (always at least one)"""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            batch = []
+            total = 0
+            while self._pending:
+                pairs, fut = self._pending[0]
+                if batch and total + len(pairs) > self.max_batch_pairs:
+                    break
+                self._pending.pop(0)
+                if fut.set_running_or_notify_cancel():
+                    batch.append((pairs, fut))
+                    total += len(pairs)
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue  # Everything taken was cancelled
+            try:
+                # Loading happens here on first use, so callers fall back instead of stalling
+                model = get_reranker()
+                if model is False:
+                    for _, fut in batch:
+                        fut.set_result(None)
+                    continue
+                started = time.perf_counter()
+                scores = model.predict([pair for pairs, _ in batch for pair in pairs])
+                elapsed = time.perf_counter() - started
+                if len(batch) > 1:
+                    print(f"Reranked {len(batch)} requests ({len(scores)} pairs) in one batch, {elapsed:.2f}s")
+                offset = 0
+                for pairs, fut in batch:
+                    fut.set_result([float(s) for s in scores[offset:offset + len(pairs)]])
+                    offset += len(pairs)
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+
+
+# Global instance
+reranker_service = RerankerService(RERANK_MAX_BATCH_PAIRS)
+
+
+def _hash(text: str) -> str:
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def rerank_scores(query: str, texts: List[str]) -> Optional[List[float]]:
+    """
+    Cross-encoder scores for texts against query within RERANK_TIMEOUT_MS, or None.
+    Cached pairs are answered from _score_cache; only the rest go to the model.
+    """
+    # The model's tokenizer is uncased, so case and spacing don't change the score
+    query_hash = _hash(' '.join(query.lower().split()))
+    keys = [(query_hash, _hash(text)) for text in texts]
+
+    scores = {}
+    with _score_cache_lock:
+        for key in keys:
+            if key in _score_cache:
+                scores[key] = _score_cache[key]
+
+    missing = {}  # key -> text (deduplicated)
+    for key, text in zip(keys, texts):
+        if key not in scores:
+            missing.setdefault(key, text)
+    if missing:
+        timeout = RERANK_TIMEOUT_MS / 1000.0 if RERANK_TIMEOUT_MS > 0 else None
+        new_scores = reranker_service.score([(query, text) for text in missing.values()], timeout)
+        if new_scores is None:
+            return None
+        with _score_cache_lock:
+            for key, score in zip(missing, new_scores):
+                _score_cache[key] = score
+                scores[key] = score
+
+    return [scores[key] for key in keys]
+
+
+def warm_up_reranker() -> None:
+    """Load the model on the worker thread and run one forward pass (used by startup warm-up)"""
+    reranker_service.score([("warm up", "warm up")], timeout=None)
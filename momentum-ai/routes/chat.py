@@ -1,15 +1,22 @@
 # routes/chat.py
+import asyncio
 import json
 import re
 import traceback
 import uuid
 from datetime import datetime, timedelta
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from models import ChatRequest, ChatResponse, ChatAction, GenerateSyllabusTasksRequest, GenerateSyllabusTasksResponse, SyllabusTask
-from database import collection
-from ai_client import call_gemini_generate, gemini_embedding
-from utils import retrieve_user_context, determine_optimal_k, determine_context_types, summarize_long_context, filter_syllabus_by_chapters
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from ai_client import acall_gemini_generate, astream_gemini_generate
+from action_parser import ActionStreamParser, parse_actions
+from memory_writer import chat_memory_writer
+from conversation_summary import conversation_summarizer
+from websocket_manager import ws_manager
+from utils import aretrieve_user_context, aretrieve_many, determine_optimal_k, determine_context_types, filter_syllabus_by_chapters
+from token_budget import allocate_budgets, count_tokens, pack_documents, pack_recent, truncate_to_tokens
+from config import CHAT_CONTEXT_EST_TOKENS
 
 # Try to import dateutil, fallback to manual parsing
 try:
@@ -19,213 +26,33 @@ except ImportError:
     HAS_DATEUTIL = False
     print("Warning: python-dateutil not installed. Date parsing may be limited.")
 
-# Text splitter for long conversations (smaller chunks for chat context)
-conversation_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=500,  # Smaller chunks for conversations
-    chunk_overlap=50,  # Small overlap for context
-    length_function=len
-)
+# Text splitter for long conversations, created on first use (langchain is slow to import)
+_conversation_splitter = None
+
+def get_conversation_splitter():
+    """Lazy load the conversation splitter to keep langchain off the startup path"""
+    global _conversation_splitter
+    if _conversation_splitter is None:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        # Smaller chunks for chat context
+        _conversation_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=500,  # Smaller chunks for conversations
+            chunk_overlap=50,  # Small overlap for context
+            length_function=len
+        )
+    return _conversation_splitter
 
 router = APIRouter()
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat(req: ChatRequest):
-    """Chat with AI assistant using user context from ChromaDB"""
-    try:
-        # OPTIMIZED: Query-specific context retrieval to prevent overcontext
-        # Use the actual user message as query for better semantic matching
-        context_query = req.message
-        
-        # Determine optimal k based on query complexity (prevents overcontext for simple queries)
-        optimal_k = determine_optimal_k(req.message)
-        
-        # Determine relevant context types based on query (prevents retrieving irrelevant types)
-        allowed_types = determine_context_types(req.message)
-        
-        # Retrieve context with anti-overfitting measures:
-        # - Similarity threshold (min_similarity=0.65) - only relevant docs
-        # - Recency weighting (20% weight) - prioritize recent context
-        # - Context length limit (2000 chars) - prevent token bloat
-        # - Type filtering - only relevant document types
-        # - Deduplication - remove similar documents
-        context_docs = retrieve_user_context(
-            req.user_id, 
-            context_query,
-            k=optimal_k,
-            min_similarity=0.65,  # Only include docs with >65% similarity
-            max_context_length=2000,  # Limit total context to prevent token bloat
-            recency_weight=0.2,  # 20% weight for recency, 80% for relevance
-            allowed_types=allowed_types,
-            deduplicate=True
-        )
-        
-        # Build context text from retrieved documents
-        # Documents are already sorted by combined_score (relevance + recency)
-        context_text = "\n\n".join([d['text'] for d in context_docs]) if context_docs else ""
-        
-        # Detect exam mentions and retrieve relevant syllabus
-        syllabus_context = ""
-        exam_info = None
-        
-        # Check if message mentions exam (midterm, final, quiz, exam)
-        exam_keywords = ['midterm', 'mid term', 'final', 'quiz', 'exam', 'test', 'assessment']
-        message_lower = req.message.lower()
-        has_exam_mention = any(keyword in message_lower for keyword in exam_keywords)
-        
-        if has_exam_mention:
-            # Extract exam date
-            exam_date = None
-            date_patterns = [
-                r'(?:on|for|by)\s+(\w+\s+\d{1,2}(?:st|nd|rd|th)?(?:\s+\d{4})?)',  # "on Nov 15" or "on November 15, 2025"
-                r'(\d{1,2}[/-]\d{1,2}(?:[/-]\d{2,4})?)',  # "11/15" or "11/15/2025"
-                r'(\w+\s+\d{1,2})',  # "Nov 15"
-            ]
-            
-            for pattern in date_patterns:
-                match = re.search(pattern, req.message, re.IGNORECASE)
-                if match:
-                    try:
-                        if HAS_DATEUTIL:
-                            exam_date = date_parser.parse(match.group(1), fuzzy=True)
-                        else:
-                            # Simple fallback parsing
-                            date_str = match.group(1)
-                            # Try common formats
-                            try:
-                                exam_date = datetime.strptime(date_str, "%m/%d/%Y")
-                            except:
-                                try:
-                                    exam_date = datetime.strptime(date_str, "%m/%d")
-                                    # Assume current year
-                                    exam_date = exam_date.replace(year=datetime.now().year)
-                                except:
-                                    pass
-                        if exam_date:
-                            break
-                    except:
-                        pass
-            
-            # Extract course name from message or structured context
-            course_name = None
-            course_id = None
-            if req.structured_context:
-                # Try to extract course from structured context
-                try:
-                    # Look for course mentions in the message
-                    course_pattern = r'(?:for|in|of)\s+([A-Z][a-zA-Z\s]+?)(?:\s+covering|\s+chapters|\s+on|$)'
-                    course_match = re.search(course_pattern, req.message, re.IGNORECASE)
-                    if course_match:
-                        course_name = course_match.group(1).strip()
-                except:
-                    pass
-            
-            # Extract chapters from message
-            chapters = None
-            chapter_patterns = [
-                r'chapter[s]?\s*(\d+(?:\s*[-–]\s*\d+)?)',  # "chapters 1-5"
-                r'chapter[s]?\s*(\d+(?:\s*,\s*\d+)*)',  # "chapters 1, 2, 3"
-                r'ch\.?\s*(\d+)',  # "ch. 1"
-            ]
-            
-            for pattern in chapter_patterns:
-                matches = re.findall(pattern, message_lower)
-                if matches:
-                    chapters = []
-                    for match in matches:
-                        if '-' in match or '–' in match:
-                            range_parts = re.split(r'[-–]', match)
-                            if len(range_parts) == 2:
-                                try:
-                                    start = int(range_parts[0].strip())
-                                    end = int(range_parts[1].strip())
-                                    chapters.extend([str(i) for i in range(start, end + 1)])
-                                except:
-                                    pass
-                        elif ',' in match:
-                            chapters.extend([c.strip() for c in match.split(',')])
-                        else:
-                            chapters.append(match.strip())
-                    break
-            
-            # If we have course info, try to retrieve syllabus
-            if course_name or course_id:
-                # Try to find course_id from structured context
-                # For now, we'll retrieve syllabus for all courses and filter by course name
-                # This is a simplified approach - in production, you'd match course_id from context
-                try:
-                    # Get syllabus chunks filtered by chapters
-                    # Note: We need course_id, but we can try to find it from context
-                    # For now, retrieve syllabus with type filter and let semantic search find relevant ones
-                    syllabus_docs = retrieve_user_context(
-                        req.user_id,
-                        f"{req.message} {course_name or ''}",
-                        k=5,
-                        min_similarity=0.6,
-                        allowed_types=["syllabus"],
-                        deduplicate=True
-                    )
-                    
-                    if syllabus_docs:
-                        # Filter by chapters if specified
-                        if chapters:
-                            filtered_syllabus = []
-                            for doc in syllabus_docs:
-                                doc_lower = doc['text'].lower()
-                                if any(
-                                    f"chapter {ch}" in doc_lower or 
-                                    f"ch. {ch}" in doc_lower or
-                                    ch in doc_lower
-                                    for ch in chapters
-                                ):
-                                    filtered_syllabus.append(doc)
-                            syllabus_docs = filtered_syllabus if filtered_syllabus else syllabus_docs
-                        
-                        syllabus_context = "\n\n".join([d['text'] for d in syllabus_docs[:3]])  # Limit to top 3 chunks
-                        exam_info = {
-                            'date': exam_date,
-                            'course': course_name,
-                            'chapters': chapters
-                        }
-                except Exception as e:
-                    print(f"Error retrieving syllabus: {e}")
-        
-        # Summarize if context is too long (prevent token bloat)
-        context_text = summarize_long_context(context_text, max_length=2000)
-        
-        # Build conversation history string
-        conversation_str = ""
-        if req.conversation_history:
-            for msg in req.conversation_history:
-                role = msg.get('role', 'user')
-                content = msg.get('content', '')
-                conversation_str += f"{role.capitalize()}: {content}\n"
-        
-        # Build prompt with user context
-        user_name_part = f" (User's name: {req.user_name})" if req.user_name else ""
-        
-        # Combine structured context from PostgreSQL with unstructured from ChromaDB
-        full_context = ""
-        if req.structured_context:
-            full_context += f"Structured Information:\n{req.structured_context}\n\n"
-        if context_text:
-            full_context += f"Additional Context from Memory:\n{context_text}"
-        if syllabus_context:
-            full_context += f"\n\nRelevant Syllabus Content:\n{syllabus_context}"
-        
-        # Build personalized prompt with structured instructions
-        name_greeting = f"Hi {req.user_name}!" if req.user_name else "Hello!"
-        first_name = req.user_name.split()[0] if req.user_name else "there"
-        personalization_note = f"\n\nPERSONALIZATION: The user's name is {req.user_name}. Always use their name naturally in conversation to make it feel personal and friendly, like ChatGPT does. For example: 'Hi {first_name}!' or 'That's great, {first_name}!'" if req.user_name else ""
-        
-        # Get current date for prompt
-        current_date_iso = datetime.now().strftime('%Y-%m-%d')
-        current_date_readable = datetime.now().strftime('%B %d, %Y')
-        current_day = datetime.now().strftime('%A')
-        
-        # Optimized prompt - concise and direct for faster responses
-        prompt = f"""Momentum AI Assistant. {name_greeting} Be friendly and concise.
+# Share of CHAT_CONTEXT_EST_TOKENS per prompt section (before surplus is redistributed)
+CHAT_SECTION_WEIGHTS = {"structured": 0.4, "memory": 0.25, "syllabus": 0.15, "history": 0.2}
 
-CURRENT DATE: Today is {current_date_readable} ({current_day}). The date in YYYY-MM-DD format is {current_date_iso}.
+# Static part of the chat prompt: identical on every turn, so it is sent as a system
+# instruction through Gemini context caching (uploaded once per model) instead of
+# being re-sent as fresh input tokens. Everything per-request (date, name, context,
+# history, message) goes in the prompt built by _build_chat_prompt.
+CHAT_SYSTEM_INSTRUCTION = """Momentum AI Assistant. Be friendly and concise.
+Each request starts with the user's greeting and CURRENT DATE (today's date and weekday), followed by their context, the conversation history and their message.
 
 RULES:
 - Keep responses SHORT (2-3 sentences max unless complex question)
@@ -239,39 +66,39 @@ User: "I want to learn CSS, 3 hours per week for 1 month starting Nov 13"
 Assistant: Great! I'll set up your CSS learning plan for you. You'll be dedicating 3 hours per week for 1 month, starting November 13, 2025.
 
 Actions:
-[{{"type":"add_skill","data":{{"name":"CSS",...}}}}]
+[{"type":"add_skill","data":{"name":"CSS",...}}]
 
 ACTIONS (include in Actions: JSON array):
-- update_user: {{"type":"update_user","data":{{"firstName":"..."}}}}
-- add_course: {{"type":"add_course","data":{{"name":"..." OR "courseName":"...","code":"..." OR "courseCode":"..." (optional),"description":"..." (optional),"group":"science|commerce|arts" (for school/college),"credits":N (optional, default 3 for university),"semester":"1"|"2"|"3"|"4"|"5"|"6"|"7"|"8" (optional, for university),"year":1|2|3|4 (optional, for university),"status":"ongoing|completed|dropped" (optional, default "ongoing"),"progress":0-100 (optional, default 0),"attendance":0-100 (optional, default 0)}}}}
-- add_skill: {{"type":"add_skill","data":{{"name":"...","category":"Technical|Creative|Soft Skills|Business|Language|Other","level":"beginner|intermediate|advanced|expert","description":"...","goalStatement":"...","durationMonths":N,"estimatedHours":N,"startDate":"YYYY-MM-DD","endDate":"YYYY-MM-DD","milestones":[{{"name":"...","order":0,"estimatedHours":N (2-8 hours per milestone),"startDate":"YYYY-MM-DD","dueDate":"YYYY-MM-DD","daysAllocated":N (auto-calculated from dates, typically 3-7 days)}}],"resources":[{{"title":"...","type":"link|video|note","url":"...","description":"..."}}]}}}}
-- add_expense: {{"type":"add_expense","data":{{"amount":N,"category":"Food|Transport|Entertainment|Shopping|Bills|Education|Health|Other","description":"...","date":"YYYY-MM-DD","paymentMethod":"cash|card|digital|bank_transfer","recurring":false,"frequency":"weekly|monthly|yearly"}}}}
-- update_expense: {{"type":"update_expense","data":{{"finance_id":"..." OR "description":"..." (find by description if ID not provided),"amount":N,"category":"Food|Transport|Entertainment|Shopping|Bills|Education|Health|Other","description":"...","date":"YYYY-MM-DD"}}}}
-- add_income: {{"type":"add_income","data":{{"amount":N,"category":"Salary|Freelance|Gift|Other","description":"...","date":"YYYY-MM-DD","paymentMethod":"cash|card|digital|bank_transfer"}}}}
-- update_income: {{"type":"update_income","data":{{"finance_id":"..." OR "description":"..." (find by description if ID not provided),"amount":N,"category":"Salary|Freelance|Gift|Other","description":"...","date":"YYYY-MM-DD"}}}}
-- add_savings_goal: {{"type":"add_savings_goal","data":{{"title":"...","targetAmount":N,"category":"emergency|vacation|education|investment|other","dueDate":"YYYY-MM-DD","description":"...","priority":"high|medium|low"}}}}
-- update_savings_goal: {{"type":"update_savings_goal","data":{{"goal_id":"...","title":"...","targetAmount":N,"currentAmount":N,"dueDate":"YYYY-MM-DD","status":"active|completed|cancelled"}}}}
-- delete_finance: {{"type":"delete_finance","data":{{"finance_id":"..." OR "description":"..." (find by description if ID not provided)}}}}
-- add_journal: {{"type":"add_journal","data":{{"title":"...","content":"...","mood":"happy|sad|neutral|anxious|excited|tired|energetic","tags":["tag1","tag2"],"date":"YYYY-MM-DD"}}}}
-- update_journal: {{"type":"update_journal","data":{{"journal_id":"...","title":"...","content":"...","mood":"...","tags":["..."]}}}}
-- delete_journal: {{"type":"delete_journal","data":{{"journal_id":"..."}}}}
-- add_lifestyle: {{"type":"add_lifestyle","data":{{"date":"YYYY-MM-DD","sleepHours":N,"exerciseMinutes":N,"waterIntake":N,"mealQuality":"excellent|good|fair|poor","stressLevel":1-10,"notes":"..."}}}}
-- update_lifestyle: {{"type":"update_lifestyle","data":{{"lifestyle_id":"...","sleepHours":N,"exerciseMinutes":N,"waterIntake":N,"mealQuality":"...","stressLevel":N,"notes":"..."}}}}
-- delete_lifestyle: {{"type":"delete_lifestyle","data":{{"lifestyle_id":"..."}}}}
-- add_habit: {{"type":"add_habit","data":{{"name":"...","target":"...","time":"HH:MM","color":"from-blue-500 to-cyan-500","icon":"..."}}}}
-- update_habit: {{"type":"update_habit","data":{{"habit_id":"...","name":"...","target":"...","time":"HH:MM","color":"...","icon":"..."}}}}
-- delete_habit: {{"type":"delete_habit","data":{{"habit_id":"..."}}}}
-- toggle_habit: {{"type":"toggle_habit","data":{{"habit_id":"..."}}}}
-- add_schedule: {{"type":"add_schedule","data":{{"courseId":"..." OR "courseName":"...","day":"Mon|Tue|Wed|Thu|Fri|Sat|Sun","time":"HH:MM" (e.g., "09:00"),"type":"Lecture|Lab|Tutorial" (optional),"location":"..." (optional)}}}}
-- update_schedule: {{"type":"update_schedule","data":{{"schedule_id":"...","day":"Mon|Tue|Wed|Thu|Fri|Sat|Sun","time":"HH:MM","type":"Lecture|Lab|Tutorial","location":"..."}}}}
-- delete_schedule: {{"type":"delete_schedule","data":{{"schedule_id":"..."}}}}
-- mark_attendance: {{"type":"mark_attendance","data":{{"courseId":"..." OR "courseName":"...","classScheduleId":"..." OR "day":"Mon|Tue|Wed|Thu|Fri|Sat|Sun" AND "time":"HH:MM","status":"present|absent|late","date":"YYYY-MM-DD" (optional, default today),"notes":"..." (optional)}}}}
-- update_attendance: {{"type":"update_attendance","data":{{"attendance_id":"...","status":"present|absent|late","notes":"..." (optional)}}}}
-- delete_attendance: {{"type":"delete_attendance","data":{{"attendance_id":"..."}}}}
-- add_assignment: {{"type":"add_assignment","data":{{"courseId":"..." OR "courseName":"...","title":"...","description":"..." (optional),"dueDate":"YYYY-MM-DD" (optional),"startDate":"YYYY-MM-DD" (optional),"estimatedHours":N (optional),"status":"pending|in_progress|completed" (optional, default "pending"),"points":N (optional),"examId":"..." (optional, link to exam if this is exam preparation task)}}}}
-- update_assignment: {{"type":"update_assignment","data":{{"assignment_id":"...","title":"...","description":"...","dueDate":"YYYY-MM-DD","startDate":"YYYY-MM-DD","estimatedHours":N,"status":"pending|in_progress|completed","points":N}}}}
-- delete_assignment: {{"type":"delete_assignment","data":{{"assignment_id":"..."}}}}
-- add_exam: {{"type":"add_exam","data":{{"courseId":"..." OR "courseName":"...","title":"..." (optional, default based on type),"date":"YYYY-MM-DD","type":"Midterm|Quiz|Final|Lab Final|Other" (optional, default "Midterm")}}}}
+- update_user: {"type":"update_user","data":{"firstName":"..."}}
+- add_course: {"type":"add_course","data":{"name":"..." OR "courseName":"...","code":"..." OR "courseCode":"..." (optional),"description":"..." (optional),"group":"science|commerce|arts" (for school/college),"credits":N (optional, default 3 for university),"semester":"1"|"2"|"3"|"4"|"5"|"6"|"7"|"8" (optional, for university),"year":1|2|3|4 (optional, for university),"status":"ongoing|completed|dropped" (optional, default "ongoing"),"progress":0-100 (optional, default 0),"attendance":0-100 (optional, default 0)}}
+- add_skill: {"type":"add_skill","data":{"name":"...","category":"Technical|Creative|Soft Skills|Business|Language|Other","level":"beginner|intermediate|advanced|expert","description":"...","goalStatement":"...","durationMonths":N,"estimatedHours":N,"startDate":"YYYY-MM-DD","endDate":"YYYY-MM-DD","milestones":[{"name":"...","order":0,"estimatedHours":N (2-8 hours per milestone),"startDate":"YYYY-MM-DD","dueDate":"YYYY-MM-DD","daysAllocated":N (auto-calculated from dates, typically 3-7 days)}],"resources":[{"title":"...","type":"link|video|note","url":"...","description":"..."}]}}
+- add_expense: {"type":"add_expense","data":{"amount":N,"category":"Food|Transport|Entertainment|Shopping|Bills|Education|Health|Other","description":"...","date":"YYYY-MM-DD","paymentMethod":"cash|card|digital|bank_transfer","recurring":false,"frequency":"weekly|monthly|yearly"}}
+- update_expense: {"type":"update_expense","data":{"finance_id":"..." OR "description":"..." (find by description if ID not provided),"amount":N,"category":"Food|Transport|Entertainment|Shopping|Bills|Education|Health|Other","description":"...","date":"YYYY-MM-DD"}}
+- add_income: {"type":"add_income","data":{"amount":N,"category":"Salary|Freelance|Gift|Other","description":"...","date":"YYYY-MM-DD","paymentMethod":"cash|card|digital|bank_transfer"}}
+- update_income: {"type":"update_income","data":{"finance_id":"..." OR "description":"..." (find by description if ID not provided),"amount":N,"category":"Salary|Freelance|Gift|Other","description":"...","date":"YYYY-MM-DD"}}
+- add_savings_goal: {"type":"add_savings_goal","data":{"title":"...","targetAmount":N,"category":"emergency|vacation|education|investment|other","dueDate":"YYYY-MM-DD","description":"...","priority":"high|medium|low"}}
+- update_savings_goal: {"type":"update_savings_goal","data":{"goal_id":"...","title":"...","targetAmount":N,"currentAmount":N,"dueDate":"YYYY-MM-DD","status":"active|completed|cancelled"}}
+- delete_finance: {"type":"delete_finance","data":{"finance_id":"..." OR "description":"..." (find by description if ID not provided)}}
+- add_journal: {"type":"add_journal","data":{"title":"...","content":"...","mood":"happy|sad|neutral|anxious|excited|tired|energetic","tags":["tag1","tag2"],"date":"YYYY-MM-DD"}}
+- update_journal: {"type":"update_journal","data":{"journal_id":"...","title":"...","content":"...","mood":"...","tags":["..."]}}
+- delete_journal: {"type":"delete_journal","data":{"journal_id":"..."}}
+- add_lifestyle: {"type":"add_lifestyle","data":{"date":"YYYY-MM-DD","sleepHours":N,"exerciseMinutes":N,"waterIntake":N,"mealQuality":"excellent|good|fair|poor","stressLevel":1-10,"notes":"..."}}
+- update_lifestyle: {"type":"update_lifestyle","data":{"lifestyle_id":"...","sleepHours":N,"exerciseMinutes":N,"waterIntake":N,"mealQuality":"...","stressLevel":N,"notes":"..."}}
+- delete_lifestyle: {"type":"delete_lifestyle","data":{"lifestyle_id":"..."}}
+- add_habit: {"type":"add_habit","data":{"name":"...","target":"...","time":"HH:MM","color":"from-blue-500 to-cyan-500","icon":"..."}}
+- update_habit: {"type":"update_habit","data":{"habit_id":"...","name":"...","target":"...","time":"HH:MM","color":"...","icon":"..."}}
+- delete_habit: {"type":"delete_habit","data":{"habit_id":"..."}}
+- toggle_habit: {"type":"toggle_habit","data":{"habit_id":"..."}}
+- add_schedule: {"type":"add_schedule","data":{"courseId":"..." OR "courseName":"...","day":"Mon|Tue|Wed|Thu|Fri|Sat|Sun","time":"HH:MM" (e.g., "09:00"),"type":"Lecture|Lab|Tutorial" (optional),"location":"..." (optional)}}
+- update_schedule: {"type":"update_schedule","data":{"schedule_id":"...","day":"Mon|Tue|Wed|Thu|Fri|Sat|Sun","time":"HH:MM","type":"Lecture|Lab|Tutorial","location":"..."}}
+- delete_schedule: {"type":"delete_schedule","data":{"schedule_id":"..."}}
+- mark_attendance: {"type":"mark_attendance","data":{"courseId":"..." OR "courseName":"...","classScheduleId":"..." OR "day":"Mon|Tue|Wed|Thu|Fri|Sat|Sun" AND "time":"HH:MM","status":"present|absent|late","date":"YYYY-MM-DD" (optional, default today),"notes":"..." (optional)}}
+- update_attendance: {"type":"update_attendance","data":{"attendance_id":"...","status":"present|absent|late","notes":"..." (optional)}}
+- delete_attendance: {"type":"delete_attendance","data":{"attendance_id":"..."}}
+- add_assignment: {"type":"add_assignment","data":{"courseId":"..." OR "courseName":"...","title":"...","description":"..." (optional),"dueDate":"YYYY-MM-DD" (optional),"startDate":"YYYY-MM-DD" (optional),"estimatedHours":N (optional),"status":"pending|in_progress|completed" (optional, default "pending"),"points":N (optional),"examId":"..." (optional, link to exam if this is exam preparation task)}}
+- update_assignment: {"type":"update_assignment","data":{"assignment_id":"...","title":"...","description":"...","dueDate":"YYYY-MM-DD","startDate":"YYYY-MM-DD","estimatedHours":N,"status":"pending|in_progress|completed","points":N}}
+- delete_assignment: {"type":"delete_assignment","data":{"assignment_id":"..."}}
+- add_exam: {"type":"add_exam","data":{"courseId":"..." OR "courseName":"...","title":"..." (optional, default based on type),"date":"YYYY-MM-DD","type":"Midterm|Quiz|Final|Lab Final|Other" (optional, default "Midterm")}}
 
 SKILL CREATION RULES:
 - "I know X" → Simple: Create immediately with name, category, level only
@@ -290,8 +117,8 @@ SKILL CREATION RULES:
   - durationMonths (from user: "2 months", "1 month", etc.)
   - estimatedHours (calculate: hours/week × weeks)
   - startDate (from user: "Nov 9", "10 nov", etc. - convert to YYYY-MM-DD)
-    * IMPORTANT: If user says "today" or "now", use {current_date_iso}
-    * If user says "next week" or similar, calculate from {current_date_iso}
+    * IMPORTANT: If user says "today" or "now", use today's date (CURRENT DATE)
+    * If user says "next week" or similar, calculate from today's date
   - endDate (calculate: startDate + durationMonths)
   - description (brief, from goal)
   - goalStatement (specific learning goal)
@@ -366,13 +193,13 @@ DUPLICATE PREVENTION:
 
 FINANCE RULES:
 - For expenses: Extract amount, category, description, date from user message
-  * IMPORTANT: If user doesn't specify a date, ALWAYS use today's date ({current_date_iso})
+  * IMPORTANT: If user doesn't specify a date, ALWAYS use today's date (CURRENT DATE)
   * Only use a different date if user explicitly mentions it (e.g., "yesterday", "last week", specific date)
   * ALWAYS infer category from description (e.g., "fuchka", "food", "groceries" → "Food"; "bus", "taxi", "uber" → "Transport"; "movie", "netflix" → "Entertainment"; "shirt", "shopping" → "Shopping"; "rent", "electricity" → "Bills"; "book", "course" → "Education"; "medicine", "doctor" → "Health")
   * If category cannot be inferred, use "Other"
   * Valid categories: Food, Transport, Entertainment, Shopping, Bills, Education, Health, Other
 - For income: Extract amount, category, description, date from user message
-  * IMPORTANT: If user doesn't specify a date, ALWAYS use today's date ({current_date_iso})
+  * IMPORTANT: If user doesn't specify a date, ALWAYS use today's date (CURRENT DATE)
   * Only use a different date if user explicitly mentions it (e.g., "yesterday", "last week", specific date)
   * Valid categories: Salary, Freelance, Gift, Other
 - For updating expenses/income: Use update_expense or update_income action
@@ -390,11 +217,11 @@ FINANCE RULES:
 
 JOURNAL & LIFESTYLE RULES:
 - For journal entries: Extract title, content, mood, tags, date from user message
-  * IMPORTANT: If user doesn't specify a date, ALWAYS use today's date ({current_date_iso})
+  * IMPORTANT: If user doesn't specify a date, ALWAYS use today's date (CURRENT DATE)
   * Only use a different date if user explicitly mentions it (e.g., "yesterday", "last week", specific date)
-  * Current date is {current_date_readable} ({current_day})
+  * Current date and weekday are given under CURRENT DATE
 - For lifestyle tracking: Extract sleep hours, exercise minutes, water intake, meal quality, stress level, date
-  * IMPORTANT: If user doesn't specify a date, ALWAYS use today's date ({current_date_iso})
+  * IMPORTANT: If user doesn't specify a date, ALWAYS use today's date (CURRENT DATE)
 - If user asks "How's my mood been?" or "Am I sleeping enough?" → Use analyze_lifestyle (return analysis as text, not action)
 - Correlate lifestyle factors (sleep, exercise) with mood/stress from journal entries
 - Provide actionable recommendations based on patterns
@@ -421,7 +248,7 @@ EXAM PREPARATION TASK GENERATION:
     - Distribute tasks across days leading up to exam date
     - Set appropriate due dates (e.g., "Study Chapter 1" due 5 days before exam)
     - Create review tasks closer to exam date (e.g., "Review all chapters" due 1 day before)
-  * Calculate days until exam: (exam_date - {current_date_iso})
+  * Calculate days until exam: (exam_date - today's date)
   * Example: 7 days before exam, 5 chapters → 1 chapter per day for first 5 days, review on days 6-7
   * Create multiple add_assignment actions with:
     - title: "Study Chapter X" or "Review [topic]"
@@ -441,212 +268,342 @@ ANALYSIS MODE:
   * Analyze the data from context
   * Return insights as natural language response
   * Provide specific, actionable suggestions
+"""
+
+def _pack_chat_context(structured_context, context_docs, syllabus_docs, summary_line, history_lines):
+    """
+    Fit the per-request context into CHAT_CONTEXT_EST_TOKENS (prevent token bloat).
+    Sections share the budget by weight; one that needs less passes its surplus on.
+    Returns (structured_context, context_text, syllabus_context, conversation_str).
+    """
+    budgets = allocate_budgets(CHAT_CONTEXT_EST_TOKENS, CHAT_SECTION_WEIGHTS, {
+        "structured": count_tokens(structured_context),
+        "memory": sum(count_tokens(d['text']) for d in context_docs),
+        "syllabus": sum(count_tokens(d['text']) for d in syllabus_docs),
+        "history": count_tokens(summary_line) + sum(count_tokens(line) for line in history_lines),
+    })
+    structured_context = truncate_to_tokens(structured_context, budgets["structured"])
+    # Documents are already sorted by relevance, so packing keeps the best ones that fit
+    context_text = "\n\n".join([d['text'] for d in pack_documents(context_docs, budgets["memory"])])
+    syllabus_context = "\n\n".join([d['text'] for d in pack_documents(syllabus_docs, budgets["syllabus"])])
+    # Summary first, then as many of the most recent turns as fit
+    summary_line = truncate_to_tokens(summary_line, budgets["history"])
+    conversation_str = summary_line + "".join(pack_recent(history_lines, budgets["history"] - count_tokens(summary_line)))
+    return structured_context, context_text, syllabus_context, conversation_str
+
+
+async def _build_chat_prompt(req: ChatRequest):
+    """
+    Retrieve context for the message (memory, plus syllabus for exam mentions) and build the chat prompt.
+    Returns (prompt, is_skill_creation); skill creation uses the faster model.
+    The prompt is sent with CHAT_SYSTEM_INSTRUCTION as the system instruction.
+    """
+    # OPTIMIZED: Query-specific context retrieval to prevent overcontext
+    # Use the actual user message as query for better semantic matching
+    context_query = req.message
+    
+    # Determine optimal k based on query complexity (prevents overcontext for simple queries)
+    optimal_k = determine_optimal_k(req.message)
+    
+    # Determine relevant context types based on query (prevents retrieving irrelevant types)
+    allowed_types = determine_context_types(req.message)
+    
+    # Retrieve context with anti-overfitting measures:
+    # - Similarity threshold (min_similarity=0.65) - only relevant docs
+    # - Recency weighting (20% weight) - prioritize recent context
+    # - Context length limit (2000 chars) - prevent token bloat
+    # - Type filtering - only relevant document types
+    # - Deduplication - remove similar documents
+    # Every retrieval the turn needs is collected first and run together below
+    retrievals = [(context_query, dict(
+        k=optimal_k,
+        min_similarity=0.65,  # Only include docs with >65% similarity
+        max_context_length=2000,  # Limit total context to prevent token bloat
+        recency_weight=0.2,  # 20% weight for recency, 80% for relevance
+        allowed_types=allowed_types,
+        deduplicate=True
+    ))]
+    
+    # Detect exam mentions and retrieve relevant syllabus
+    syllabus_docs = []
+    exam_info = None
+    
+    # Check if message mentions exam (midterm, final, quiz, exam)
+    exam_keywords = ['midterm', 'mid term', 'final', 'quiz', 'exam', 'test', 'assessment']
+    message_lower = req.message.lower()
+    has_exam_mention = any(keyword in message_lower for keyword in exam_keywords)
+    
+    if has_exam_mention:
+        # Extract exam date
+        exam_date = None
+        date_patterns = [
+            r'(?:on|for|by)\s+(\w+\s+\d{1,2}(?:st|nd|rd|th)?(?:\s+\d{4})?)',  # "on Nov 15" or "on November 15, 2025"
+            r'(\d{1,2}[/-]\d{1,2}(?:[/-]\d{2,4})?)',  # "11/15" or "11/15/2025"
+            r'(\w+\s+\d{1,2})',  # "Nov 15"
+        ]
+        
+        for pattern in date_patterns:
+            match = re.search(pattern, req.message, re.IGNORECASE)
+            if match:
+                try:
+                    if HAS_DATEUTIL:
+                        exam_date = date_parser.parse(match.group(1), fuzzy=True)
+                    else:
+                        # Simple fallback parsing
+                        date_str = match.group(1)
+                        # Try common formats
+                        try:
+                            exam_date = datetime.strptime(date_str, "%m/%d/%Y")
+                        except:
+                            try:
+                                exam_date = datetime.strptime(date_str, "%m/%d")
+                                # Assume current year
+                                exam_date = exam_date.replace(year=datetime.now().year)
+                            except:
+                                pass
+                    if exam_date:
+                        break
+                except:
+                    pass
+        
+        # Extract course name from message or structured context
+        course_name = None
+        course_id = None
+        if req.structured_context:
+            # Try to extract course from structured context
+            try:
+                # Look for course mentions in the message
+                course_pattern = r'(?:for|in|of)\s+([A-Z][a-zA-Z\s]+?)(?:\s+covering|\s+chapters|\s+on|$)'
+                course_match = re.search(course_pattern, req.message, re.IGNORECASE)
+                if course_match:
+                    course_name = course_match.group(1).strip()
+            except:
+                pass
+        
+        # Extract chapters from message
+        chapters = None
+        chapter_patterns = [
+            r'chapter[s]?\s*(\d+(?:\s*[-–]\s*\d+)?)',  # "chapters 1-5"
+            r'chapter[s]?\s*(\d+(?:\s*,\s*\d+)*)',  # "chapters 1, 2, 3"
+            r'ch\.?\s*(\d+)',  # "ch. 1"
+        ]
+        
+        for pattern in chapter_patterns:
+            matches = re.findall(pattern, message_lower)
+            if matches:
+                chapters = []
+                for match in matches:
+                    if '-' in match or '–' in match:
+                        range_parts = re.split(r'[-–]', match)
+                        if len(range_parts) == 2:
+                            try:
+                                start = int(range_parts[0].strip())
+                                end = int(range_parts[1].strip())
+                                chapters.extend([str(i) for i in range(start, end + 1)])
+                            except:
+                                pass
+                    elif ',' in match:
+                        chapters.extend([c.strip() for c in match.split(',')])
+                    else:
+                        chapters.append(match.strip())
+                break
+        
+        # If we have course info, try to retrieve syllabus
+        if course_name or course_id:
+            # Try to find course_id from structured context
+            # For now, we'll retrieve syllabus for all courses and filter by course name
+            # This is a simplified approach - in production, you'd match course_id from context
+            # Get syllabus chunks (filtered by chapters below)
+            # Note: We need course_id, but we can try to find it from context
+            # For now, retrieve syllabus with type filter and let semantic search find relevant ones
+            retrievals.append((f"{req.message} {course_name or ''}", dict(
+                k=5,
+                min_similarity=0.6,
+                allowed_types=["syllabus"],
+                deduplicate=True
+            )))
+    
+    # One embedding call for all queries, vector searches run concurrently
+    results = await aretrieve_many(req.user_id, retrievals)
+    context_docs = results[0]
+    
+    if len(results) > 1 and results[1]:
+        syllabus_docs = results[1]
+        # Filter by chapters if specified
+        if chapters:
+            filtered_syllabus = []
+            for doc in syllabus_docs:
+                doc_lower = doc['text'].lower()
+                if any(
+                    f"chapter {ch}" in doc_lower or 
+                    f"ch. {ch}" in doc_lower or
+                    ch in doc_lower
+                    for ch in chapters
+                ):
+                    filtered_syllabus.append(doc)
+            syllabus_docs = filtered_syllabus if filtered_syllabus else syllabus_docs
+        
+        syllabus_docs = syllabus_docs[:3]  # Limit to top 3 chunks
+        exam_info = {
+            'date': exam_date,
+            'course': course_name,
+            'chapters': chapters
+        }
+    
+    # Build conversation history lines: the session's rolling summary stands in
+    # for older messages, so long sessions don't grow the prompt
+    summary, recent_history = await conversation_summarizer.history_for_prompt(
+        req.user_id, req.conversation_history, req.session_id
+    )
+    summary_line = f"Summary of earlier conversation: {summary}\n" if summary else ""
+    history_lines = []
+    for msg in recent_history:
+        role = msg.get('role', 'user')
+        content = msg.get('content', '')
+        history_lines.append(f"{role.capitalize()}: {content}\n")
+    
+    # Token counting is CPU work with a configured tokenizer, so it runs off the event loop
+    structured_context, context_text, syllabus_context, conversation_str = await asyncio.to_thread(
+        _pack_chat_context, req.structured_context or "", context_docs, syllabus_docs, summary_line, history_lines
+    )
+    
+    # Build prompt with user context
+    user_name_part = f" (User's name: {req.user_name})" if req.user_name else ""
+    
+    # Combine structured context from PostgreSQL with unstructured from ChromaDB
+    full_context = ""
+    if structured_context:
+        full_context += f"Structured Information:\n{structured_context}\n\n"
+    if context_text:
+        full_context += f"Additional Context from Memory:\n{context_text}"
+    if syllabus_context:
+        full_context += f"\n\nRelevant Syllabus Content:\n{syllabus_context}"
+    
+    # Build personalized prompt with structured instructions
+    name_greeting = f"Hi {req.user_name}!" if req.user_name else "Hello!"
+    first_name = req.user_name.split()[0] if req.user_name else "there"
+    personalization_note = f"\n\nPERSONALIZATION: The user's name is {req.user_name}. Always use their name naturally in conversation to make it feel personal and friendly, like ChatGPT does. For example: 'Hi {first_name}!' or 'That's great, {first_name}!'" if req.user_name else ""
+    
+    # Get current date for prompt
+    current_date_iso = datetime.now().strftime('%Y-%m-%d')
+    current_date_readable = datetime.now().strftime('%B %d, %Y')
+    current_day = datetime.now().strftime('%A')
+    
+    # Only the per-request part; the rules are in CHAT_SYSTEM_INSTRUCTION
+    prompt = f"""{name_greeting}
+
+CURRENT DATE: Today is {current_date_readable} ({current_day}). The date in YYYY-MM-DD format is {current_date_iso}.
 
 Context: {full_context}
 History: {conversation_str}
 
 User: {req.message}
 Assistant:"""
-        
-        # Check if this is a skill creation request for faster processing
-        is_skill_creation = any(keyword in req.message.lower() for keyword in [
-            "want to learn", "learn", "add skill", "create skill", "skill to", "build", "develop"
-        ])
+    
+    # Check if this is a skill creation request for faster processing
+    is_skill_creation = any(keyword in req.message.lower() for keyword in [
+        "want to learn", "learn", "add skill", "create skill", "skill to", "build", "develop"
+    ])
+    
+    return prompt, is_skill_creation
+
+
+def _add_fallback_actions(req: ChatRequest, actions: list):
+    """Extract name changes from the user message when the AI returned no actions"""
+    # Also check if user message mentions updates and try to extract them (fallback if AI doesn't return actions)
+    update_keywords = ["change", "update", "set", "modify", "edit", "my name is", "call me"]
+    if any(keyword in req.message.lower() for keyword in update_keywords) and not actions:
+        # Try to extract name changes with better patterns
+        name_patterns = [
+            r"(?:my name is|call me|name should be|change my name to|update my name to|set my name to)\s+([A-Za-z\s]+?)(?:\.|$|,|\s+and)",
+            r"(?:name|it['']s|it is)\s*:?\s*([A-Za-z\s]+?)(?:\.|$|,|\s+and)",
+            r"([A-Z][a-z]+\s+[A-Z][a-z]+)",  # Pattern like "Al Amin"
+        ]
+        for pattern in name_patterns:
+            match = re.search(pattern, req.message, re.IGNORECASE)
+            if match:
+                new_name = match.group(1).strip()
+                # Handle names like "Al Amin" - if it's two words, treat as first and last
+                name_parts = new_name.split()
+                action_data = {}
+                if len(name_parts) == 1:
+                    # Single name - update first name only
+                    action_data["firstName"] = name_parts[0]
+                elif len(name_parts) >= 2:
+                    # Multiple words - first is first name, rest is last name
+                    action_data["firstName"] = name_parts[0]
+                    action_data["lastName"] = " ".join(name_parts[1:])
+                if action_data:
+                    actions.append(ChatAction(type="update_user", data=action_data))
+                    print(f"Extracted name change from message: {action_data}")
+                break
+
+
+def _new_conversation_id(user_id: str) -> str:
+    return f"chat_{user_id}_{datetime.now().isoformat()}"
+
+
+def _queue_conversation(user_id: str, message: str, response_text: str, base_doc_id: str):
+    """
+    Queue the exchange for storage in ChromaDB (chunked if long).
+    Written in the background by chat_memory_writer, so the reply doesn't wait on it.
+    """
+    conversation_text = f"User: {message}\nAssistant: {response_text}"
+    
+    try:
+        # For long conversations, chunk them for better retrieval
+        # Short conversations (<500 chars) stored as single document
+        if len(conversation_text) > 500:
+            # Split long conversation into chunks
+            chunks = get_conversation_splitter().split_text(conversation_text)
+            
+            # Prepare metadata and IDs for all chunks
+            chunk_ids = []
+            chunk_metadatas = []
+            
+            for i, chunk in enumerate(chunks):
+                chunk_id = f"{base_doc_id}_chunk_{i}"
+                chunk_ids.append(chunk_id)
+                chunk_metadatas.append({
+                    "user_id": user_id,
+                    "type": "chat",
+                    "timestamp": datetime.now().isoformat(),
+                    "chunk_index": i,
+                    "total_chunks": len(chunks),
+                    "source_doc_id": base_doc_id,
+                    "is_chunk": True
+                })
+            
+            chat_memory_writer.enqueue(user_id, chunk_ids, chunks, chunk_metadatas)
+        else:
+            # Short conversation - store as single document
+            chat_memory_writer.enqueue(user_id, [base_doc_id], [conversation_text], [{
+                "user_id": user_id,
+                "type": "chat",
+                "timestamp": datetime.now().isoformat()
+            }])
+    except Exception as e:
+        print(f"Error storing chat conversation: {e}")
+
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat(req: ChatRequest):
+    """Chat with AI assistant using user context from ChromaDB"""
+    try:
+        prompt, is_skill_creation = await _build_chat_prompt(req)
         
         # Generate response using Gemini (use fast model for skill creation)
-        raw_response = call_gemini_generate(prompt, use_fast_model=is_skill_creation)
+        raw_response = await acall_gemini_generate(
+            prompt, use_fast_model=is_skill_creation, system_instruction=CHAT_SYSTEM_INSTRUCTION
+        )
         
         # Parse response to extract actions
-        response_text = raw_response
-        actions = []
-        
-        # Improved JSON extraction using balanced bracket matching
-        # This handles nested JSON structures properly
-        actions_pos = raw_response.find('Actions:')
-        if actions_pos != -1:
-            # Find the opening bracket after "Actions:"
-            # Skip past any code block markers
-            search_start = actions_pos + len('Actions:')
-            bracket_pos = raw_response.find('[', search_start)
-            
-            if bracket_pos != -1:
-                # Use balanced bracket matching to find the complete JSON array
-                # This handles nested arrays and objects correctly
-                bracket_count = 0
-                brace_count = 0  # Also track braces for nested objects
-                in_string = False
-                escape_next = False
-                end_pos = bracket_pos
-                
-                for i in range(bracket_pos, len(raw_response)):
-                    char = raw_response[i]
-                    
-                    if escape_next:
-                        escape_next = False
-                        continue
-                    
-                    if char == '\\':
-                        escape_next = True
-                        continue
-                    
-                    if char == '"' and not escape_next:
-                        in_string = not in_string
-                        continue
-                    
-                    if not in_string:
-                        if char == '[':
-                            bracket_count += 1
-                        elif char == ']':
-                            bracket_count -= 1
-                            if bracket_count == 0:
-                                end_pos = i + 1
-                                break
-                        elif char == '{':
-                            brace_count += 1
-                        elif char == '}':
-                            brace_count -= 1
-                
-                if bracket_count == 0:
-                    # Extract the JSON string
-                    actions_str = raw_response[bracket_pos:end_pos]
-                    
-                    # Clean up markdown code blocks if present
-                    actions_str = re.sub(r'^```json\s*', '', actions_str, flags=re.IGNORECASE | re.MULTILINE)
-                    actions_str = re.sub(r'^```\s*', '', actions_str, flags=re.MULTILINE)
-                    actions_str = re.sub(r'\s*```$', '', actions_str, flags=re.MULTILINE)
-                    actions_str = actions_str.strip()
-                    
-                    # Try to parse the JSON
-                    try:
-                        actions_json = json.loads(actions_str)
-                        if isinstance(actions_json, list):
-                            actions = [ChatAction(**action) for action in actions_json]
-                            # Remove the entire Actions section from response text
-                            # Remove from "Actions:" to the end of the JSON array
-                            response_text = raw_response[:actions_pos].strip()
-                            # Also remove any trailing newlines or markdown
-                            response_text = re.sub(r'\n+$', '', response_text)
-                            print(f"Successfully extracted {len(actions)} actions from AI response")
-                        else:
-                            print(f"Warning: Actions JSON is not a list: {type(actions_json)}")
-                    except json.JSONDecodeError as e:
-                        print(f"Error parsing actions JSON: {e}")
-                        print(f"Actions string (first 1000 chars): {actions_str[:1000] if len(actions_str) > 1000 else actions_str}")
-                        # Try to fix common JSON issues
-                        try:
-                            # Try to complete truncated JSON by adding closing brackets
-                            fixed_str = actions_str
-                            if bracket_count > 0:
-                                fixed_str += ']' * bracket_count
-                            if brace_count > 0:
-                                fixed_str += '}' * brace_count
-                            actions_json = json.loads(fixed_str)
-                            if isinstance(actions_json, list):
-                                actions = [ChatAction(**action) for action in actions_json]
-                                response_text = raw_response[:actions_pos].strip()
-                                response_text = re.sub(r'\n+$', '', response_text)
-                                print(f"Successfully extracted {len(actions)} actions after fixing truncated JSON")
-                        except Exception as e2:
-                            print(f"Failed to fix truncated JSON: {e2}")
-                            traceback.print_exc()
-                    except Exception as e:
-                        print(f"Error processing actions: {e}")
-                        traceback.print_exc()
-                else:
-                    print(f"Warning: Unbalanced brackets in Actions JSON (bracket_count={bracket_count})")
-        
-        # Also check if user message mentions updates and try to extract them (fallback if AI doesn't return actions)
-        update_keywords = ["change", "update", "set", "modify", "edit", "my name is", "call me"]
-        if any(keyword in req.message.lower() for keyword in update_keywords) and not actions:
-            # Try to extract name changes with better patterns
-            name_patterns = [
-                r"(?:my name is|call me|name should be|change my name to|update my name to|set my name to)\s+([A-Za-z\s]+?)(?:\.|$|,|\s+and)",
-                r"(?:name|it['']s|it is)\s*:?\s*([A-Za-z\s]+?)(?:\.|$|,|\s+and)",
-                r"([A-Z][a-z]+\s+[A-Z][a-z]+)",  # Pattern like "Al Amin"
-            ]
-            for pattern in name_patterns:
-                match = re.search(pattern, req.message, re.IGNORECASE)
-                if match:
-                    new_name = match.group(1).strip()
-                    # Handle names like "Al Amin" - if it's two words, treat as first and last
-                    name_parts = new_name.split()
-                    action_data = {}
-                    if len(name_parts) == 1:
-                        # Single name - update first name only
-                        action_data["firstName"] = name_parts[0]
-                    elif len(name_parts) >= 2:
-                        # Multiple words - first is first name, rest is last name
-                        action_data["firstName"] = name_parts[0]
-                        action_data["lastName"] = " ".join(name_parts[1:])
-                    if action_data:
-                        actions.append(ChatAction(type="update_user", data=action_data))
-                        print(f"Extracted name change from message: {action_data}")
-                    break
+        response_text, actions = parse_actions(raw_response)
+        _add_fallback_actions(req, actions)
         
         # Store conversation in ChromaDB for future context
-        conversation_text = f"User: {req.message}\nAssistant: {response_text}"
-        base_doc_id = f"chat_{req.user_id}_{datetime.now().isoformat()}"
-        
-        try:
-            # For long conversations, chunk them for better retrieval
-            # Short conversations (<500 chars) stored as single document
-            if len(conversation_text) > 500:
-                # Split long conversation into chunks
-                chunks = conversation_splitter.split_text(conversation_text)
-                
-                # Generate embeddings for all chunks at once (more efficient)
-                embeddings = gemini_embedding(chunks)
-                
-                # ChromaDB expects List[List[float]], gemini_embedding already returns this format
-                # Ensure each embedding is a list (not numpy array)
-                embeddings_list = []
-                for emb in embeddings:
-                    if isinstance(emb, list):
-                        embeddings_list.append(emb)
-                    else:
-                        embeddings_list.append(list(emb))
-                
-                # Prepare metadata and IDs for all chunks
-                chunk_ids = []
-                chunk_metadatas = []
-                
-                for i, chunk in enumerate(chunks):
-                    chunk_id = f"{base_doc_id}_chunk_{i}"
-                    chunk_ids.append(chunk_id)
-                    chunk_metadatas.append({
-                        "user_id": req.user_id,
-                        "type": "chat",
-                        "timestamp": datetime.now().isoformat(),
-                        "chunk_index": i,
-                        "total_chunks": len(chunks),
-                        "source_doc_id": base_doc_id,
-                        "is_chunk": True
-                    })
-                
-                # Batch add chunks to ChromaDB
-                collection.add(
-                    documents=chunks,
-                    ids=chunk_ids,
-                    embeddings=embeddings_list,
-                    metadatas=chunk_metadatas
-                )
-            else:
-                # Short conversation - store as single document
-                emb = gemini_embedding([conversation_text])[0]
-                # ChromaDB expects List[float], ensure it's a list (not numpy array)
-                emb_list = list(emb) if not isinstance(emb, list) else emb
-                collection.add(
-                    documents=[conversation_text],
-                    ids=[base_doc_id],
-                    embeddings=[emb_list],
-                    metadatas=[{
-                        "user_id": req.user_id,
-                        "type": "chat",
-                        "timestamp": datetime.now().isoformat()
-                    }]
-                )
-        except Exception as e:
-            print(f"Error storing chat conversation: {e}")
+        base_doc_id = _new_conversation_id(req.user_id)
+        _queue_conversation(req.user_id, req.message, response_text, base_doc_id)
         
         return ChatResponse(
             response=response_text,
@@ -659,6 +616,108 @@ Assistant:"""
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _chat_stream_events(req: ChatRequest, result: dict):
+    """
+    Run a chat turn as a stream of (event, data) pairs:
+    - ("token", {"text": ...}) for each piece of the reply as Gemini produces it
+    - ("action", ChatAction) for each action as soon as the model finishes writing it
+    - ("done", ChatResponse) once complete, with all actions (including fallbacks)
+    - ("error", {"detail": ...}) if the turn fails
+    The Actions section is never streamed as text.
+    On success the final response text is left in result for storage after the stream.
+    """
+    try:
+        prompt, is_skill_creation = await _build_chat_prompt(req)
+        
+        parser = ActionStreamParser()
+        sent = 0
+        async for piece in astream_gemini_generate(
+            prompt, use_fast_model=is_skill_creation, system_instruction=CHAT_SYSTEM_INSTRUCTION
+        ):
+            completed = parser.feed(piece)
+            safe = parser.streamable_length
+            if safe > sent:
+                yield "token", {"text": parser.raw[sent:safe]}
+                sent = safe
+            for action in completed:
+                yield "action", action.dict()
+        
+        # Release held-back text that turned out not to start an Actions section
+        if parser.marker_pos == -1 and sent < len(parser.raw):
+            yield "token", {"text": parser.raw[sent:]}
+        
+        # Salvage an action cut off by the end of the completion
+        for action in parser.close():
+            yield "action", action.dict()
+        
+        response_text, actions = parser.response_text, list(parser.actions)
+        _add_fallback_actions(req, actions)
+        
+        base_doc_id = _new_conversation_id(req.user_id)
+        result["response_text"] = response_text
+        result["conversation_id"] = base_doc_id
+        yield "done", ChatResponse(
+            response=response_text,
+            conversation_id=base_doc_id,
+            actions=actions
+        ).dict()
+    except Exception as e:
+        print(f"Chat stream error: {e}")
+        traceback.print_exc()
+        yield "error", {"detail": str(e)}
+
+
+async def _store_streamed_conversation(req: ChatRequest, result: dict):
+    """Store a streamed turn once the stream has closed (nothing to store if it failed)"""
+    if "response_text" in result:
+        _queue_conversation(req.user_id, req.message, result["response_text"], result["conversation_id"])
+
+
+# Running websocket streams (held so they aren't garbage collected mid-stream)
+_stream_tasks = set()
+
+
+async def _push_chat_stream(req: ChatRequest):
+    """Forward a streamed chat turn to the user's websocket connections"""
+    result = {}
+    async for event, data in _chat_stream_events(req, result):
+        await ws_manager.send_json(req.user_id, {"type": f"chat_{event}", "data": data})
+    await _store_streamed_conversation(req, result)
+
+
+@router.post("/chat/stream")
+async def chat_stream(req: ChatRequest, transport: str = Query("sse")):
+    """
+    Streaming version of /chat.
+    transport=sse (default): the response is text/event-stream with "token" events,
+    then a "done" event carrying the same body /chat returns (or an "error" event).
+    transport=ws: returns immediately and pushes chat_token / chat_done / chat_error
+    messages to the user's /ws connections instead.
+    Actions are also sent individually ("action" / chat_action) as soon as each
+    one is complete, so clients can apply them before the reply finishes.
+    The conversation is stored after the stream has finished.
+    """
+    if transport == "ws":
+        task = asyncio.create_task(_push_chat_stream(req))
+        _stream_tasks.add(task)
+        task.add_done_callback(_stream_tasks.discard)
+        return {"status": "streaming", "transport": "ws"}
+    
+    result = {}
+    
+    async def sse():
+        async for event, data in _chat_stream_events(req, result):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    
+    return StreamingResponse(
+        sse(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Runs after the last byte is sent, so storage never delays the reply
+        background=BackgroundTask(_store_streamed_conversation, req, result)
+    )
+
+
 @router.post("/generate-syllabus-tasks", response_model=GenerateSyllabusTasksResponse)
 async def generate_syllabus_tasks(req: GenerateSyllabusTasksRequest):
     """
@@ -667,8 +726,6 @@ async def generate_syllabus_tasks(req: GenerateSyllabusTasksRequest):
     """
     try:
         from datetime import datetime, timedelta
-        from ai_client import call_gemini_generate
-        from utils import retrieve_user_context
         
         # Get current date
         current_date = datetime.now()
@@ -677,7 +734,7 @@ async def generate_syllabus_tasks(req: GenerateSyllabusTasksRequest):
         end_date = current_date + timedelta(days=req.months * 30)  # Approximate 30 days per month
         
         # Retrieve syllabus context from ChromaDB
-        syllabus_docs = retrieve_user_context(
+        syllabus_docs = await aretrieve_user_context(
             req.user_id,
             req.syllabus_text[:200],  # Use first 200 chars as query
             k=10,
@@ -721,7 +778,7 @@ Distribute them evenly across the {req.months} months.
 Return ONLY a valid JSON array, no other text."""
 
         # Call Gemini to generate tasks
-        response_text = call_gemini_generate(prompt)
+        response_text = await acall_gemini_generate(prompt)
         
         # Parse JSON response
         # Extract JSON from response (handle markdown code blocks if present)
@@ -3,20 +3,29 @@ import uuid
 from datetime import datetime
 from fastapi import APIRouter, HTTPException, Query
 from models import IngestRequest
-from database import collection
-from ai_client import gemini_embedding
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from database import get_user_collection
+from ai_client import gemini_embedding, to_chroma_embeddings
+from utils import invalidate_user_context
 
 router = APIRouter()
 
-# Create text splitter with optimal settings for this project
-# Chunk size 1000 chars with 200 char overlap balances precision and context
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=200,
-    length_function=len,
-    separators=["\n\n", "\n", ". ", " ", ""]  # Smart splitting by paragraphs, sentences, words
-)
+# Text splitter, created on first use (langchain is slow to import)
+_text_splitter = None
+
+def get_text_splitter():
+    """Lazy load the document splitter to keep langchain off the startup path"""
+    global _text_splitter
+    if _text_splitter is None:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        # Create text splitter with optimal settings for this project
+        # Chunk size 1000 chars with 200 char overlap balances precision and context
+        _text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000,
+            chunk_overlap=200,
+            length_function=len,
+            separators=["\n\n", "\n", ". ", " ", ""]  # Smart splitting by paragraphs, sentences, words
+        )
+    return _text_splitter
 
 @router.post("/ingest")
 def ingest(req: IngestRequest):
@@ -38,7 +47,7 @@ def ingest(req: IngestRequest):
         
         # Split document into chunks using LangChain
         # This ensures long documents (syllabi, notes) are properly chunked
-        chunks = text_splitter.split_text(d.text)
+        chunks = get_text_splitter().split_text(d.text)
         
         # If document is short enough, store as single chunk
         if len(chunks) == 1 and len(d.text) <= 1000:
@@ -64,17 +73,17 @@ def ingest(req: IngestRequest):
     if all_chunks:
         embeddings = gemini_embedding(all_chunks)
         
-        # ChromaDB expects List[List[float]], gemini_embedding already returns this format
-        # Ensure each embedding is a list (not numpy array)
-        embeddings_list = [list(emb) if not isinstance(emb, list) else emb for emb in embeddings]
+        # ChromaDB expects List[List[float]], gemini_embedding returns numpy vectors
+        embeddings_list = to_chroma_embeddings(embeddings)
         
         # Batch add to ChromaDB (more efficient than individual adds)
-        collection.add(
+        get_user_collection(req.user_id).add(
             documents=all_chunks,
             embeddings=embeddings_list,
             ids=all_ids,
             metadatas=all_metadatas
         )
+        invalidate_user_context(req.user_id)
     
     return {
         "status": "ok",
@@ -94,7 +103,8 @@ def delete_context(user_id: str = Query(...)):
         # Query all documents with type=context and source=user_edit for this user
         # Note: ChromaDB doesn't have a direct delete by metadata filter
         # So we need to query first, then delete by IDs
-        results = collection.get(
+        user_collection = get_user_collection(user_id)
+        results = user_collection.get(
             where={
                 "$and": [
                     {"user_id": user_id},
@@ -106,7 +116,8 @@ def delete_context(user_id: str = Query(...)):
         
         if results and results['ids']:
             # Delete all old context documents
-            collection.delete(ids=results['ids'])
+            user_collection.delete(ids=results['ids'])
+            invalidate_user_context(user_id)
             return {
                 "status": "ok",
                 "deleted_count": len(results['ids']),
@@ -133,7 +144,8 @@ def delete_syllabus(course_id: str, user_id: str = Query(...)):
         # Query all documents with this course_id and type=syllabus
         # Note: ChromaDB doesn't have a direct delete by metadata filter
         # So we need to query first, then delete by IDs
-        results = collection.get(
+        user_collection = get_user_collection(user_id)
+        results = user_collection.get(
             where={
                 "$and": [
                     {"user_id": user_id},
@@ -145,7 +157,8 @@ def delete_syllabus(course_id: str, user_id: str = Query(...)):
         
         if results and results['ids']:
             # Delete all chunks for this syllabus
-            collection.delete(ids=results['ids'])
+            user_collection.delete(ids=results['ids'])
+            invalidate_user_context(user_id)
             return {
                 "status": "ok",
                 "deleted_count": len(results['ids']),
@@ -181,7 +194,8 @@ def ingest_syllabus(req: IngestRequest):
         # Delete old syllabus chunks for this course
         try:
             # Call the delete function directly with the same logic
-            results = collection.get(
+            user_collection = get_user_collection(req.user_id)
+            results = user_collection.get(
                 where={
                     "$and": [
                         {"user_id": req.user_id},
@@ -191,7 +205,8 @@ def ingest_syllabus(req: IngestRequest):
                 }
             )
             if results and results['ids']:
-                collection.delete(ids=results['ids'])
+                user_collection.delete(ids=results['ids'])
+                invalidate_user_context(req.user_id)
                 print(f"Deleted {len(results['ids'])} old syllabus chunks for course {course_id}")
         except Exception as delete_error:
             print(f"Warning: Could not delete old syllabus chunks: {delete_error}")
@@ -211,7 +226,7 @@ def verify_syllabus_in_chromadb(course_id: str, user_id: str = Query(...)):
     """
     try:
         # Query ChromaDB for syllabus chunks for this course
-        results = collection.get(
+        results = get_user_collection(user_id).get(
             where={
                 "$and": [
                     {"user_id": user_id},
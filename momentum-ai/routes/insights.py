@@ -1,12 +1,18 @@
 # routes/insights.py
+import hashlib
 import json
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Dict, Any
-from ai_client import call_gemini_generate
+from ai_client import acall_gemini_generate
+from config import SEMANTIC_CACHE_TTL_INSIGHTS
+from semantic_cache import SemanticCache
 
 router = APIRouter()
 
+# Near-identical dashboards (per user) get the earlier insights
+_insights_cache = SemanticCache("insights", SEMANTIC_CACHE_TTL_INSIGHTS)
+
 class InsightsRequest(BaseModel):
     user_id: str
     habits: List[Dict[str, Any]]
@@ -70,6 +76,24 @@ async def get_insights(req: InsightsRequest):
                 'estimated_hours': skill.get('estimatedHours', 0)
             })
 
+        # Reuse insights only for exactly the same numbers: embeddings barely move when
+        # digits change, so every amount, rate and count goes into the scope's hash and
+        # similarity only covers the habit and skill names
+        numbers = {
+            "finances": [total_income, total_expenses, net_savings, expense_by_category],
+            "habits": [[h['streak'], h['completed_today'], h['completion_rate']] for h in habits_summary],
+            "skills": [[s['progress'], s['completed_milestones'], s['total_milestones'], s['estimated_hours']] for s in skills_summary]
+        }
+        numbers_hash = hashlib.md5(json.dumps(numbers, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        cache_scope = f"{req.user_id}:{numbers_hash}"
+        cache_inputs = {
+            "habits": [[h['name'], h['target']] for h in habits_summary],
+            "skills": [[s['name'], s['category'], s['level']] for s in skills_summary]
+        }
+        cached, cache_vec = await _insights_cache.aget(cache_scope, cache_inputs)
+        if cached is not None:
+            return InsightsResponse(insights=cached)
+
         # Build prompt for AI
         prompt = f"""You are an AI assistant analyzing user finances, habits, and skills to provide personalized insights and suggestions.
 
@@ -97,7 +121,7 @@ Return ONLY a JSON array with EXACTLY 3 insight strings (no markdown, no explana
 Keep each insight concise (1-2 sentences max) and actionable. Focus on performance, consistency, and progress."""
 
         # Generate insights using Gemini
-        raw_response = call_gemini_generate(prompt, use_fast_model=False)
+        raw_response = await acall_gemini_generate(prompt, use_fast_model=False)
         
         # Parse JSON response
         try:
@@ -118,6 +142,8 @@ Keep each insight concise (1-2 sentences max) and actionable. Focus on performan
         # Limit to exactly 3 insights (replace oldest if more than 3)
         # Only return insights if we have valid ones (no fallbacks)
         insights = insights[:3] if insights else []
+        if insights:
+            _insights_cache.put(cache_scope, cache_vec, insights)
 
         return InsightsResponse(insights=insights)
         
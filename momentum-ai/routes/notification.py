@@ -1,11 +1,22 @@
 # routes/notification.py
+import hashlib
+import threading
+from cachetools import TTLCache
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
 from ai_client import call_gemini_generate
+from config import SEMANTIC_CACHE, SEMANTIC_CACHE_TTL_NOTIFICATIONS
 
 router = APIRouter()
 
+# Repeated notification lists get the earlier summary (per user). Matched exactly,
+# not by similarity: lists that differ only in an amount, a date or one extra
+# notification look alike to embeddings but need a different summary.
+# (user_id, hash of the notification texts) -> summary
+_summary_cache = TTLCache(maxsize=5000, ttl=SEMANTIC_CACHE_TTL_NOTIFICATIONS)
+_summary_cache_lock = threading.Lock()
+
 class NotificationItem(BaseModel):
     id: str
     type: str  # "success", "error", "warning", "info"
@@ -17,6 +28,7 @@ class NotificationItem(BaseModel):
 
 class SummarizeNotificationsRequest(BaseModel):
     notifications: List[NotificationItem]
+    user_id: Optional[str] = None  # Enables the semantic cache (scoped per user)
 
 class SummarizeNotificationsResponse(BaseModel):
     summary: str
@@ -52,6 +64,18 @@ def summarize_notifications(req: SummarizeNotificationsRequest):
         
         notifications_list = "\n".join(notification_texts)
         
+        # Exactly the same notification texts (whitespace aside) -> reuse the summary.
+        # ids and createdAt aren't part of the texts; anything written in them is.
+        cache_key = None
+        if req.user_id and SEMANTIC_CACHE:
+            normalized = "\n".join(' '.join(text.split()) for text in notification_texts)
+            cache_key = (req.user_id, hashlib.md5(normalized.encode('utf-8')).hexdigest())
+            with _summary_cache_lock:
+                cached = _summary_cache.get(cache_key)
+            if cached is not None:
+                print("Notification summary cache hit")
+                return SummarizeNotificationsResponse(summary=cached)
+        
         # Build prompt for AI summarization
         prompt = f"""You are a helpful assistant that summarizes user notifications. You are ONLY summarizing these notifications - do not remember or store this information for future use.
 
@@ -77,6 +101,9 @@ Summary:"""
         
         # Clean up the summary (remove any markdown formatting if needed)
         summary = raw_summary.strip()
+        if cache_key and summary and not summary.startswith("Error:"):
+            with _summary_cache_lock:
+                _summary_cache[cache_key] = summary
         
         return SummarizeNotificationsResponse(summary=summary)
         
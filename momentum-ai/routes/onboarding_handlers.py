@@ -1,10 +1,11 @@
 # routes/onboarding_handlers.py
+import asyncio
 import json
 from datetime import datetime
 from models import OnboardingResponse
-from database import collection
-from ai_client import genai_client, gemini_embedding
-from config import GEMINI_MODEL
+from database import get_user_collection
+from ai_client import acall_gemini_generate, agemini_embedding, to_chroma_embeddings
+from utils import invalidate_user_context
 
 async def handle_education_level(user_id: str, answer: str, session: dict) -> OnboardingResponse:
     """Handle education level question with Bangladeshi context"""
@@ -24,12 +25,7 @@ async def handle_education_level(user_id: str, answer: str, session: dict) -> On
     """
     
     try:
-        response = genai_client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=prompt
-        )
-        
-        text = response.text.strip()
+        text = (await acall_gemini_generate(prompt)).strip()
         # Remove markdown code blocks if present
         if "```json" in text:
             text = text.split("```json")[1].split("```")[0].strip()
@@ -110,12 +106,7 @@ async def handle_school_details(user_id: str, answer: str, session: dict) -> Onb
     """
     
     try:
-        response = genai_client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=prompt
-        )
-        
-        text = response.text.strip()
+        text = (await acall_gemini_generate(prompt)).strip()
         if "```json" in text:
             text = text.split("```json")[1].split("```")[0].strip()
         elif "```" in text:
@@ -190,12 +181,7 @@ async def handle_school_group(user_id: str, answer: str, session: dict) -> Onboa
     """
     
     try:
-        response = genai_client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=prompt
-        )
-        
-        text = response.text.strip()
+        text = (await acall_gemini_generate(prompt)).strip()
         if "```json" in text:
             text = text.split("```json")[1].split("```")[0].strip()
         elif "```" in text:
@@ -257,12 +243,7 @@ async def handle_college_details(user_id: str, answer: str, session: dict) -> On
     """
     
     try:
-        response = genai_client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=prompt
-        )
-        
-        text = response.text.strip()
+        text = (await acall_gemini_generate(prompt)).strip()
         if "```json" in text:
             text = text.split("```json")[1].split("```")[0].strip()
         elif "```" in text:
@@ -326,12 +307,7 @@ async def handle_university_details(user_id: str, answer: str, session: dict) ->
     """
     
     try:
-        response = genai_client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=prompt
-        )
-        
-        text = response.text.strip()
+        text = (await acall_gemini_generate(prompt)).strip()
         if "```json" in text:
             text = text.split("```json")[1].split("```")[0].strip()
         elif "```" in text:
@@ -445,12 +421,7 @@ async def handle_academic_courses(user_id: str, answer: str, session: dict) -> O
         """
         
         try:
-            response = genai_client.models.generate_content(
-                model=GEMINI_MODEL,
-                contents=prompt
-            )
-            
-            text = response.text.strip()
+            text = (await acall_gemini_generate(prompt)).strip()
             if "```json" in text:
                 text = text.split("```json")[1].split("```")[0].strip()
             elif "```" in text:
@@ -519,12 +490,7 @@ async def handle_skill_goals(user_id: str, answer: str, session: dict) -> Onboar
         """
         
         try:
-            response = genai_client.models.generate_content(
-                model=GEMINI_MODEL,
-                contents=prompt
-            )
-            
-            text = response.text.strip()
+            text = (await acall_gemini_generate(prompt)).strip()
             if "```json" in text:
                 text = text.split("```json")[1].split("```")[0].strip()
             elif "```" in text:
@@ -567,12 +533,7 @@ async def handle_financial_situation(user_id: str, answer: str, session: dict) -
         """
         
         try:
-            response = genai_client.models.generate_content(
-                model=GEMINI_MODEL,
-                contents=prompt
-            )
-            
-            text = response.text.strip()
+            text = (await acall_gemini_generate(prompt)).strip()
             if "```json" in text:
                 text = text.split("```json")[1].split("```")[0].strip()
             elif "```" in text:
@@ -610,18 +571,20 @@ async def store_onboarding_conversation(user_id: str, conversation: list):
         
         # Store in ChromaDB with embeddings
         doc_id = f"onboarding_{user_id}_{datetime.now().isoformat()}"
-        emb = gemini_embedding([conversation_text])[0]
+        emb = (await agemini_embedding([conversation_text]))[0]
         
-        collection.add(
+        await asyncio.to_thread(
+            get_user_collection(user_id).add,
             documents=[conversation_text],
             ids=[doc_id],
-            embeddings=[emb],
+            embeddings=to_chroma_embeddings([emb]),
             metadatas=[{
                 "user_id": user_id,
                 "type": "onboarding",
                 "timestamp": datetime.now().isoformat()
             }]
         )
+        invalidate_user_context(user_id)
         
     except Exception as e:
         print(f"Error storing conversation: {e}")
@@ -3,122 +3,202 @@ import json
 import uuid
 import asyncio
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from dateutil import parser
 import numpy as np
-import joblib
-from fastapi import APIRouter
-from models import PlanRequest, PlanResponse, CompleteReq
-from database import collection
+from anyio import from_thread
+from fastapi import APIRouter, HTTPException
+from models import Task, PlanRequest, PlanResponse, PlanRangeRequest, PlanRangeResponse, CompleteReq
 from ai_client import call_gemini_generate
-from scheduler import fallback_scheduler
+from scheduler import fallback_scheduler, local_plan, carry_forward, class_on_day, windows_on_day, plan_tz, TaskTable
 from websocket_manager import ws_manager
 from utils import retrieve_user_context, polish_context, format_context_for_prompt
-from config import GEMINI_MODEL, POLICY_MODEL_PATH
+from config import GEMINI_MODEL, POLICY_MODEL_PATH, PLANNER_LOCAL_MAX_TASKS, PLAN_RANGE_MAX_DAYS
 
 router = APIRouter()
 
-# Load policy model if exists
-policy_model = None
-if os.path.exists(POLICY_MODEL_PATH):
+# Policy model, loaded on first use (joblib and the model's libraries are slow to import)
+_policy_model = None
+_policy_model_loaded = False
+
+def get_policy_model():
+    """Lazy load the policy model if one exists at POLICY_MODEL_PATH (None otherwise)"""
+    global _policy_model, _policy_model_loaded
+    if not _policy_model_loaded:
+        if os.path.exists(POLICY_MODEL_PATH):
+            try:
+                import joblib
+                _policy_model = joblib.load(POLICY_MODEL_PATH)
+            except Exception as e:
+                print("Failed to load policy model:", e)
+        _policy_model_loaded = True
+    return _policy_model
+
+# Realtime pushes scheduled by _notify; the loop only keeps weak references to
+# tasks, so they are held here until they finish
+_pending_pushes = set()
+
+def _notify(user_id, message):
+    """
+    Best-effort realtime push from a sync route. These run in a worker thread
+    without an event loop, so the send is scheduled on the app's loop.
+    """
+    def schedule_push():
+        task = asyncio.ensure_future(ws_manager.send_json(user_id, message))
+        _pending_pushes.add(task)
+        task.add_done_callback(_pending_pushes.discard)
+
     try:
-        policy_model = joblib.load(POLICY_MODEL_PATH)
+        from_thread.run_sync(schedule_push)
     except Exception as e:
-        print("Failed to load policy model:", e)
+        print(f"Realtime update failed: {e}")
+
+def _score_schedule(schedule):
+    """Score schedule items with the policy model (if available) and sort best first"""
+    policy_model = get_policy_model()
+    if policy_model is None:
+        return
+    for s in schedule:
+        try:
+            start_dt = parser.isoparse(s["start"])
+            feat = np.array([[start_dt.hour, start_dt.weekday(), s.get("priority", 3), s.get("estimated_minutes", 30)]])
+            if hasattr(policy_model, "predict_proba"):
+                prob = policy_model.predict_proba(feat)[:,1][0]
+            else:
+                prob = float(policy_model.predict(feat)[0])
+            s["score"] = float(prob)
+        except Exception:
+            s["score"] = 0.0
+    schedule.sort(key=lambda x: x.get("score",0), reverse=True)
 
-@router.post("/plan", response_model=PlanResponse)
-def plan(req: PlanRequest):
+def _narrate(date_label, planned, completion_history=None, use_llm=True):
+    """
+    Summary and suggestions for a locally planned day (or range of days). The
+    schedule itself is final; the fast model only describes it. Without use_llm,
+    or if that fails, a plain summary is returned.
+    """
+    schedule, shifted = planned["schedule"], planned["shifted_tasks"]
+    summary = f"{len(schedule)} task{'s' if len(schedule) != 1 else ''} scheduled for {date_label}"
+    if shifted:
+        summary += f", {len(shifted)} moved to the next day"
+    summary += "."
+    suggestions = []
+    if planned["overflow"]:
+        suggestions.append(f"{planned['overflow']} must-do task(s) run past your study windows. Consider freeing up more time today.")
+    if not use_llm:
+        return summary, suggestions
+
+    avg_completion = (completion_history or {}).get("averageDailyCompletion", 0.7)
+    prompt = f"""You are Momentum — a student's daily planner assistant. The plan below is final; do not change it.
+Write a short, encouraging summary of the plan (1-2 sentences) and 1-3 actionable suggestions.
+Return ONLY a JSON object: {{"summary": string, "suggestions": [string]}}
+
+Dates: {date_label}
+Average daily completion rate: {avg_completion:.0%}
+Schedule:
+{json.dumps([{"title": s["title"], "start": s["start"][:16].replace("T", " "), "end": s["end"][11:16], "priority": s["priority"], "notes": s["notes"]} for s in schedule])}
+Moved to the next day:
+{json.dumps([{"title": t["title"], "reason": t["reason"]} for t in shifted]) if shifted else "None"}
+"""
     try:
-        # 1) get context - optimized retrieval for planning queries
-        context_docs = retrieve_user_context(
-            req.user_id, 
-            query=f"study notes syllabus courses subjects planning schedule",
-            k=5,  # Get more context for planning
-            min_similarity=0.65,  # Higher threshold to filter low-quality docs
-            max_context_length=2500,  # More context allowed for planning
-            allowed_types=["plan", "context", "onboarding"],  # Planning-relevant types
-            deduplicate=True
-        )
-        
-        # Polish context to remove junk data and duplicates
-        polished_docs = polish_context(context_docs, min_similarity=0.65)
-        
-        # Validate context quality - need at least 2 relevant documents
-        if len(polished_docs) < 2:
-            print(f"Warning: Only {len(polished_docs)} high-quality context documents found. Using available context.")
-        
-        # Format context for prompt with structured sections
-        user_profile = req.user_profile if req.user_profile else None
-        completion_history = req.completion_history if req.completion_history else None
-        
-        context_text = format_context_for_prompt(
-            polished_docs,
-            user_profile=user_profile if user_profile else {},
-            completion_history=completion_history if completion_history else {},
-            max_length=2500
-        )
-        
-        # Pre-filter tasks: Mark tasks that MUST stay (cannot be shifted)
-        from datetime import datetime, timedelta
-        plan_date = datetime.fromisoformat(req.date_iso.replace('Z', '+00:00')).replace(tzinfo=None)
-        tomorrow = plan_date + timedelta(days=1)
-        
-        tasks_must_stay = []
-        tasks_can_shift = []
-        
-        for task in req.tasks:
-            task_dict = task.dict(exclude_none=True)
-            due_date = None
-            if task_dict.get('dueDate'):
-                try:
-                    due_date = datetime.fromisoformat(task_dict['dueDate'].replace('Z', '+00:00')).replace(tzinfo=None)
-                except:
-                    pass
-            
-            status = task_dict.get('status', 'pending').lower()
-            priority = task_dict.get('priority', 'medium').lower()
-            
-            # Check if task MUST stay
-            must_stay = False
-            reason = ""
-            
-            # Due today or tomorrow
-            if due_date and due_date <= tomorrow:
-                must_stay = True
-                reason = "due today or tomorrow"
-            # In-progress
-            elif status == 'in-progress':
-                must_stay = True
-                reason = "in-progress"
-            # High priority
-            elif priority == 'high':
-                must_stay = True
-                reason = "high priority"
-            # Exam-related (check if task has examId or is linked to exam)
-            elif task_dict.get('examId') or 'exam' in task_dict.get('title', '').lower():
-                must_stay = True
-                reason = "exam-related"
-            
-            if must_stay:
-                tasks_must_stay.append({
-                    'task': task_dict,
-                    'reason': reason
-                })
-            else:
-                tasks_can_shift.append(task_dict)
-        
-        # Calculate user's daily capacity from completion history
-        completion_history = req.completion_history if req.completion_history else {}
-        avg_completion = completion_history.get("averageDailyCompletion", 0.7)
-        typical_capacity = completion_history.get("typicalCapacity")
-        
-        # If capacity not provided, estimate from task count and completion rate
-        if not typical_capacity and len(req.tasks) > 0:
-            # Estimate: user can complete 70-80% of tasks on average (more reasonable)
-            typical_capacity = max(4, int(len(req.tasks) * 0.75))  # Use 75% as default, minimum 4 tasks
-        
-        # 2) build prompt (strict JSON)
-        prompt = f"""
+        import re
+        raw = call_gemini_generate(prompt, use_fast_model=True)
+        m = re.search(r"\{.*\}", raw, flags=re.S)
+        parsed = json.loads(m.group(0)) if m else {}
+        summary = parsed.get("summary") or summary
+        suggestions = suggestions + [str(x) for x in parsed.get("suggestions", [])]
+    except Exception as e:
+        print(f"Plan narration failed, using default summary: {e}")
+    return summary, suggestions
+
+def _plan_locally(req: PlanRequest, narrate=True, notify=True, table=None, use_default_windows=True):
+    """
+    Schedule the request with the local planner; the LLM only narrates (if narrate).
+    use_default_windows=False: no windows means no free time (see local_plan).
+    """
+    completion_history = req.completion_history or {}
+    typical_capacity = completion_history.get("typicalCapacity") or max(4, int(len(req.tasks) * 0.75))
+    table = table or TaskTable([t.dict(exclude_none=True) for t in req.tasks], req.date_iso, plan_tz(req.available_times, req.date_iso))
+    planned = local_plan(
+        [row["task"] for row in table.rows],
+        req.date_iso,
+        available_times=req.available_times or [],
+        classes=[c.dict(exclude_none=True) for c in (req.classes or [])],
+        capacity=typical_capacity,
+        table=table,
+        use_default_windows=use_default_windows
+    )
+    _score_schedule(planned["schedule"])
+    summary, suggestions = _narrate(req.date_iso[:10], planned, completion_history, use_llm=narrate)
+    parsed = {"summary": summary, "schedule": planned["schedule"], "suggestions": suggestions, "shifted_tasks": planned["shifted_tasks"]}
+
+    os.makedirs("logs", exist_ok=True)
+    with open("logs/plan_requests.log", "a") as f:
+        f.write(json.dumps({"ts": datetime.utcnow().isoformat(), "user_id": req.user_id, "engine": "local", "payload": parsed}) + "\n")
+    if notify:
+        _notify(req.user_id, {"type":"plan","payload":parsed})
+
+    return PlanResponse(user_id=req.user_id, date_iso=req.date_iso,
+                        summary=summary,
+                        schedule=planned["schedule"],
+                        suggestions=suggestions,
+                        rebalanced_tasks=[],
+                        shifted_tasks=planned["shifted_tasks"],
+                        metadata={"model": GEMINI_MODEL, "engine": "local", "must_stay": planned["must_stay"], "overflow": planned["overflow"]})
+
+def _plan_context(req: PlanRequest):
+    """Retrieve and format the user's planning context. Returns (polished_docs, context_text)."""
+    # 1) get context - optimized retrieval for planning queries
+    context_docs = retrieve_user_context(
+        req.user_id, 
+        query=f"study notes syllabus courses subjects planning schedule",
+        k=5,  # Get more context for planning
+        min_similarity=0.65,  # Higher threshold to filter low-quality docs
+        max_context_length=2500,  # More context allowed for planning
+        allowed_types=["plan", "context", "onboarding"],  # Planning-relevant types
+        deduplicate=True
+    )
+    
+    # Polish context to remove junk data and duplicates
+    polished_docs = polish_context(context_docs, min_similarity=0.65)
+    
+    # Validate context quality - need at least 2 relevant documents
+    if len(polished_docs) < 2:
+        print(f"Warning: Only {len(polished_docs)} high-quality context documents found. Using available context.")
+    
+    # Format context for prompt with structured sections
+    user_profile = req.user_profile if req.user_profile else None
+    completion_history = req.completion_history if req.completion_history else None
+    
+    context_text = format_context_for_prompt(
+        polished_docs,
+        user_profile=user_profile if user_profile else {},
+        completion_history=completion_history if completion_history else {},
+        max_tokens=650
+    )
+    return polished_docs, context_text
+
+def _plan_with_llm(req: PlanRequest, polished_docs, context_text, notify=True, table=None):
+    """LLM planner (requests above PLANNER_LOCAL_MAX_TASKS), validated against the must-stay rules"""
+    # Pre-filter tasks: Mark tasks that MUST stay (cannot be shifted). Deadlines, priorities
+    # and must-stay reasons are computed once here and shared by every stage below.
+    table = table or TaskTable([t.dict(exclude_none=True) for t in req.tasks], req.date_iso, plan_tz(req.available_times, req.date_iso))
+    tasks_must_stay = table.must_stay
+    tasks_can_shift = table.can_shift
+    task_dicts = [row["task"] for row in table.rows]
+    
+    # Calculate user's daily capacity from completion history
+    completion_history = req.completion_history if req.completion_history else {}
+    avg_completion = completion_history.get("averageDailyCompletion", 0.7)
+    typical_capacity = completion_history.get("typicalCapacity")
+    
+    # If capacity not provided, estimate from task count and completion rate
+    if not typical_capacity and len(req.tasks) > 0:
+        # Estimate: user can complete 70-80% of tasks on average (more reasonable)
+        typical_capacity = max(4, int(len(req.tasks) * 0.75))  # Use 75% as default, minimum 4 tasks
+    
+    # 2) build prompt (strict JSON)
+    prompt = f"""
 You are Momentum — an intelligent student's daily planner assistant. Return ONLY a valid JSON object exactly matching the schema below.
 
 Context:
@@ -128,14 +208,14 @@ INPUT:
 date: {req.date_iso}
 available_windows: { [w.dict() for w in (req.available_times or [])] }
 classes: { [c.dict() for c in (req.classes or [])] }
-tasks: {json.dumps([t.dict(exclude_none=True) for t in req.tasks], default=str)}
+tasks: {json.dumps(task_dicts, default=str)}
 preferences: { req.preferences or {} }
 
 TASKS THAT MUST STAY (DO NOT SHIFT THESE):
-{json.dumps([{"task_id": t['task'].get('id') or t['task'].get('sourceId'), "title": t['task'].get('title'), "reason": t['reason']} for t in tasks_must_stay], indent=2) if tasks_must_stay else "None - all tasks can potentially be shifted"}
+{json.dumps([{"task_id": t['id'], "title": t['task'].get('title'), "reason": t['reason']} for t in tasks_must_stay], indent=2) if tasks_must_stay else "None - all tasks can potentially be shifted"}
 
 TASKS THAT CAN BE SHIFTED (if capacity exceeded):
-{json.dumps([{"task_id": t.get('id') or t.get('sourceId'), "title": t.get('title'), "dueDate": t.get('dueDate'), "priority": t.get('priority')} for t in tasks_can_shift], indent=2) if tasks_can_shift else "None"}
+{json.dumps([{"task_id": t['id'], "title": t['task'].get('title'), "dueDate": t['task'].get('dueDate'), "priority": t['task'].get('priority')} for t in tasks_can_shift], indent=2) if tasks_can_shift else "None"}
 
 USER CAPACITY ANALYSIS:
 - Average daily completion rate: {avg_completion:.1%}
@@ -179,11 +259,11 @@ YOUR TASK:
 
 3. Shift less critical tasks to next day (ONLY if capacity truly exceeded):
    - Only shift tasks that meet ALL criteria:
-     * Task is not due today or tomorrow
-     * Task is not in-progress
-     * Task is not high priority
-     * Task is not linked to upcoming exam
-     * User capacity is truly exceeded
+ * Task is not due today or tomorrow
+ * Task is not in-progress
+ * Task is not high priority
+ * Task is not linked to upcoming exam
+ * User capacity is truly exceeded
    - For tasks shifted to next day, calculate new dueDate and startDate
    - Next day = {req.date_iso} + 1 day
    - Update dates appropriately (maintain daysAllocated if multi-day task)
@@ -193,14 +273,14 @@ SCHEMA:
   "schedule": [{{"id","task_id","title","type","start","end","priority","estimated_minutes","notes","score"}}],
   "suggestions": [string],
   "shifted_tasks": [
-    {{
-      "task_id": "original_task_id",
-      "title": "Task title",
-      "type": "assignment|milestone|task",
-      "newDueDate": "ISO8601 date (YYYY-MM-DD)",
-      "newStartDate": "ISO8601 date (YYYY-MM-DD) or null",
-      "reason": "Why this was shifted"
-    }}
+{{
+  "task_id": "original_task_id",
+  "title": "Task title",
+  "type": "assignment|milestone|task",
+  "newDueDate": "ISO8601 date (YYYY-MM-DD)",
+  "newStartDate": "ISO8601 date (YYYY-MM-DD) or null",
+  "reason": "Why this was shifted"
+}}
   ]
 }}
 
@@ -219,174 +299,154 @@ Rules:
 - Use ISO8601 datetimes for start/end.
 - Output VALID JSON ONLY — no extra text.
 """
-        try:
-            raw = call_gemini_generate(prompt)
-        except Exception as e:
-            print(f"Error calling Gemini API: {e}")
-            import traceback
-            traceback.print_exc()
-            # Fallback to simple scheduler
-            schedule = fallback_scheduler(req.available_times or [], [t.dict() for t in req.tasks], [c.dict() for c in (req.classes or [])], req.date_iso)
-            return PlanResponse(user_id=req.user_id, date_iso=req.date_iso,
-                                summary="Error generating plan - using fallback schedule",
-                                schedule=schedule, suggestions=["AI service error. Using fallback scheduler."], 
-                                rebalanced_tasks=[], shifted_tasks=[],
-                                metadata={"model": GEMINI_MODEL, "error": str(e), "retrieved_docs": len(polished_docs)})
-        
-        import re
-        m = re.search(r"\{.*\}", raw, flags=re.S)
-        if not m:
-            # fallback
-            schedule = fallback_scheduler(req.available_times or [], [t.dict() for t in req.tasks], [c.dict() for c in (req.classes or [])], req.date_iso)
-            return PlanResponse(user_id=req.user_id, date_iso=req.date_iso,
-                                summary="Fallback schedule (LLM failed to produce JSON)",
-                                schedule=schedule, suggestions=["Fallback used."], rebalanced_tasks=[],
-                                shifted_tasks=[], metadata={"model": GEMINI_MODEL, "retrieved_docs": len(polished_docs) if 'polished_docs' in locals() else 0})
-        try:
-            parsed = json.loads(m.group(0))
-        except Exception:
-            schedule = fallback_scheduler(req.available_times or [], [t.dict() for t in req.tasks], [c.dict() for c in (req.classes or [])], req.date_iso)
-            return PlanResponse(user_id=req.user_id, date_iso=req.date_iso,
-                                summary="Fallback schedule (LLM JSON parse error)",
-                                schedule=schedule, suggestions=["Fallback used."], rebalanced_tasks=[],
-                                shifted_tasks=[], metadata={"model": GEMINI_MODEL, "retrieved_docs": len(polished_docs) if 'polished_docs' in locals() else 0})
-
-        # 3) score with policy model if available
-        if policy_model is not None:
-            for s in parsed.get("schedule", []):
-                try:
-                    start_dt = parser.isoparse(s["start"])
-                    feat = np.array([[start_dt.hour, start_dt.weekday(), s.get("priority", 3), s.get("estimated_minutes", 30)]])
-                    if hasattr(policy_model, "predict_proba"):
-                        prob = policy_model.predict_proba(feat)[:,1][0]
-                    else:
-                        prob = float(policy_model.predict(feat)[0])
-                    s["score"] = float(prob)
-                except Exception:
-                    s["score"] = 0.0
-            parsed["schedule"].sort(key=lambda x: x.get("score",0), reverse=True)
-
-        # ensure ids
-        for item in parsed.get("schedule", []):
-            if "id" not in item:
-                item["id"] = str(uuid.uuid4())
-
-        # VALIDATION: Ensure tasks due today/tomorrow are not shifted
-        shifted_tasks = parsed.get("shifted_tasks", [])
-        validated_shifted_tasks = []
-        moved_back_to_schedule = []
+    try:
+        raw = call_gemini_generate(prompt)
+    except Exception as e:
+        print(f"Error calling Gemini API: {e}")
+        import traceback
+        traceback.print_exc()
+        # Fallback to simple scheduler
+        schedule = fallback_scheduler(req.available_times or [], task_dicts, [c.dict() for c in (req.classes or [])], req.date_iso, table=table)
+        return PlanResponse(user_id=req.user_id, date_iso=req.date_iso,
+                            summary="Error generating plan - using fallback schedule",
+                            schedule=schedule, suggestions=["AI service error. Using fallback scheduler."], 
+                            rebalanced_tasks=[], shifted_tasks=[],
+                            metadata={"model": GEMINI_MODEL, "error": str(e), "retrieved_docs": len(polished_docs)})
+    
+    import re
+    m = re.search(r"\{.*\}", raw, flags=re.S)
+    if not m:
+        # fallback
+        schedule = fallback_scheduler(req.available_times or [], task_dicts, [c.dict() for c in (req.classes or [])], req.date_iso, table=table)
+        return PlanResponse(user_id=req.user_id, date_iso=req.date_iso,
+                            summary="Fallback schedule (LLM failed to produce JSON)",
+                            schedule=schedule, suggestions=["Fallback used."], rebalanced_tasks=[],
+                            shifted_tasks=[], metadata={"model": GEMINI_MODEL, "retrieved_docs": len(polished_docs) if 'polished_docs' in locals() else 0})
+    try:
+        parsed = json.loads(m.group(0))
+    except Exception:
+        schedule = fallback_scheduler(req.available_times or [], task_dicts, [c.dict() for c in (req.classes or [])], req.date_iso, table=table)
+        return PlanResponse(user_id=req.user_id, date_iso=req.date_iso,
+                            summary="Fallback schedule (LLM JSON parse error)",
+                            schedule=schedule, suggestions=["Fallback used."], rebalanced_tasks=[],
+                            shifted_tasks=[], metadata={"model": GEMINI_MODEL, "retrieved_docs": len(polished_docs) if 'polished_docs' in locals() else 0})
+
+    # 3) score with policy model if available
+    _score_schedule(parsed.get("schedule", []))
+
+    # ensure ids
+    for item in parsed.get("schedule", []):
+        if "id" not in item:
+            item["id"] = str(uuid.uuid4())
+
+    # VALIDATION: Ensure tasks due today/tomorrow are not shifted
+    shifted_tasks = parsed.get("shifted_tasks", [])
+    validated_shifted_tasks = []
+    moved_back_to_schedule = []
+    
+    for shifted_task in shifted_tasks:
+        task_id = shifted_task.get("task_id")
+        # Find the original task
+        row = table.get(task_id)
         
-        for shifted_task in shifted_tasks:
-            task_id = shifted_task.get("task_id")
-            # Find the original task
-            original_task = None
-            for task in req.tasks:
-                task_dict = task.dict(exclude_none=True)
-                if (task_dict.get('id') == task_id or 
-                    task_dict.get('sourceId') == task_id):
-                    original_task = task_dict
-                    break
+        if row:
+            original_task = row["task"]
+            # Validate: Don't allow shifting if task must stay
+            # (due today/tomorrow, in-progress, high priority or exam-related)
+            should_not_shift = bool(row["reason"])
             
-            if original_task:
-                # Check if this task MUST stay
-                due_date = None
-                if original_task.get('dueDate'):
-                    try:
-                        due_date = datetime.fromisoformat(original_task['dueDate'].replace('Z', '+00:00')).replace(tzinfo=None)
-                    except:
-                        pass
-                
-                status = original_task.get('status', 'pending').lower()
-                priority = original_task.get('priority', 'medium').lower()
-                
-                # Validate: Don't allow shifting if task must stay
-                should_not_shift = (
-                    (due_date and due_date <= tomorrow) or  # Due today/tomorrow
-                    status == 'in-progress' or  # In-progress
-                    priority == 'high' or  # High priority
-                    original_task.get('examId') or 'exam' in original_task.get('title', '').lower()  # Exam-related
-                )
+            if should_not_shift:
+                # Move this task back to schedule (don't shift it)
+                print(f"VALIDATION: Task '{original_task.get('title')}' should not be shifted (due today/tomorrow, in-progress, high priority, or exam-related). Moving back to schedule.")
+                moved_back_to_schedule.append({
+                    "id": str(uuid.uuid4()),
+                    "task_id": task_id,
+                    "title": original_task.get('title', 'Task'),
+                    "type": shifted_task.get("type", "task"),
+                    "start": f"{req.date_iso}T09:00:00",
+                    "end": f"{req.date_iso}T10:00:00",
+                    "priority": original_task.get('priority', 'medium'),
+                    "estimated_minutes": original_task.get('estimatedMinutes', 60),
+                    "notes": "Kept in schedule (must not be shifted)"
+                })
+            else:
+                validated_shifted_tasks.append(shifted_task)
+        else:
+            # If we can't find the task, allow the shift (might be a new task)
+            validated_shifted_tasks.append(shifted_task)
+    
+    # Add moved-back tasks to schedule
+    schedule = parsed.get("schedule", [])
+    schedule.extend(moved_back_to_schedule)
+    
+    # Validate: At least 50% of tasks should be in schedule (not shifted)
+    total_tasks = len(req.tasks)
+    tasks_in_schedule = len([s for s in schedule if s.get("task_id")])
+    if tasks_in_schedule < total_tasks * 0.5:
+        print(f"VALIDATION WARNING: Only {tasks_in_schedule}/{total_tasks} tasks in schedule. This seems too aggressive. Adjusting...")
+        # If too many tasks shifted, move some back
+        if validated_shifted_tasks:
+            # Move back the first few shifted tasks
+            tasks_to_move_back = validated_shifted_tasks[:max(1, int(total_tasks * 0.3))]
+            moved_back = set()
+            for i, task_to_move in enumerate(tasks_to_move_back):
+                task_id = task_to_move.get("task_id")
+                row = table.get(task_id)
                 
-                if should_not_shift:
-                    # Move this task back to schedule (don't shift it)
-                    print(f"VALIDATION: Task '{original_task.get('title')}' should not be shifted (due today/tomorrow, in-progress, high priority, or exam-related). Moving back to schedule.")
-                    moved_back_to_schedule.append({
+                if row:
+                    original_task = row["task"]
+                    schedule.append({
                         "id": str(uuid.uuid4()),
                         "task_id": task_id,
                         "title": original_task.get('title', 'Task'),
-                        "type": shifted_task.get("type", "task"),
+                        "type": task_to_move.get("type", "task"),
                         "start": f"{req.date_iso}T09:00:00",
                         "end": f"{req.date_iso}T10:00:00",
                         "priority": original_task.get('priority', 'medium'),
                         "estimated_minutes": original_task.get('estimatedMinutes', 60),
-                        "notes": "Kept in schedule (must not be shifted)"
+                        "notes": "Moved back to schedule (validation)"
                     })
-                else:
-                    validated_shifted_tasks.append(shifted_task)
-            else:
-                # If we can't find the task, allow the shift (might be a new task)
-                validated_shifted_tasks.append(shifted_task)
-        
-        # Add moved-back tasks to schedule
-        schedule = parsed.get("schedule", [])
-        schedule.extend(moved_back_to_schedule)
-        
-        # Validate: At least 50% of tasks should be in schedule (not shifted)
-        total_tasks = len(req.tasks)
-        tasks_in_schedule = len([s for s in schedule if s.get("task_id")])
-        if tasks_in_schedule < total_tasks * 0.5:
-            print(f"VALIDATION WARNING: Only {tasks_in_schedule}/{total_tasks} tasks in schedule. This seems too aggressive. Adjusting...")
-            # If too many tasks shifted, move some back
-            if validated_shifted_tasks:
-                # Move back the first few shifted tasks
-                tasks_to_move_back = validated_shifted_tasks[:max(1, int(total_tasks * 0.3))]
-                for task_to_move in tasks_to_move_back:
-                    task_id = task_to_move.get("task_id")
-                    original_task = None
-                    for task in req.tasks:
-                        task_dict = task.dict(exclude_none=True)
-                        if (task_dict.get('id') == task_id or 
-                            task_dict.get('sourceId') == task_id):
-                            original_task = task_dict
-                            break
-                    
-                    if original_task:
-                        schedule.append({
-                            "id": str(uuid.uuid4()),
-                            "task_id": task_id,
-                            "title": original_task.get('title', 'Task'),
-                            "type": task_to_move.get("type", "task"),
-                            "start": f"{req.date_iso}T09:00:00",
-                            "end": f"{req.date_iso}T10:00:00",
-                            "priority": original_task.get('priority', 'medium'),
-                            "estimated_minutes": original_task.get('estimatedMinutes', 60),
-                            "notes": "Moved back to schedule (validation)"
-                        })
-                        validated_shifted_tasks.remove(task_to_move)
-
-        # persist policy log and optionally push to frontend (store details in your DB in production)
-        # For demo: write a small json to logs/
-        os.makedirs("logs", exist_ok=True)
-        with open("logs/plan_requests.log", "a") as f:
-            f.write(json.dumps({"ts": datetime.utcnow().isoformat(), "user_id": req.user_id, "payload": parsed}) + "\n")
-
-        # send realtime update to frontend (best-effort)
-        asyncio.create_task(ws_manager.send_json(req.user_id, {"type":"plan","payload":parsed}))
+                    moved_back.add(i)
+            validated_shifted_tasks = [t for i, t in enumerate(validated_shifted_tasks) if i not in moved_back]
 
-        return PlanResponse(user_id=req.user_id, date_iso=req.date_iso,
-                            summary=parsed.get("summary",""),
-                            schedule=schedule,
-                            suggestions=parsed.get("suggestions",[]),
-                            rebalanced_tasks=parsed.get("rebalanced_tasks",[]),
-                            shifted_tasks=validated_shifted_tasks,
-                            metadata={"model": GEMINI_MODEL, "retrieved_docs": len(polished_docs), "validation": {"moved_back": len(moved_back_to_schedule)}})
+    # persist policy log and optionally push to frontend (store details in your DB in production)
+    # For demo: write a small json to logs/
+    os.makedirs("logs", exist_ok=True)
+    with open("logs/plan_requests.log", "a") as f:
+        f.write(json.dumps({"ts": datetime.utcnow().isoformat(), "user_id": req.user_id, "payload": parsed}) + "\n")
+
+    # send realtime update to frontend (best-effort)
+    if notify:
+        _notify(req.user_id, {"type":"plan","payload":parsed})
+
+    return PlanResponse(user_id=req.user_id, date_iso=req.date_iso,
+                        summary=parsed.get("summary",""),
+                        schedule=schedule,
+                        suggestions=parsed.get("suggestions",[]),
+                        rebalanced_tasks=parsed.get("rebalanced_tasks",[]),
+                        shifted_tasks=validated_shifted_tasks,
+                        metadata={"model": GEMINI_MODEL, "retrieved_docs": len(polished_docs), "validation": {"moved_back": len(moved_back_to_schedule)}})
+
+@router.post("/plan", response_model=PlanResponse)
+def plan(req: PlanRequest):
+    table = None
+    try:
+        # Task features are computed once and shared by every stage, including the fallback
+        table = TaskTable([t.dict(exclude_none=True) for t in req.tasks], req.date_iso, plan_tz(req.available_times, req.date_iso))
+
+        # Typical plans are scheduled locally; only large ones go to the LLM planner
+        if 0 < len(req.tasks) <= PLANNER_LOCAL_MAX_TASKS:
+            return _plan_locally(req, table=table)
+
+        polished_docs, context_text = _plan_context(req)
+        return _plan_with_llm(req, polished_docs, context_text, table=table)
     except Exception as e:
         import traceback
         error_msg = f"Error in plan endpoint: {str(e)}\n{traceback.format_exc()}"
         print(error_msg)
         # Return a fallback response instead of crashing
         try:
-            schedule = fallback_scheduler(req.available_times or [], [t.dict() for t in req.tasks], [c.dict() for c in (req.classes or [])], req.date_iso)
+            schedule = fallback_scheduler(req.available_times or [], [t.dict() for t in req.tasks], [c.dict() for c in (req.classes or [])], req.date_iso, table=table)
         except Exception as fallback_error:
             print(f"Fallback scheduler also failed: {fallback_error}")
             schedule = []
@@ -397,6 +457,89 @@ Rules:
                             shifted_tasks=[],
                             metadata={"model": GEMINI_MODEL, "error": str(e), "retrieved_docs": len(polished_docs) if 'polished_docs' in locals() else 0})
 
+@router.post("/plan/range", response_model=PlanRangeResponse)
+def plan_range(req: PlanRangeRequest):
+    """
+    Plan every day from start_date_iso to end_date_iso (inclusive) in one pass.
+    Context is retrieved once for the whole range, tasks shifted off a day are
+    planned on the next one, and each day is pushed over the websocket as soon
+    as it is planned ("plan_range_day"). One summary covers the whole range.
+    """
+    try:
+        start_dt = parser.isoparse(req.start_date_iso).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+        end_dt = parser.isoparse(req.end_date_iso).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+    except Exception:
+        raise HTTPException(status_code=400, detail="start_date_iso and end_date_iso must be ISO dates")
+    # Every day is planned in the range's timezone, so times are comparable across days
+    range_tz = plan_tz(req.available_times, req.start_date_iso)
+    num_days = (end_dt - start_dt).days + 1
+    if num_days < 1 or num_days > PLAN_RANGE_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range must cover 1 to {PLAN_RANGE_MAX_DAYS} days")
+
+    tasks = [t.dict(exclude_none=True) for t in req.tasks]
+    # The task list only shrinks from day to day, so this decides whether any day needs the LLM
+    polished_docs, context_text = [], ""
+    if len(tasks) > PLANNER_LOCAL_MAX_TASKS:
+        polished_docs, context_text = _plan_context(req)
+
+    # Default study windows only apply when the request gives none at all; otherwise a
+    # day without windows has no free time (shiftable tasks move on, must-stay ones overflow)
+    use_default_windows = not req.available_times
+
+    days = []
+    for i in range(num_days):
+        day = start_dt + timedelta(days=i)
+        day_iso = day.date().isoformat()
+        day_windows = windows_on_day(req.available_times, day, range_tz)
+        day_req = PlanRequest(
+            user_id=req.user_id,
+            date_iso=day_iso,
+            available_times=day_windows,
+            tasks=[Task(**t) for t in tasks],
+            classes=[c for c in (req.classes or []) if class_on_day(c.dict(exclude_none=True), day, range_tz)],
+            preferences=req.preferences,
+            user_profile=req.user_profile,
+            task_patterns=req.task_patterns,
+            completion_history=req.completion_history
+        )
+        table = TaskTable(tasks, day, range_tz)
+        try:
+            if not tasks:
+                day_plan = PlanResponse(user_id=req.user_id, date_iso=day_iso, summary="Nothing left to plan",
+                                        schedule=[], suggestions=[], metadata={"engine": "local"})
+            elif len(tasks) <= PLANNER_LOCAL_MAX_TASKS or not (day_windows or use_default_windows):
+                # (a day without free time is left to the local planner: nothing to ask the LLM)
+                day_plan = _plan_locally(day_req, narrate=False, notify=False, table=table,
+                                         use_default_windows=use_default_windows)
+            else:
+                day_plan = _plan_with_llm(day_req, polished_docs, context_text, notify=False, table=table)
+        except Exception as e:
+            print(f"Error planning {day_iso} in range: {e}")
+            schedule = fallback_scheduler(day_req.available_times, tasks, [c.dict() for c in day_req.classes], day_iso,
+                                          table=table, use_default_windows=use_default_windows)
+            day_plan = PlanResponse(user_id=req.user_id, date_iso=day_iso,
+                                    summary="Error generating plan - using fallback schedule",
+                                    schedule=schedule, suggestions=["Error occurred. Using fallback scheduler."],
+                                    metadata={"model": GEMINI_MODEL, "engine": "fallback", "error": str(e)})
+        days.append(day_plan)
+        _notify(req.user_id, {"type": "plan_range_day", "payload": {"day": i + 1, "days": num_days, **day_plan.dict()}})
+        tasks = carry_forward(tasks, day_plan.schedule, day_plan.shifted_tasks)
+
+    # Tasks still carried after the last day are shifted past the range
+    shifted_tasks = days[-1].shifted_tasks
+    label = f"{start_dt.date().isoformat()} to {end_dt.date().isoformat()}" if num_days > 1 else start_dt.date().isoformat()
+    summary, suggestions = _narrate(label, {
+        "schedule": [s for d in days for s in d.schedule],
+        "shifted_tasks": shifted_tasks,
+        "overflow": sum(d.metadata.get("overflow", 0) for d in days)
+    }, req.completion_history)
+    _notify(req.user_id, {"type": "plan_range", "payload": {"summary": summary, "suggestions": suggestions, "shifted_tasks": shifted_tasks}})
+
+    return PlanRangeResponse(user_id=req.user_id, start_date_iso=req.start_date_iso, end_date_iso=req.end_date_iso,
+                             summary=summary, suggestions=suggestions, days=days, shifted_tasks=shifted_tasks,
+                             metadata={"model": GEMINI_MODEL, "days": num_days, "retrieved_docs": len(polished_docs),
+                                       "llm_days": sum(1 for d in days if "engine" not in d.metadata)})
+
 @router.post("/complete")
 def complete(req: CompleteReq):
     # compute simple reward and append to completions log for offline training
@@ -417,7 +560,7 @@ def complete(req: CompleteReq):
         f.write(json.dumps(log) + "\n")
     # trigger optional immediate small rebalancer (here done synchronously for simplicity)
     # In production enqueue async rebalancer
-    asyncio.create_task(ws_manager.send_json(req.user_id, {"type":"complete","payload":log}))
+    _notify(req.user_id, {"type":"complete","payload":log})
     return {"status":"ok","reward":reward}
 
 @router.post("/rebalance")
@@ -438,6 +581,30 @@ def rebalance(req: dict):
     if not user_id or not date_iso:
         return {"error": "user_id and date_iso are required"}
     
+    # Typical rebalances are scheduled locally; the LLM only narrates. Rebalancing
+    # today only uses the time that's left (existing_plan slots aren't reused:
+    # the incomplete tasks are planned afresh)
+    if 0 < len(incomplete_tasks) <= PLANNER_LOCAL_MAX_TASKS:
+        typical_capacity = completion_history.get("typicalCapacity") or max(4, int(len(incomplete_tasks) * 0.75))
+        planned = local_plan(incomplete_tasks, date_iso, capacity=typical_capacity,
+                             not_before=datetime.now().astimezone())
+        summary, suggestions = _narrate(date_iso[:10], planned, completion_history)
+        parsed = {"summary": summary, "schedule": planned["schedule"], "suggestions": suggestions, "shifted_tasks": planned["shifted_tasks"]}
+        _notify(user_id, {"type": "rebalance", "payload": parsed})
+        priorities = [s["priority"] for s in planned["schedule"]]
+        return {
+            "user_id": user_id,
+            "date_iso": date_iso,
+            **parsed,
+            "metadata": {
+                "tasksKept": len(planned["schedule"]),
+                "tasksShifted": len(planned["shifted_tasks"]),
+                "priorityBreakdown": {p: priorities.count(p) for p in ("high", "medium", "low")},
+                "model": GEMINI_MODEL,
+                "engine": "local"
+            }
+        }
+    
     # Get context for rebalancing
     context_docs = retrieve_user_context(
         user_id,
@@ -457,7 +624,7 @@ def rebalance(req: dict):
         polished_docs,
         user_profile=user_profile if user_profile else {},
         completion_history=completion_history if completion_history else {},
-        max_length=2000
+        max_tokens=500
     )
     
     # Build user context string
@@ -618,7 +785,7 @@ Rules:
                 item["id"] = str(uuid.uuid4())
         
         # Send realtime update
-        asyncio.create_task(ws_manager.send_json(user_id, {"type": "rebalance", "payload": parsed}))
+        _notify(user_id, {"type": "rebalance", "payload": parsed})
         
         return {
             "user_id": user_id,
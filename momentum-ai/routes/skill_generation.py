@@ -5,11 +5,17 @@ from datetime import datetime, timedelta
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
-from ai_client import call_gemini_generate
-from utils import retrieve_user_context
+from ai_client import acall_gemini_generate
+from utils import aretrieve_user_context, user_context_generation
+from config import SEMANTIC_CACHE_TTL_SKILL_SUGGESTIONS
+from semantic_cache import SemanticCache
 
 router = APIRouter()
 
+# Near-identical profiles get the earlier suggestions. Scoped per user and per
+# version of the user's documents, since the prompt includes retrieved memory.
+_suggestions_cache = SemanticCache("skill suggestions", SEMANTIC_CACHE_TTL_SKILL_SUGGESTIONS)
+
 class SkillSuggestionRequest(BaseModel):
     user_id: str
     courses: List[Dict[str, Any]] = []
@@ -63,9 +69,25 @@ class SkillRoadmapResponse(BaseModel):
 async def generate_skill_suggestions(req: SkillSuggestionRequest):
     """Generate AI-powered skill suggestions based on user data"""
     try:
+        # Suggestions depend on the user's stored context, so they're only cached while
+        # its generation is known (put is a no-op without a lookup vector)
+        generation = user_context_generation(req.user_id)
+        cache_scope = f"{req.user_id}:{generation}"
+        cached, cache_vec = None, None
+        if generation is not None:
+            cached, cache_vec = await _suggestions_cache.aget(cache_scope, {
+                "courses": [c.get('courseName', c.get('name', '')) for c in req.courses[:5]],
+                "existing_skills": [s.get('name', '') for s in req.existing_skills[:5]],
+                "education_level": req.education_level,
+                "major": req.major,
+                "unstructured_context": req.unstructured_context
+            })
+        if cached is not None:
+            return SkillSuggestionsResponse(suggestions=cached)
+        
         # Retrieve user context from ChromaDB
         context_query = "skills learning goals career development"
-        context_docs = retrieve_user_context(
+        context_docs = await aretrieve_user_context(
             req.user_id,
             context_query,
             k=5,
@@ -126,7 +148,7 @@ Generate 3-5 suggestions. Focus on skills that are:
 - Achievable for their level"""
 
         # Generate suggestions using Gemini
-        raw_response = call_gemini_generate(prompt, use_fast_model=True)
+        raw_response = await acall_gemini_generate(prompt, use_fast_model=True)
         
         # Parse JSON response
         try:
@@ -172,6 +194,7 @@ Generate 3-5 suggestions. Focus on skills that are:
                 ]
                 suggestions.extend(fallbacks[:3 - len(suggestions)])
             
+            _suggestions_cache.put(cache_scope, cache_vec, [s.dict() for s in suggestions[:5]])
             return SkillSuggestionsResponse(suggestions=suggestions[:5])
             
         except Exception as e:
@@ -211,7 +234,7 @@ async def generate_skill_roadmap(req: SkillRoadmapRequest):
     try:
         # Retrieve user context from ChromaDB
         context_query = f"{req.skill_name} learning roadmap resources"
-        context_docs = retrieve_user_context(
+        context_docs = await aretrieve_user_context(
             req.user_id,
             context_query,
             k=5,
@@ -320,7 +343,7 @@ Return ONLY a JSON object with this exact structure:
 Make the roadmap realistic, achievable, and personalized to the user's background."""
 
         # Generate roadmap using Gemini
-        raw_response = call_gemini_generate(prompt, use_fast_model=True)
+        raw_response = await acall_gemini_generate(prompt, use_fast_model=True)
         
         # Parse JSON response
         try:
@@ -1,145 +1,532 @@
 # scheduler.py
+import bisect
+import math
 import uuid
 from datetime import timedelta, datetime
 from dateutil import parser
+from config import CLASS_DEFAULT_MINUTES
 
-def fallback_scheduler(available_times, tasks, classes, plan_date=None):
+def fallback_scheduler(available_times, tasks, classes, plan_date=None, table=None, use_default_windows=True):
     """
     Fallback scheduler that respects due dates and priorities.
     Prioritizes tasks due today/tomorrow, in-progress, and high priority.
+    Tasks go into the earliest free time that fits (windows minus classes);
+    a task that doesn't fit anywhere is left out and later ones still backfill.
+    Without valid windows the default ones are used, or nothing is scheduled if
+    use_default_windows is False.
     """
-    windows = [(parser.isoparse(w.start_iso), parser.isoparse(w.end_iso)) for w in available_times] if available_times else []
     schedule = []
     
-    if not windows:
-        # If no available times, create default windows (9 AM - 5 PM)
-        if plan_date:
-            base_date = parser.isoparse(plan_date) if isinstance(plan_date, str) else plan_date
-        else:
-            base_date = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0)
-        windows = [
-            (base_date.replace(hour=9), base_date.replace(hour=12)),
-            (base_date.replace(hour=13), base_date.replace(hour=17))
-        ]
-    
     if not tasks:
         return schedule
     
-    # Get plan date for due date comparison
-    if plan_date:
-        plan_dt = parser.isoparse(plan_date) if isinstance(plan_date, str) else plan_date
-    else:
-        plan_dt = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    tomorrow = plan_dt + timedelta(days=1)
-    day_after_tomorrow = plan_dt + timedelta(days=2)
+    # Deadlines and priorities are parsed once per request (reuse the caller's table if given).
+    # Times are planned in the table's timezone and emitted with its offset.
+    table = table or TaskTable(tasks, plan_date, plan_tz(available_times, plan_date))
+    tz = table.tz
     
-    # Categorize tasks
-    must_schedule = []  # Due today/tomorrow, in-progress, high priority
-    can_schedule = []    # Other tasks
+    # Windows that are missing, unparseable or empty are ignored
+    windows = [(_parse_dt(w.start_iso, tz), _parse_dt(w.end_iso, tz)) for w in (available_times or [])]
+    windows = [(s, e) for s, e in windows if s and e and e > s]
     
-    for t in tasks:
-        due_date = None
-        due_str = t.get("deadline_iso") or t.get("dueDate")
-        if due_str:
-            try:
-                due_date = parser.isoparse(due_str) if isinstance(due_str, str) else due_str
-                if due_date.tzinfo:
-                    due_date = due_date.replace(tzinfo=None)
-            except:
-                pass
-        
-        status = t.get("status", "pending").lower()
-        priority = t.get("priority", "medium").lower()
-        
-        # Check if task must be scheduled
-        must_schedule_task = (
-            (due_date and due_date <= tomorrow) or  # Due today/tomorrow
-            status == "in-progress" or  # In-progress
-            priority == "high" or  # High priority
-            t.get("examId") or "exam" in t.get("title", "").lower()  # Exam-related
-        )
-        
-        if must_schedule_task:
-            must_schedule.append(t)
-        else:
-            can_schedule.append(t)
-    
-    # Sort must-schedule tasks: due today first, then in-progress, then high priority
-    def sort_key_must(t):
-        due_str = t.get("deadline_iso") or t.get("dueDate")
-        due_date = None
-        if due_str:
-            try:
-                due_date = parser.isoparse(due_str) if isinstance(due_str, str) else due_str
-                if due_date.tzinfo:
-                    due_date = due_date.replace(tzinfo=None)
-            except:
-                pass
-        
-        status = t.get("status", "pending").lower()
-        priority = t.get("priority", "medium").lower()
-        
-        # Priority order: due today (0), due tomorrow (1), in-progress (2), high priority (3)
-        if due_date and due_date.date() == plan_dt.date():
-            return (0, due_date)
-        elif due_date and due_date <= tomorrow:
-            return (1, due_date)
-        elif status == "in-progress":
-            return (2, datetime.max)
-        elif priority == "high":
-            return (3, datetime.max)
-        else:
-            return (4, due_date or datetime.max)
-    
-    # Sort can-schedule tasks: by priority and due date
-    def sort_key_can(t):
-        due_str = t.get("deadline_iso") or t.get("dueDate")
-        due_date = None
-        if due_str:
-            try:
-                due_date = parser.isoparse(due_str) if isinstance(due_str, str) else due_str
-                if due_date.tzinfo:
-                    due_date = due_date.replace(tzinfo=None)
-            except:
-                pass
-        
-        priority_map = {"high": 0, "medium": 1, "low": 2}
-        priority_val = priority_map.get(t.get("priority", "medium").lower(), 1)
-        
-        return (priority_val, due_date or datetime.max)
-    
-    must_schedule_sorted = sorted(must_schedule, key=sort_key_must)
-    can_schedule_sorted = sorted(can_schedule, key=sort_key_can)
+    if not windows:
+        if not use_default_windows:
+            return schedule
+        # If no available times, create default windows (9 AM - 12 PM, 1 PM - 5 PM)
+        windows = default_windows(table.plan_dt)
     
-    # Combine: must-schedule first, then can-schedule
-    tasks_sorted = must_schedule_sorted + can_schedule_sorted
+    # Must-schedule first (due today/tomorrow, in-progress, high priority, exam-related), then the rest
+    rows_sorted = table.must_stay + table.can_shift
     
-    w_idx = 0
-    cur = windows[0][0]
+    # Classes on any day the windows cover are busy time
+    first_day = min(start for start, _ in windows)
+    last_day = max(end for _, end in windows)
+    free = FreeTimeIndex(windows, class_blocks(classes, first_day, last_day, tz=tz))
     
-    for t in tasks_sorted:
-        minutes = int(t.get("estimated_minutes") or t.get("estimatedMinutes") or 30)
-        end = cur + timedelta(minutes=minutes)
-        
-        if end > windows[w_idx][1]:
-            w_idx += 1
-            if w_idx >= len(windows):
-                break
-            cur = windows[w_idx][0]
-            end = cur + timedelta(minutes=minutes)
+    for row in rows_sorted:
+        # Same duration as the local planner (hours, multi-day split and progress included)
+        t, minutes = row["task"], row["minutes"]
+        slot = free.allocate(minutes)
+        if slot is None:
+            continue
+        cur, end = slot
         
         schedule.append({
             "id": t.get("id") or str(uuid.uuid4()),
             "task_id": t.get("id") or t.get("sourceId"),
             "title": t.get("title", "Task"),
             "type": t.get("type", "task"),
-            "start": cur.isoformat(),
-            "end": end.isoformat(),
+            "start": _iso(cur, tz),
+            "end": _iso(end, tz),
             "priority": t.get("priority", "medium"),
             "estimated_minutes": minutes,
             "notes": t.get("notes") or ""
         })
-        cur = end
     
+    schedule.sort(key=lambda s: s["start"])
     return schedule
 
+
+
+# ---------------------------------------------------------------------------
+# Free time and the local planner: the same rules the /plan and /rebalance
+# prompts give the LLM, applied directly (must-stay rules, capacity, shifting,
+# no overlap with classes)
+# ---------------------------------------------------------------------------
+
+PRIORITY_RANK = {"high": 0, "medium": 1, "low": 2}
+
+
+# Planning works on naive wall-clock times in the plan's timezone (plan_tz):
+# aware inputs are converted into it, and emitted times get it back (_iso)
+
+def _naive(dt, tz=None):
+    """Wall-clock time of dt in tz, without tzinfo (an aware dt just loses its offset if tz is None)"""
+    if dt is None or not dt.tzinfo:
+        return dt
+    return (dt.astimezone(tz) if tz else dt).replace(tzinfo=None)
+
+
+def _parse_dt(value, tz=None):
+    """Parse an ISO date/datetime (or pass a datetime through) as wall-clock time in tz; None if missing or invalid"""
+    if not value:
+        return None
+    try:
+        return _naive(parser.isoparse(value) if isinstance(value, str) else value, tz)
+    except Exception:
+        return None
+
+
+def plan_tz(available_times=None, plan_date=None):
+    """Timezone of a plan: the first window's offset, else plan_date's; None if both are naive"""
+    for w in available_times or []:
+        try:
+            return parser.isoparse(w.start_iso).tzinfo
+        except Exception:
+            continue
+    try:
+        return (parser.isoparse(plan_date) if isinstance(plan_date, str) else plan_date).tzinfo
+    except Exception:
+        return None
+
+
+def _iso(dt, tz=None):
+    """ISO string for a wall-clock time in tz (with its offset when tz is known)"""
+    return (dt.replace(tzinfo=tz) if tz else dt).isoformat()
+
+
+def _priority_name(priority) -> str:
+    """high/medium/low for string priorities or integer ones (1 = high, 2 = medium, 3+ = low)"""
+    if isinstance(priority, (int, float)):
+        return "high" if priority <= 1 else "medium" if priority == 2 else "low"
+    priority = (priority or "medium").lower()
+    return priority if priority in PRIORITY_RANK else "medium"
+
+
+def _task_minutes(t) -> int:
+    """Minutes to schedule today: the estimate, split across multi-day tasks, less progress made"""
+    hours = t.get("estimated_hours") or t.get("estimatedHours")
+    minutes = hours * 60 if hours else (t.get("estimated_minutes") or t.get("estimatedMinutes") or 30)
+    days = t.get("daysAllocated") or 1
+    if days > 1:
+        minutes /= days
+    progress = t.get("progressPercentage") or 0
+    if 0 < progress < 100:
+        minutes *= (100 - progress) / 100
+    return max(15, int(round(minutes)))
+
+
+def _must_stay_reason(t, due_date, tomorrow):
+    """Why a task can't be shifted to another day ("" if it can)"""
+    if due_date and due_date <= tomorrow:
+        return "due today or tomorrow"
+    if (t.get("status") or "pending").lower() == "in-progress":
+        return "in-progress"
+    if _priority_name(t.get("priority")) == "high":
+        return "high priority"
+    if t.get("examId") or "exam" in (t.get("title") or "").lower():
+        return "exam-related"
+    return ""
+
+
+def _parse_clock(value):
+    """(hour, minute) from "HH:MM", "H:MM AM/PM" or an ISO datetime; None if unparseable"""
+    if not value:
+        return None
+    try:
+        parsed = parser.parse(value)
+        return parsed.hour, parsed.minute
+    except Exception:
+        return None
+
+
+def _has_date(value) -> bool:
+    """True for full datetimes ("2025-01-20T09:00"), False for times of day ("09:00")"""
+    return isinstance(value, str) and len(value) > 8 and "-" in value[:10]
+
+
+def class_on_day(c, day, tz=None) -> bool:
+    """
+    True if class entry c (a dict) is held on day's date: classes with a full
+    datetime only on that date (in tz), others on their weekday ("Mon" or
+    "Monday") or, without one, every day.
+    """
+    time_value = c.get("time")
+    if _has_date(time_value):
+        start_dt = _parse_dt(time_value, tz)
+        return bool(start_dt) and start_dt.date() == day.date()
+    day_name = (c.get("day") or "").lower()[:3]
+    return not day_name or day.strftime("%A").lower().startswith(day_name)
+
+
+def windows_on_day(available_times, day, tz=None):
+    """The TimeRange-like windows in available_times that start on day's date (in tz)"""
+    on_day = []
+    for w in available_times or []:
+        start = _parse_dt(w.start_iso, tz)
+        if start is not None and start.date() == day.date():
+            on_day.append(w)
+    return on_day
+
+
+def _class_clock(value, tz=None):
+    """(hour, minute) of a class time; full datetimes are read as wall-clock time in tz"""
+    if _has_date(value):
+        parsed = _parse_dt(value, tz)
+        return (parsed.hour, parsed.minute) if parsed else None
+    return _parse_clock(value)
+
+
+def class_blocks(classes, first_day, last_day=None, tz=None):
+    """Busy (start, end) blocks for classes between first_day and last_day (inclusive, default first_day), in tz"""
+    first_day = first_day.replace(hour=0, minute=0, second=0, microsecond=0)
+    last_day = (last_day or first_day).replace(hour=0, minute=0, second=0, microsecond=0)
+    days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+
+    blocks = []
+    for c in classes or []:
+        start = _class_clock(c.get("time"), tz)
+        if start is None:
+            continue
+        end = _class_clock(c.get("end_time"), tz)
+        for day in days:
+            if not class_on_day(c, day, tz):
+                continue
+            start_dt = day.replace(hour=start[0], minute=start[1])
+            end_dt = day.replace(hour=end[0], minute=end[1]) if end else None
+            if end_dt is None or end_dt <= start_dt:
+                end_dt = start_dt + timedelta(minutes=CLASS_DEFAULT_MINUTES)
+            blocks.append((start_dt, end_dt))
+    return blocks
+
+
+def default_windows(plan_dt):
+    """Study windows used when the request has none (9-12 and 13-17)"""
+    return [
+        (plan_dt.replace(hour=9, minute=0, second=0, microsecond=0), plan_dt.replace(hour=12, minute=0, second=0, microsecond=0)),
+        (plan_dt.replace(hour=13, minute=0, second=0, microsecond=0), plan_dt.replace(hour=17, minute=0, second=0, microsecond=0))
+    ]
+
+
+def _merge(intervals):
+    """Sorted union of (start, end) intervals"""
+    merged = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def free_intervals(windows, blocks):
+    """Sorted, non-overlapping free (start, end) intervals: windows minus busy blocks"""
+    windows, blocks = _merge(windows), _merge(blocks)
+    free = []
+    b = 0
+    for w_start, w_end in windows:
+        # Skip blocks that end before this window (windows are sorted, so for good)
+        while b < len(blocks) and blocks[b][1] <= w_start:
+            b += 1
+        cur = w_start
+        j = b
+        while j < len(blocks) and blocks[j][0] < w_end:
+            if blocks[j][0] > cur:
+                free.append((cur, blocks[j][0]))
+            cur = max(cur, blocks[j][1])
+            j += 1
+        if cur < w_end:
+            free.append((cur, w_end))
+    return free
+
+
+class FreeTimeIndex:
+    """
+    Free time for scheduling: windows minus busy blocks, as a sorted set of gaps.
+
+    Tasks take time from the start of a gap, so gaps only shrink and their order
+    never changes. A max-segment tree over gap lengths finds the earliest gap a
+    task fits in (backfilling gaps skipped by longer tasks) in O(log n), and a
+    sorted (length, position) list finds the tightest-fitting gap by bisection.
+    """
+
+    def __init__(self, windows, blocks=()):
+        gaps = free_intervals(windows, blocks)
+        self.starts = [s for s, _ in gaps]
+        self.ends = [e for _, e in gaps]
+        self._size = 1
+        while self._size < len(gaps):
+            self._size *= 2
+        # Gap lengths in seconds: leaves at _size + i, each parent is the max of its children
+        self._tree = [0.0] * (2 * self._size)
+        for i in range(len(gaps)):
+            self._tree[self._size + i] = self._length(i)
+        for node in range(self._size - 1, 0, -1):
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+        self._by_length = sorted((self._length(i), i) for i in range(len(gaps)))
+
+    def _length(self, i) -> float:
+        return (self.ends[i] - self.starts[i]).total_seconds()
+
+    def _earliest(self, need: float):
+        if not self.starts or self._tree[1] < need:
+            return None
+        node = 1
+        while node < self._size:
+            node = 2 * node if self._tree[2 * node] >= need else 2 * node + 1
+        return node - self._size
+
+    def _best(self, need: float):
+        k = bisect.bisect_left(self._by_length, (need, -1))
+        return self._by_length[k][1] if k < len(self._by_length) else None
+
+    def allocate(self, minutes, best_fit: bool = False):
+        """
+        Reserve minutes in the earliest gap that fits (or the smallest one with
+        best_fit). Returns (start, end), or None if no gap is long enough.
+        """
+        need = minutes * 60
+        i = self._best(need) if best_fit else self._earliest(need)
+        if i is None:
+            return None
+        start = self.starts[i]
+        end = start + timedelta(minutes=minutes)
+
+        old_length = self._length(i)
+        self.starts[i] = end
+        new_length = self._length(i)
+        del self._by_length[bisect.bisect_left(self._by_length, (old_length, i))]
+        bisect.insort(self._by_length, (new_length, i))
+        node = self._size + i
+        self._tree[node] = new_length
+        node //= 2
+        while node:
+            self._tree[node] = max(self._tree[2 * node], self._tree[2 * node + 1])
+            node //= 2
+        return start, end
+
+    @property
+    def free_minutes(self) -> int:
+        return int(sum(length for length, _ in self._by_length) // 60)
+
+
+class TaskTable:
+    """
+    Task features for one plan, computed once and shared by every planning stage.
+    Each row is a dict:
+      task      the task dict
+      id        id (or sourceId)
+      due       parsed deadline (wall-clock time in tz, or None)
+      priority  "high" | "medium" | "low"; rank is 0 | 1 | 2
+      minutes   minutes to schedule today (see _task_minutes)
+      reason    why the task must stay today ("" if it can be shifted)
+    by_id indexes rows by both id and sourceId. tz is the plan's timezone (plan_tz).
+    """
+
+    def __init__(self, tasks, plan_date=None, tz=None):
+        self.tz = tz
+        # The plan date is a calendar day, so it isn't converted (only its offset dropped)
+        self.plan_dt = (_parse_dt(plan_date) or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.next_day = self.plan_dt + timedelta(days=1)
+        self.rows = []
+        self.by_id = {}
+        for t in tasks or []:
+            due = _parse_dt(t.get("deadline_iso") or t.get("dueDate"), tz)
+            priority = _priority_name(t.get("priority"))
+            row = {
+                "task": t,
+                "id": t.get("id") or t.get("sourceId"),
+                "due": due,
+                "priority": priority,
+                "rank": PRIORITY_RANK[priority],
+                "minutes": _task_minutes(t),
+                "reason": _must_stay_reason(t, due, self.next_day)
+            }
+            self.rows.append(row)
+            for key in (t.get("id"), t.get("sourceId")):
+                if key and key not in self.by_id:
+                    self.by_id[key] = row
+
+    def get(self, task_id):
+        """Row for a task id or sourceId (None if unknown)"""
+        return self.by_id.get(task_id) if task_id else None
+
+    @property
+    def must_stay(self):
+        """Rows that can't be shifted, most urgent first"""
+        return sorted((r for r in self.rows if r["reason"]), key=self.must_stay_order)
+
+    @property
+    def can_shift(self):
+        """Rows that may be shifted, most important first"""
+        return sorted((r for r in self.rows if not r["reason"]), key=self.shift_order)
+
+    def must_stay_order(self, row):
+        """Due today, due tomorrow, in-progress, high priority, then the rest by deadline"""
+        due = row["due"]
+        if due and due.date() == self.plan_dt.date():
+            return (0, due)
+        if due and due <= self.next_day:
+            return (1, due)
+        if row["reason"] == "in-progress":
+            return (2, datetime.max)
+        if row["reason"] == "high priority":
+            return (3, datetime.max)
+        return (4, due or datetime.max)
+
+    @staticmethod
+    def shift_order(row):
+        """Higher priority, then earlier deadline"""
+        return (row["rank"], row["due"] or datetime.max)
+
+
+def local_plan(tasks, plan_date, available_times=None, classes=None, capacity=None, retention=0.5, table=None,
+               not_before=None, use_default_windows=True):
+    """
+    Deterministic plan for one day, following the planning prompt's rules:
+    - Must-stay tasks (due today/tomorrow, in-progress, high priority, exam-related) are always kept
+    - If there are more than capacity + 1 tasks, the least important shiftable ones move
+      to the next day, but at least `retention` of all tasks stay
+    - Kept tasks are ordered by deadline and priority and placed earliest-first into
+      the free time (windows minus classes), backfilling earlier gaps
+    - A shiftable task with no free slot left is shifted; a must-stay task with no slot
+      is appended after the last window and marked as overflow
+    tasks / classes are dicts (Task.dict()); available_times are TimeRange-like objects.
+    table is the request's TaskTable for tasks, if the caller already built one; its
+    tz is the plan's timezone (else plan_tz), and emitted times carry that offset.
+    not_before (e.g. the current time when replanning today) is the earliest a task
+    may start on the plan date; naive values are wall-clock time in tz.
+    Without valid windows the default ones (9-12, 13-17) are used; with
+    use_default_windows=False the day has no free time instead (shiftable tasks
+    shift, must-stay tasks overflow from 9:00).
+    Returns {"schedule", "shifted_tasks", "must_stay", "overflow"}.
+    """
+    table = table or TaskTable(tasks, plan_date, plan_tz(available_times, plan_date))
+    plan_dt, next_day, tz = table.plan_dt, table.next_day, table.tz
+
+    windows = [(_parse_dt(w.start_iso, tz), _parse_dt(w.end_iso, tz)) for w in (available_times or [])]
+    windows = [(s, e) for s, e in windows if s and e and e > s]
+    if not windows and use_default_windows:
+        windows = default_windows(plan_dt)
+    blocks = class_blocks(classes, plan_dt, tz=tz)
+    not_before = _naive(not_before, tz)
+    if not_before is not None and not_before.date() == plan_dt.date():
+        # The part of the day that has already passed is busy
+        blocks.append((plan_dt, not_before))
+    else:
+        not_before = None
+    free = FreeTimeIndex(windows, blocks)
+
+    must, can = table.must_stay, table.can_shift
+
+    # Capacity: keep everything when within capacity + 1, else the most important
+    total = len(must) + len(can)
+    capacity = int(capacity) if capacity else total
+    if total <= capacity + 1:
+        keep_count = len(can)
+    else:
+        keep_count = max(capacity - len(must), 0)
+    keep_count = max(keep_count, math.ceil(total * retention) - len(must), 0)
+    kept, shifted = must + can[:keep_count], [(e, "Capacity limit") for e in can[keep_count:]]
+
+    schedule = []
+    overflow = 0
+    # Overflow goes after the last window (from the usual 9:00 start on a day without any)
+    windows_end = max(end for _, end in windows) if windows else default_windows(plan_dt)[0][0]
+    last_end = max(windows_end, not_before) if not_before else windows_end
+    outside_note = " (after your study windows)" if windows else " (no study time on this day)"
+    for e in kept:
+        t = e["task"]
+        minutes = e["minutes"]
+        slot = free.allocate(minutes)
+        if slot is None:
+            if not e["reason"]:
+                shifted.append((e, "No free time left today"))
+                continue
+            # Must stay: schedule after the last window rather than drop it
+            slot = (last_end, last_end + timedelta(minutes=minutes))
+            last_end = slot[1]
+            overflow += 1
+        notes = f"Must stay: {e['reason']}" if e["reason"] else (t.get("notes") or "")
+        if slot[0] >= windows_end:
+            notes += outside_note
+        schedule.append({
+            "id": str(uuid.uuid4()),
+            "task_id": t.get("id") or t.get("sourceId"),
+            "title": t.get("title", "Task"),
+            "type": t.get("type", "task"),
+            "start": _iso(slot[0], tz),
+            "end": _iso(slot[1], tz),
+            "priority": e["priority"],
+            "estimated_minutes": minutes,
+            "notes": notes
+        })
+    schedule.sort(key=lambda s: s["start"])
+
+    shifted_tasks = []
+    for e, reason in shifted:
+        t = e["task"]
+        # Keep a later deadline; only tasks without one get the next day
+        new_due = max(e["due"], next_day) if e["due"] else next_day
+        shifted_tasks.append({
+            "task_id": t.get("id") or t.get("sourceId"),
+            "title": t.get("title", "Task"),
+            "type": t.get("type", "task"),
+            "newDueDate": new_due.date().isoformat(),
+            "newStartDate": next_day.date().isoformat() if t.get("startDate") else None,
+            "reason": reason
+        })
+
+    return {"schedule": schedule, "shifted_tasks": shifted_tasks, "must_stay": len(must), "overflow": overflow}
+
+
+def _task_key(task_id, title):
+    return task_id or title
+
+
+def carry_forward(tasks, schedule, shifted_tasks):
+    """
+    Tasks left for the next day of a range plan, given one day's schedule and
+    shifted_tasks: shifted (or unplanned) tasks with their new dates, and
+    scheduled multi-day tasks that have days left.
+    """
+    scheduled = {_task_key(s.get("task_id"), s.get("title")) for s in schedule}
+    shifted = {_task_key(s.get("task_id"), s.get("title")): s for s in shifted_tasks}
+    carried = []
+    for t in tasks:
+        key = _task_key(t.get("id") or t.get("sourceId"), t.get("title"))
+        if key in scheduled:
+            if (t.get("currentDay") or 1) < (t.get("daysAllocated") or 1):
+                carried.append({**t, "currentDay": (t.get("currentDay") or 1) + 1})
+            continue
+        t = dict(t)
+        moved = shifted.get(key) or {}
+        if moved.get("newDueDate"):
+            t["dueDate"] = t["deadline_iso"] = moved["newDueDate"]
+        if moved.get("newStartDate"):
+            t["startDate"] = moved["newStartDate"]
+        carried.append(t)
+    return carried
@@ -0,0 +1,84 @@
+# semantic_cache.py - Near-duplicate response cache for side-effect-free endpoints
+import copy
+import json
+import threading
+import time
+from typing import Any, Optional
+import numpy as np
+from cachetools import TTLCache
+from config import SEMANTIC_CACHE, SEMANTIC_CACHE_THRESHOLD
+from ai_client import gemini_embedding, agemini_embedding
+
+
+class SemanticCache:
+    """
+    Answers near-duplicate requests to one endpoint with an earlier response.
+    The endpoint passes its request inputs; they are normalized to text and embedded
+    (repeat texts hit the embedding cache, so exact repeats cost no API call). A
+    lookup returns the response of the most similar live entry in the same scope
+    (a user) if its cosine similarity is at least threshold.
+    Only use for endpoints without side effects; never share scopes between users.
+    """
+
+    def __init__(self, name: str, ttl: int, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_per_scope: int = 20, max_scopes: int = 5000):
+        self.name = name
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_per_scope = max_per_scope
+        # scope -> [(unit vector, response, expires at)], oldest first
+        self._scopes = TTLCache(maxsize=max_scopes, ttl=ttl)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(inputs: Any) -> str:
+        """Canonical text for request inputs: sorted keys, lowercase, collapsed whitespace"""
+        text = json.dumps(inputs, sort_keys=True, default=str).lower()
+        return ' '.join(text.split())
+
+    @staticmethod
+    def _unit(vec) -> Optional[np.ndarray]:
+        vec = np.asarray(vec, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        # Failed embeddings come back as zero vectors
+        return vec / norm if norm > 0 else None
+
+    def _match(self, scope: str, vec: Optional[np.ndarray]):
+        if vec is None:
+            return None
+        now = time.time()
+        with self._lock:
+            entries = [e for e in self._scopes.get(scope, []) if e[2] > now]
+        if not entries:
+            return None
+        sims = np.stack([e[0] for e in entries]) @ vec
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+        print(f"Semantic cache hit ({self.name}, similarity {sims[best]:.3f})")
+        return copy.deepcopy(entries[best][1])
+
+    def get(self, scope: str, inputs: Any):
+        """(cached response or None, lookup vector to pass to put). Blocking."""
+        if not SEMANTIC_CACHE:
+            return None, None
+        vec = self._unit(gemini_embedding([self.normalize(inputs)])[0])
+        return self._match(scope, vec), vec
+
+    async def aget(self, scope: str, inputs: Any):
+        """Async version of get"""
+        if not SEMANTIC_CACHE:
+            return None, None
+        vec = self._unit((await agemini_embedding([self.normalize(inputs)]))[0])
+        return self._match(scope, vec), vec
+
+    def put(self, scope: str, vec: Optional[np.ndarray], response: Any) -> None:
+        """Remember a response for the request that produced vec (from get/aget)"""
+        if vec is None:
+            return
+        now = time.time()
+        with self._lock:
+            entries = [e for e in self._scopes.get(scope, []) if e[2] > now]
+            entries.append((vec, copy.deepcopy(response), now + self.ttl))
+            # Reassigning also restarts the scope's TTL
+            self._scopes[scope] = entries[-self.max_per_scope:]
@@ -0,0 +1,13 @@
+# tests/conftest.py - Unit tests run offline: no API calls, no tokenizer file
+import os
+import sys
+
+# config.py refuses to load without a key; these tests never call the API
+os.environ.setdefault("GEMINI_API_KEY", "test")
+# No embedding cache or context generations on disk
+os.environ["EMBEDDING_STORE"] = "none"
+os.environ["CONTEXT_GENERATION_STORE"] = "none"
+# Token counts use the 4 chars/token estimate
+os.environ["PROMPT_TOKENIZER_PATH"] = ""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,74 @@
+# tests/test_action_parser.py
+from action_parser import ActionStreamParser, parse_actions
+
+REPLY = (
+    'Done, I logged it.\n'
+    'Actions: ```json\n'
+    '[{"type": "add_expense", "data": {"amount": 5, "note": "a \\"}\\" b [x]"}},'
+    ' {"type": "add_skill", "data": {"name": "React", "milestones": [{"name": "m1"}]}}]\n'
+    '```'
+)
+
+
+def feed_in_pieces(text, size):
+    parser = ActionStreamParser()
+    for i in range(0, len(text), size):
+        parser.feed(text[i:i + size])
+    parser.close()
+    return parser
+
+
+def test_whole_reply():
+    text, actions = parse_actions(REPLY)
+    assert text == "Done, I logged it."
+    assert [a.type for a in actions] == ["add_expense", "add_skill"]
+    assert actions[0].data["note"] == 'a "}" b [x]'
+    assert actions[1].data["milestones"] == [{"name": "m1"}]
+
+
+def test_split_at_every_position():
+    # Any split, including inside "Actions:" and inside strings, gives the same result
+    for size in range(1, 12):
+        parser = feed_in_pieces(REPLY, size)
+        assert parser.response_text == "Done, I logged it."
+        assert [a.type for a in parser.actions] == ["add_expense", "add_skill"]
+        assert parser.array_closed
+
+
+def test_actions_complete_as_they_arrive():
+    parser = ActionStreamParser()
+    assert parser.feed('Ok. Actio') == []
+    assert parser.feed('ns: [{"type": "add_expense", "data": {"amount": 5}}') != []
+    assert len(parser.actions) == 1
+    assert parser.feed(', {"type": "add_skill", "data": {}}]') != []
+    assert len(parser.actions) == 2
+
+
+def test_streamable_length_holds_back_partial_marker():
+    parser = ActionStreamParser()
+    parser.feed("Here you go. Act")
+    assert parser.raw[:parser.streamable_length] == "Here you go. "
+    parser.feed("ually, no actions.")
+    assert parser.streamable_length == len(parser.raw)
+    parser.feed(" Actions: []")
+    assert parser.raw[:parser.streamable_length] == "Here you go. Actually, no actions. "
+
+
+def test_truncated_action_is_salvaged():
+    text, actions = parse_actions(
+        'Added both. Actions: [{"type": "add_expense", "data": {"amount": 5}},'
+        ' {"type": "add_skill", "data": {"name": "Go", "milestones": [{"name": "m1"}'
+    )
+    assert text == "Added both."
+    assert [a.type for a in actions] == ["add_expense", "add_skill"]
+    assert actions[1].data == {"name": "Go", "milestones": [{"name": "m1"}]}
+
+
+def test_truncated_inside_string_keeps_completed_actions():
+    text, actions = parse_actions('Ok. Actions: [{"type": "add_expense", "data": {}}, {"type": "add_sk')
+    assert text == "Ok."
+    assert [a.type for a in actions] == ["add_expense"]
+
+
+def test_no_actions_section():
+    assert parse_actions("Just a reply.") == ("Just a reply.", [])
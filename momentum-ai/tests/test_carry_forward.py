@@ -0,0 +1,78 @@
+# tests/test_carry_forward.py
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from scheduler import carry_forward, local_plan, windows_on_day
+
+
+def plan_range(tasks, first_day, num_days, capacity):
+    """What /plan/range does per day, without the routes: plan locally, then carry forward"""
+    days = []
+    for i in range(num_days):
+        day_iso = (first_day + timedelta(days=i)).isoformat()
+        plan = local_plan(tasks, day_iso, capacity=capacity, retention=0)
+        days.append((day_iso, sorted(s["task_id"] for s in plan["schedule"])))
+        tasks = carry_forward(tasks, plan["schedule"], plan["shifted_tasks"])
+    return days, tasks
+
+
+def test_scheduled_single_day_tasks_are_done():
+    tasks = [{"id": "a"}, {"id": "b"}]
+    schedule = [{"task_id": "a"}, {"task_id": "b"}]
+    assert carry_forward(tasks, schedule, []) == []
+
+
+def test_shifted_tasks_get_their_new_dates():
+    tasks = [{"id": "a", "dueDate": "2026-10-19", "startDate": "2026-10-18"}, {"title": "untitled id"}]
+    shifted = [
+        {"task_id": "a", "newDueDate": "2026-10-20", "newStartDate": "2026-10-20"},
+        {"task_id": None, "title": "untitled id", "newDueDate": "2026-10-20", "newStartDate": None},
+    ]
+    assert carry_forward(tasks, [], shifted) == [
+        {"id": "a", "dueDate": "2026-10-20", "deadline_iso": "2026-10-20", "startDate": "2026-10-20"},
+        {"title": "untitled id", "dueDate": "2026-10-20", "deadline_iso": "2026-10-20"},
+    ]
+    # The caller's tasks are left unchanged
+    assert tasks[0]["dueDate"] == "2026-10-19"
+
+
+def test_unplanned_tasks_are_kept_as_they_are():
+    assert carry_forward([{"id": "a", "dueDate": "2026-10-25"}], [], []) == [{"id": "a", "dueDate": "2026-10-25"}]
+
+
+def test_multi_day_task_across_a_range():
+    tasks = [{"id": "project", "title": "Project", "daysAllocated": 3, "estimatedMinutes": 180, "dueDate": "2026-10-30"}]
+    days, left = plan_range(tasks, date(2026, 10, 19), 4, capacity=4)
+    assert days == [("2026-10-19", ["project"]), ("2026-10-20", ["project"]), ("2026-10-21", ["project"]), ("2026-10-22", [])]
+    assert left == []
+
+
+def test_shifted_tasks_move_through_the_range():
+    tasks = [{"id": f"t{i}", "title": f"t{i}", "priority": "low", "dueDate": "2026-10-30"} for i in range(6)]
+    tasks.append({"id": "multi", "title": "Multi", "priority": "high", "daysAllocated": 2, "currentDay": 1,
+                  "estimatedMinutes": 60, "dueDate": "2026-10-30"})
+    days, left = plan_range(tasks, date(2026, 10, 19), 3, capacity=2)
+    assert days == [
+        ("2026-10-19", ["multi", "t0"]),
+        ("2026-10-20", ["multi", "t1"]),
+        ("2026-10-21", ["t2", "t3"]),
+    ]
+    # Still shifted after the last day; the deadline is later, so it's kept
+    assert [(t["id"], t["dueDate"]) for t in left] == [("t4", "2026-10-30"), ("t5", "2026-10-30")]
+
+
+def test_days_without_windows_only_carry_tasks():
+    tasks = [{"id": f"t{i}", "title": f"t{i}", "estimatedMinutes": 60, "dueDate": "2026-10-30"} for i in range(1, 4)]
+    windows = [SimpleNamespace(start_iso="2026-10-19T18:00:00", end_iso="2026-10-19T19:00:00"),
+               SimpleNamespace(start_iso="2026-10-21T09:00:00", end_iso="2026-10-21T11:00:00")]
+    days = []
+    for day_iso in ("2026-10-19", "2026-10-20", "2026-10-21"):
+        day_windows = windows_on_day(windows, datetime.fromisoformat(day_iso))
+        plan = local_plan(tasks, day_iso, day_windows, use_default_windows=False)
+        days.append((day_iso, [(s["task_id"], s["start"][11:16]) for s in plan["schedule"]]))
+        tasks = carry_forward(tasks, plan["schedule"], plan["shifted_tasks"])
+    assert days == [
+        ("2026-10-19", [("t1", "18:00")]),
+        ("2026-10-20", []),
+        ("2026-10-21", [("t2", "09:00"), ("t3", "10:00")]),
+    ]
+    assert tasks == []
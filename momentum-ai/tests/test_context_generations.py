@@ -0,0 +1,13 @@
+# tests/test_context_generations.py
+from context_generations import SQLiteGenerationStore
+
+
+def test_bumps_are_seen_by_every_worker(tmp_path):
+    path = str(tmp_path / "context_generations.sqlite3")
+    # One store per worker process, on the same file
+    worker_a, worker_b = SQLiteGenerationStore(path), SQLiteGenerationStore(path)
+    assert worker_a.get("u1") == 0
+    assert worker_b.bump("u1") == 1
+    assert worker_a.bump("u1") == 2
+    assert worker_b.get("u1") == 2
+    assert worker_a.get("u2") == 0
@@ -0,0 +1,43 @@
+# tests/test_embedding_batcher.py
+from concurrent.futures import Future
+import pytest
+import ai_client
+from ai_client import _EmbeddingBatcher
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls = []
+
+    def fake_embed(texts):
+        calls.append(list(texts))
+        return [[float(len(t))] for t in texts], True
+
+    monkeypatch.setattr(ai_client, "_embed_upstream", fake_embed)
+    return calls
+
+
+def test_cancelled_caller_does_not_strand_the_batch(upstream):
+    batcher = _EmbeddingBatcher(window=0.01, max_batch=10, max_parallel=1)
+    futures = [Future() for _ in range(3)]
+    futures[1].cancel()
+    batcher._flush(list(zip(["a", "bb", "ccc"], futures)))
+    assert upstream == [["a", "ccc"]]
+    assert futures[0].result() == ([1.0], True)
+    assert futures[2].result() == ([3.0], True)
+
+
+def test_claimed_futures_can_no_longer_be_cancelled(upstream, monkeypatch):
+    batcher = _EmbeddingBatcher(window=0.01, max_batch=10, max_parallel=1)
+    futures = [Future(), Future()]
+
+    # A caller cancelling while the request is in flight is too late, not an error
+    def embed_then_cancel(texts):
+        assert not futures[0].cancel()
+        return [[1.0]], True
+
+    monkeypatch.setattr(ai_client, "_embed_upstream", embed_then_cancel)
+    batcher._flush(list(zip(["a", "b"], futures)))
+    assert futures[0].result() == ([1.0], True)
+    with pytest.raises(RuntimeError):
+        futures[1].result()
@@ -0,0 +1,83 @@
+# tests/test_free_time.py
+from datetime import datetime
+from types import SimpleNamespace
+from scheduler import FreeTimeIndex, class_blocks, fallback_scheduler, free_intervals
+
+DAY = datetime(2026, 10, 19)  # A Monday
+
+
+def at(hour, minute=0):
+    return DAY.replace(hour=hour, minute=minute)
+
+
+def window(start, end):
+    return SimpleNamespace(start_iso=start, end_iso=end)
+
+
+def test_earliest_fit_backfills_skipped_gaps():
+    # Gaps: 9:00-9:30, 10:00-12:00, 13:00-13:45
+    free = FreeTimeIndex([(at(9), at(9, 30)), (at(10), at(12)), (at(13), at(13, 45))])
+    assert free.allocate(60) == (at(10), at(11))
+    # The 30 minute gap skipped above is still the earliest fit for a short task
+    assert free.allocate(20) == (at(9), at(9, 20))
+    assert free.allocate(45) == (at(11), at(11, 45))
+    assert free.allocate(60) is None
+    assert free.free_minutes == 10 + 15 + 45
+
+
+def test_best_fit_takes_the_tightest_gap():
+    free = FreeTimeIndex([(at(9), at(11)), (at(13), at(13, 45)), (at(15), at(15, 30))])
+    assert free.allocate(30, best_fit=True) == (at(15), at(15, 30))
+    assert free.allocate(40, best_fit=True) == (at(13), at(13, 40))
+    assert free.allocate(40) == (at(9), at(9, 40))
+
+
+def test_classes_are_subtracted():
+    classes = [
+        {"time": "10:00", "end_time": "11:00", "day": "Mon"},
+        {"time": "2:00 PM", "day": "Monday"},          # Default length (60 minutes)
+        {"time": "12:00", "end_time": "13:00", "day": "Tue"},
+    ]
+    blocks = class_blocks(classes, DAY)
+    assert sorted(blocks) == [(at(10), at(11)), (at(14), at(15))]
+    assert free_intervals([(at(9), at(17))], blocks) == [(at(9), at(10)), (at(11), at(14)), (at(15), at(17))]
+
+    free = FreeTimeIndex([(at(9), at(17))], blocks)
+    assert free.allocate(90) == (at(11), at(12, 30))
+    assert free.allocate(60) == (at(9), at(10))
+
+
+def test_dated_classes_only_block_their_day():
+    classes = [{"time": "2026-10-20T09:00:00", "end_time": "2026-10-20T10:30:00"}]
+    assert class_blocks(classes, DAY) == []
+    assert class_blocks(classes, DAY, DAY.replace(day=20)) == [(at(9).replace(day=20), at(10, 30).replace(day=20))]
+
+
+def test_fallback_skips_invalid_windows_and_keeps_the_offset():
+    tasks = [{"id": "a", "title": "A", "estimated_minutes": 30}, {"id": "b", "title": "B", "estimated_minutes": 45}]
+    windows = [
+        window("not a date", "2026-10-19T12:00:00Z"),
+        window("2026-10-19T11:00:00Z", "2026-10-19T10:00:00Z"),
+        window("2026-10-19T09:00:00Z", "2026-10-19T12:00:00Z"),
+    ]
+    classes = [{"time": "09:00", "end_time": "09:30"}]
+    schedule = fallback_scheduler(windows, tasks, classes, "2026-10-19")
+    assert [(s["task_id"], s["start"], s["end"]) for s in schedule] == [
+        ("a", "2026-10-19T09:30:00+00:00", "2026-10-19T10:00:00+00:00"),
+        ("b", "2026-10-19T10:00:00+00:00", "2026-10-19T10:45:00+00:00"),
+    ]
+
+
+def test_fallback_uses_default_windows_without_valid_ones():
+    schedule = fallback_scheduler([window("", "")], [{"id": "a", "estimated_minutes": 30}], [], "2026-10-19")
+    assert schedule[0]["start"] == "2026-10-19T09:00:00"
+
+
+def test_fallback_uses_the_task_tables_durations():
+    tasks = [
+        {"id": "hours", "estimatedHours": 1.5},
+        {"id": "split", "estimatedMinutes": 240, "daysAllocated": 4},
+        {"id": "half-done", "estimated_minutes": 60, "progressPercentage": 50},
+    ]
+    schedule = fallback_scheduler([], tasks, [], "2026-10-19")
+    assert {s["task_id"]: s["estimated_minutes"] for s in schedule} == {"hours": 90, "split": 60, "half-done": 30}
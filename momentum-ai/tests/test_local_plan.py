@@ -0,0 +1,127 @@
+# tests/test_local_plan.py
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from scheduler import local_plan, windows_on_day
+
+DATE = "2026-10-19"
+LONG_DAY = [SimpleNamespace(start_iso=f"{DATE}T08:00:00", end_iso=f"{DATE}T20:00:00")]
+
+
+def task(task_id, priority="medium", due="2026-11-30", minutes=30, **fields):
+    return {"id": task_id, "title": task_id, "priority": priority, "dueDate": due, "estimated_minutes": minutes, **fields}
+
+
+def planned_ids(plan):
+    return sorted(s["task_id"] for s in plan["schedule"])
+
+
+def shifted_ids(plan):
+    return sorted(s["task_id"] for s in plan["shifted_tasks"])
+
+
+def test_keeps_everything_within_capacity_plus_one():
+    tasks = [task(f"t{i}") for i in range(5)]
+    plan = local_plan(tasks, DATE, LONG_DAY, capacity=4)
+    assert planned_ids(plan) == ["t0", "t1", "t2", "t3", "t4"]
+    assert plan["shifted_tasks"] == []
+
+
+def test_over_capacity_shifts_least_important():
+    tasks = [task("low", "low"), task("late", due="2026-12-31"), task("m1"), task("m2"), task("m3"), task("m4")]
+    plan = local_plan(tasks, DATE, LONG_DAY, capacity=4)
+    assert planned_ids(plan) == ["m1", "m2", "m3", "m4"]
+    assert shifted_ids(plan) == ["late", "low"]
+    assert {s["reason"] for s in plan["shifted_tasks"]} == {"Capacity limit"}
+
+
+def test_retention_keeps_at_least_half():
+    tasks = [task(f"t{i}") for i in range(10)]
+    plan = local_plan(tasks, DATE, LONG_DAY, capacity=2)
+    assert len(plan["schedule"]) == 5
+    plan = local_plan(tasks, DATE, LONG_DAY, capacity=2, retention=0.8)
+    assert len(plan["schedule"]) == 8
+
+
+def test_must_stay_tasks_count_towards_capacity_but_are_never_shifted():
+    tasks = [task("due", due="2026-10-20"), task("busy", status="in-progress"), task("hi", "high"),
+             task("exam", examId="e1"), task("a"), task("b"), task("c"), task("d")]
+    plan = local_plan(tasks, DATE, LONG_DAY, capacity=5)
+    assert plan["must_stay"] == 4
+    assert planned_ids(plan) == ["a", "busy", "due", "exam", "hi"]
+    assert shifted_ids(plan) == ["b", "c", "d"]
+    # With no capacity left they all stay, however small the capacity
+    plan = local_plan(tasks, DATE, LONG_DAY, capacity=2)
+    assert planned_ids(plan) == ["busy", "due", "exam", "hi"]
+
+
+def test_must_stay_overflows_after_the_windows():
+    window = [SimpleNamespace(start_iso=f"{DATE}T09:00:00", end_iso=f"{DATE}T10:00:00")]
+    tasks = [task("due", due=DATE, minutes=45), task("hi", "high", minutes=45), task("later", minutes=30)]
+    plan = local_plan(tasks, DATE, window)
+    assert [(s["task_id"], s["start"][11:16]) for s in plan["schedule"]] == [("due", "09:00"), ("hi", "10:00")]
+    assert plan["overflow"] == 1
+    assert plan["schedule"][1]["notes"].endswith("(after your study windows)")
+    assert [(s["task_id"], s["reason"]) for s in plan["shifted_tasks"]] == [("later", "No free time left today")]
+
+
+def test_shifted_dates():
+    tasks = [task("k1", "high"), task("k2", "high"), task("far", "low", due="2026-12-01", startDate="2026-10-01"),
+             task("none", "low", due=None), task("soon", "low", due="2026-10-19T23:00:00"), task("k3", "high")]
+    plan = local_plan(tasks, DATE, LONG_DAY, capacity=1, retention=0)
+    shifted = {s["task_id"]: (s["newDueDate"], s["newStartDate"]) for s in plan["shifted_tasks"]}
+    # "soon" is due today, so it stays
+    assert shifted == {"far": ("2026-12-01", "2026-10-20"), "none": ("2026-10-20", None)}
+
+
+def test_times_keep_the_windows_offset():
+    windows = [SimpleNamespace(start_iso=f"{DATE}T09:00:00+05:30", end_iso=f"{DATE}T12:00:00+05:30")]
+    # 03:30Z is 09:00 at +05:30, so the class takes the first hour
+    classes = [{"time": f"{DATE}T03:30:00Z", "end_time": f"{DATE}T04:30:00Z"}]
+    # Due 19:00Z on the 20th is already the 21st at +05:30: not due tomorrow there
+    tasks = [task("a", due="2026-10-20T19:00:00Z", minutes=60)]
+    plan = local_plan(tasks, DATE, windows, classes)
+    assert plan["must_stay"] == 0
+    assert (plan["schedule"][0]["start"], plan["schedule"][0]["end"]) == (f"{DATE}T10:00:00+05:30", f"{DATE}T11:00:00+05:30")
+
+    plan = local_plan(tasks, f"{DATE}T00:00:00Z", [])
+    assert plan["schedule"][0]["start"] == f"{DATE}T09:00:00+00:00"
+
+
+def test_not_before_skips_the_part_of_the_day_that_has_passed():
+    # 100 minutes of the default windows are left after 15:20
+    tasks = [task("a", minutes=60), task("due", due=DATE, minutes=60), task("due2", due=DATE, minutes=60)]
+    plan = local_plan(tasks, DATE, capacity=5, not_before=datetime(2026, 10, 19, 15, 20))
+    assert [(s["task_id"], s["start"][11:16]) for s in plan["schedule"]] == [("due", "15:20"), ("due2", "17:00")]
+    assert plan["overflow"] == 1
+    assert [(s["task_id"], s["reason"]) for s in plan["shifted_tasks"]] == [("a", "No free time left today")]
+    # Past the windows, overflow starts now rather than in the past
+    plan = local_plan(tasks, DATE, capacity=5, not_before=datetime(2026, 10, 19, 18, 30))
+    assert [s["start"][11:16] for s in plan["schedule"]] == ["18:30", "19:30"]
+
+
+def test_not_before_only_applies_on_the_plan_date():
+    plan = local_plan([task("a")], DATE, not_before=datetime(2026, 10, 18, 15, 0))
+    assert plan["schedule"][0]["start"] == f"{DATE}T09:00:00"
+    # Aware times are converted into the plan's timezone (+02:00 here)
+    plan = local_plan([task("a")], f"{DATE}T00:00:00+02:00", not_before=datetime(2026, 10, 19, 8, 0, tzinfo=timezone.utc))
+    assert plan["schedule"][0]["start"] == f"{DATE}T10:00:00+02:00"
+
+
+def test_day_without_windows_has_no_free_time_when_defaults_are_off():
+    tasks = [task("a"), task("due", due=DATE, minutes=45), task("hi", "high", minutes=30)]
+    plan = local_plan(tasks, DATE, [], use_default_windows=False)
+    assert [(s["task_id"], s["start"][11:16]) for s in plan["schedule"]] == [("due", "09:00"), ("hi", "09:45")]
+    assert plan["overflow"] == 2
+    assert all(s["notes"].endswith("(no study time on this day)") for s in plan["schedule"])
+    assert [(s["task_id"], s["reason"]) for s in plan["shifted_tasks"]] == [("a", "No free time left today")]
+
+
+def test_windows_on_day_uses_the_plan_timezone():
+    windows = [SimpleNamespace(start_iso="2026-10-19T20:00:00Z", end_iso="2026-10-19T21:00:00Z"),
+               SimpleNamespace(start_iso="2026-10-20T09:00:00+05:30", end_iso="2026-10-20T10:00:00+05:30"),
+               SimpleNamespace(start_iso="not a date", end_iso="")]
+    ist = timezone(timedelta(hours=5, minutes=30))
+    # 20:00Z on the 19th is already the 20th at +05:30
+    assert windows_on_day(windows, datetime(2026, 10, 19), ist) == []
+    assert windows_on_day(windows, datetime(2026, 10, 20), ist) == windows[:2]
+    assert windows_on_day(windows, datetime(2026, 10, 19), timezone.utc) == windows[:1]
@@ -0,0 +1,47 @@
+# tests/test_task_table.py
+from scheduler import TaskTable
+
+DATE = "2026-10-19"
+
+
+def test_must_stay_reasons_and_order():
+    table = TaskTable([
+        {"id": "shift", "priority": "low", "dueDate": "2026-11-30"},
+        {"id": "exam", "title": "Exam revision", "dueDate": "2026-11-01"},
+        {"id": "hi", "priority": 1},
+        {"id": "busy", "status": "in-progress"},
+        {"id": "tomorrow", "dueDate": "2026-10-20"},
+        {"id": "today", "deadline_iso": "2026-10-19T17:00:00"},
+        {"id": "overdue", "dueDate": "2026-10-10"},
+    ], DATE)
+    assert [(r["id"], r["reason"]) for r in table.must_stay] == [
+        ("today", "due today or tomorrow"),
+        ("overdue", "due today or tomorrow"),
+        ("tomorrow", "due today or tomorrow"),
+        ("busy", "in-progress"),
+        ("hi", "high priority"),
+        ("exam", "exam-related"),
+    ]
+    assert [r["id"] for r in table.can_shift] == ["shift"]
+
+
+def test_can_shift_order_and_lookup():
+    table = TaskTable([
+        {"id": "low", "priority": "low", "dueDate": "2026-11-01"},
+        {"id": "med-late", "priority": "medium", "dueDate": "2026-12-01"},
+        {"id": "med-soon", "priority": 2, "dueDate": "2026-11-01"},
+        {"sourceId": "src", "priority": "medium"},
+    ], DATE)
+    assert [r["id"] for r in table.can_shift] == ["med-soon", "med-late", "src", "low"]
+    assert table.get("src")["task"] == {"sourceId": "src", "priority": "medium"}
+    assert table.get("missing") is None and table.get(None) is None
+
+
+def test_task_minutes():
+    table = TaskTable([
+        {"id": "hours", "estimated_hours": 2},
+        {"id": "split", "estimatedMinutes": 300, "daysAllocated": 5},
+        {"id": "half-done", "estimated_minutes": 60, "progressPercentage": 50},
+        {"id": "tiny", "estimated_minutes": 5},
+    ], DATE)
+    assert {r["id"]: r["minutes"] for r in table.rows} == {"hours": 120, "split": 60, "half-done": 30, "tiny": 15}
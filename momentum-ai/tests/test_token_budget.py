@@ -0,0 +1,55 @@
+# tests/test_token_budget.py
+from token_budget import allocate_budgets, pack_documents, pack_recent, count_tokens
+
+
+def doc(tokens, **fields):
+    return {"text": "x" * (tokens * 4), **fields}
+
+
+def test_budgets_split_by_weight():
+    budgets = allocate_budgets(1000, {"a": 3, "b": 1}, {"a": 5000, "b": 5000})
+    assert budgets == {"a": 750, "b": 250}
+
+
+def test_unused_budget_spills_over():
+    # A section that needs less than its share hands the rest to the others, by weight
+    budgets = allocate_budgets(1000, {"a": 1, "b": 1}, {"a": 5000, "b": 100})
+    assert budgets == {"a": 900, "b": 100}
+    budgets = allocate_budgets(1200, {"a": 2, "b": 1, "c": 1}, {"a": 5000, "b": 100, "c": 5000})
+    assert budgets == {"a": 733, "b": 100, "c": 366}
+
+
+def test_spill_over_cascades():
+    # c's leftover lets b's demand fit, which then frees more for a
+    budgets = allocate_budgets(900, {"a": 1, "b": 1, "c": 1}, {"a": 5000, "b": 350, "c": 50})
+    assert budgets == {"a": 500, "b": 350, "c": 50}
+
+
+def test_empty_sections_get_nothing():
+    budgets = allocate_budgets(1000, {"a": 1, "b": 1}, {"a": 5000})
+    assert budgets == {"a": 1000, "b": 0}
+    assert allocate_budgets(1000, {"a": 1}, {"a": 0}) == {"a": 0}
+
+
+def test_pack_documents_skips_what_does_not_fit():
+    docs = [doc(60, id=1), doc(50, id=2), doc(30, id=3), doc(10, id=4)]
+    packed = pack_documents(docs, 100)
+    assert [d["id"] for d in packed] == [1, 3, 4]
+    assert sum(count_tokens(d["text"]) for d in packed) <= 100
+
+
+def test_pack_documents_by_score():
+    docs = [doc(60, id=1, score=0.1), doc(50, id=2, score=0.9), doc(40, id=3, score=0.5)]
+    assert [d["id"] for d in pack_documents(docs, 100, score_key="score")] == [2, 3]
+
+
+def test_pack_documents_truncates_best_when_nothing_fits():
+    packed = pack_documents([doc(500, id=1), doc(400, id=2)], 50)
+    assert [d["id"] for d in packed] == [1]
+    assert count_tokens(packed[0]["text"]) <= 52  # 50 tokens plus the " ..." marker
+    assert pack_documents([doc(10)], 0) == []
+
+
+def test_pack_recent_keeps_newest():
+    lines = ["a" * 40, "b" * 40, "c" * 40]
+    assert pack_recent(lines, 25) == ["b" * 40, "c" * 40]
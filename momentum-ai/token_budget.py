@@ -0,0 +1,123 @@
+# token_budget.py - Token estimates and budget packing for prompt context
+import math
+import threading
+from typing import Dict, List, Optional
+from config import PROMPT_TOKENIZER_PATH, PROMPT_TOKENIZER_SCALE
+
+# Gemini's rule of thumb, used unless a local tokenizer is configured
+CHARS_PER_TOKEN = 4
+
+# Lazy tokenizer (False if unavailable)
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    """
+    Lazy load the tokenizer.json at PROMPT_TOKENIZER_PATH from disk (nothing is
+    downloaded). False if none is configured or it can't be loaded; counts are
+    then estimated from characters. Blocking - load it off the event loop.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                _tokenizer = False
+                if PROMPT_TOKENIZER_PATH:
+                    try:
+                        from tokenizers import Tokenizer
+                        tokenizer = Tokenizer.from_file(PROMPT_TOKENIZER_PATH)
+                        # Count whole texts, not model-sized windows
+                        tokenizer.no_truncation()
+                        tokenizer.no_padding()
+                        _tokenizer = tokenizer
+                        print(f"Prompt tokenizer loaded ({PROMPT_TOKENIZER_PATH})")
+                    except Exception as e:
+                        print(f"Warning: prompt tokenizer unavailable ({e}). Estimating {CHARS_PER_TOKEN} chars per token.")
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    """Estimated Gemini tokens in text"""
+    if not text:
+        return 0
+    tokenizer = get_tokenizer()
+    if tokenizer is False:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return math.ceil(len(tokenizer.encode(text, add_special_tokens=False).ids) * PROMPT_TOKENIZER_SCALE)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Keep the beginning of text, at most max_tokens (estimated) tokens, cut at a token boundary"""
+    if max_tokens <= 0:
+        return ""
+    tokenizer = get_tokenizer()
+    if tokenizer is False:
+        limit = max_tokens * CHARS_PER_TOKEN
+        return text if len(text) <= limit else text[:limit].rstrip() + " ..."
+    offsets = tokenizer.encode(text, add_special_tokens=False).offsets
+    limit = max(1, int(max_tokens / PROMPT_TOKENIZER_SCALE))
+    if len(offsets) <= limit:
+        return text
+    return text[:offsets[limit - 1][1]].rstrip() + " ..."
+
+
+def allocate_budgets(total: int, weights: Dict[str, float], demands: Dict[str, int]) -> Dict[str, int]:
+    """
+    Split a token budget between prompt sections.
+    Each section gets a share of total proportional to its weight; a section that
+    needs fewer tokens (demands) gets only what it needs and the rest is shared
+    among the others. Sections with no content get 0.
+    """
+    budgets = {name: 0 for name in weights}
+    remaining = total
+    active = {name for name in weights if demands.get(name, 0) > 0}
+    while active:
+        weight_sum = sum(weights[name] for name in active)
+        shares = {name: remaining * weights[name] / weight_sum for name in active}
+        satisfied = {name for name in active if demands[name] <= shares[name]}
+        if not satisfied:
+            for name in active:
+                budgets[name] = int(shares[name])
+            break
+        for name in satisfied:
+            budgets[name] = demands[name]
+            remaining -= demands[name]
+        active -= satisfied
+    return budgets
+
+
+def pack_documents(docs: List[dict], max_tokens: int, score_key: Optional[str] = None) -> List[dict]:
+    """
+    Greedily pack the highest-scoring documents into max_tokens.
+    Documents are taken in order of score_key (list order if None, i.e. already ranked);
+    any that don't fit in what's left are skipped so smaller ones can still fit.
+    If not even the best document fits, it's truncated to the budget.
+    Returns the packed documents in rank order.
+    """
+    ranked = sorted(docs, key=lambda d: d.get(score_key, 0), reverse=True) if score_key else list(docs)
+    packed = []
+    used = 0
+    for doc in ranked:
+        cost = count_tokens(doc.get('text', ''))
+        if used + cost <= max_tokens:
+            packed.append(doc)
+            used += cost
+    if not packed and ranked and max_tokens > 0:
+        best = ranked[0]
+        packed.append({**best, "text": truncate_to_tokens(best.get('text', ''), max_tokens)})
+    return packed
+
+
+def pack_recent(lines: List[str], max_tokens: int) -> List[str]:
+    """Keep the most recent lines (e.g. conversation turns) that fit, in their original order"""
+    kept = []
+    used = 0
+    for line in reversed(lines):
+        cost = count_tokens(line)
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    kept.reverse()
+    return kept
@@ -1,25 +1,104 @@
 # utils.py
+import asyncio
+import copy
+import hashlib
+import inspect
+import threading
 from datetime import datetime
 import numpy as np
-from database import collection
-from ai_client import gemini_embedding
+from cachetools import TTLCache
+from database import get_user_collection
+from ai_client import gemini_embedding, agemini_embedding, to_chroma_embeddings
+from context_generations import generation_store, context_cache_enabled
+from reranker import rerank_scores
+from token_budget import count_tokens, pack_documents, truncate_to_tokens
 
-# Lazy import for reranker (only load when needed)
-_reranker = None
+# Adjacent-chunk cache: (user_id, generation, chunk_id) -> (text, meta), or None if
+# the chunk doesn't exist. Shared across requests (and worker threads, hence the lock);
+# writes and deletes for a user move them to a new generation (see below)
+_chunk_cache = TTLCache(maxsize=5000, ttl=600)
+_chunk_cache_lock = threading.Lock()
 
-def _get_reranker():
-    """Lazy load reranker to avoid loading on import"""
-    global _reranker
-    if _reranker is None:
-        try:
-            from sentence_transformers import CrossEncoder
-            _reranker = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
-            print("Reranker model loaded successfully")
-        except ImportError:
-            print("Warning: sentence-transformers not installed. Reranking disabled.")
-            print("Install with: pip install sentence-transformers")
-            _reranker = False  # Mark as unavailable
-    return _reranker
+# Retrieval result cache: key from _retrieval_cache_key -> (generation, docs).
+# Planning and skill routes query fixed strings, so repeats skip both the
+# embedding call and the vector search. Each user has a generation counter that
+# invalidate_user_context bumps on every write; entries from an older generation
+# are ignored, which also drops results computed while a write was landing.
+# The counter lives in the generation store so every worker process sees the bump;
+# it is re-read at most every GENERATION_REFRESH_S seconds. With
+# CONTEXT_GENERATION_STORE=none it is per process (single worker). When the shared
+# counter can't be read, nothing is cached (see user_context_generation).
+_retrieval_cache = TTLCache(maxsize=2000, ttl=600)
+_retrieval_cache_lock = threading.Lock()
+_user_generation = {}  # user_id -> int (CONTEXT_GENERATION_STORE=none)
+GENERATION_REFRESH_S = 2
+_generation_cache = TTLCache(maxsize=10000, ttl=GENERATION_REFRESH_S)  # user_id -> shared generation
+
+
+def invalidate_user_context(user_id: str):
+    """
+    Drop cached retrieval results and adjacent chunks for a user, in every worker.
+    Call after any write to or delete from that user's documents.
+    """
+    shared = generation_store.bump(user_id) if generation_store is not None else None
+    with _retrieval_cache_lock:
+        _user_generation[user_id] = _user_generation.get(user_id, 0) + 1
+        if shared is not None:
+            _generation_cache[user_id] = shared
+        else:
+            _generation_cache.pop(user_id, None)
+    invalidate_chunk_cache(user_id)
+
+
+def user_context_generation(user_id: str):
+    """
+    Counter bumped by invalidate_user_context (changes whenever the user's documents do).
+    None if it can't be shared between workers right now; don't cache the user's context then.
+    """
+    if not context_cache_enabled:
+        return None
+    if generation_store is None:
+        with _retrieval_cache_lock:
+            return _user_generation.get(user_id, 0)
+    with _retrieval_cache_lock:
+        generation = _generation_cache.get(user_id)
+        if generation is not None:
+            return generation
+    shared = generation_store.get(user_id)
+    if shared is not None:
+        with _retrieval_cache_lock:
+            _generation_cache[user_id] = shared
+    return shared
+
+
+def _retrieval_cache_key(user_id, query, k, min_similarity, max_context_length,
+                         recency_weight, allowed_types, deduplicate, use_reranking):
+    """Cache key for one retrieve_user_context call (query_embedding is derived from query)"""
+    query_hash = hashlib.md5(' '.join(query.split()).encode('utf-8')).hexdigest()
+    types = tuple(sorted(allowed_types)) if allowed_types else None
+    return (user_id, query_hash, k, min_similarity, max_context_length,
+            recency_weight, types, deduplicate, use_reranking)
+
+
+def _get_cached_retrieval(key):
+    """Return a private copy of the cached docs for key, or None"""
+    generation = user_context_generation(key[0])
+    if generation is None:
+        return None
+    with _retrieval_cache_lock:
+        entry = _retrieval_cache.get(key)
+        if entry is None or entry[0] != generation:
+            return None
+        docs = entry[1]
+    # Callers edit docs in place (e.g. polish_context), so never hand out the cached ones
+    return copy.deepcopy(docs)
+
+
+def _store_retrieval(key, generation: int, docs: list):
+    """Cache docs unless the user's documents changed since retrieval started"""
+    if generation is not None and user_context_generation(key[0]) == generation:
+        with _retrieval_cache_lock:
+            _retrieval_cache[key] = (generation, copy.deepcopy(docs))
 
 def retrieve_user_context(
     user_id: str, 
@@ -30,7 +109,8 @@ def retrieve_user_context(
     recency_weight: float = 0.2,
     allowed_types: list = None,
     deduplicate: bool = True,
-    use_reranking: bool = True
+    use_reranking: bool = True,
+    query_embedding: list = None
 ):
     """
     Optimized context retrieval with anti-overfitting measures:
@@ -40,7 +120,17 @@ def retrieve_user_context(
     - Type filtering (only relevant document types)
     - Deduplication (remove similar documents)
     - Reranking (cross-encoder for better relevance, if enabled)
+
+    query_embedding: precomputed embedding for query (skips the embedding call)
+    Results are cached per user until invalidate_user_context is called for them.
     """
+    cache_key = _retrieval_cache_key(user_id, query, k, min_similarity, max_context_length,
+                                     recency_weight, allowed_types, deduplicate, use_reranking)
+    cached = _get_cached_retrieval(cache_key)
+    if cached is not None:
+        return cached
+    generation = user_context_generation(user_id)
+    
     # Build where clause with user_id and optional type filter
     # ChromaDB requires $and operator when combining multiple conditions
     if allowed_types:
@@ -54,11 +144,13 @@ def retrieve_user_context(
         where_clause = {"user_id": user_id}
     
     # Get more candidates than needed for filtering
-    q_emb = gemini_embedding([query])[0]
-    res = collection.query(
-        query_embeddings=[q_emb],
+    q_emb = query_embedding if query_embedding is not None else gemini_embedding([query])[0]
+    res = get_user_collection(user_id).query(
+        query_embeddings=to_chroma_embeddings([q_emb]),
         n_results=k * 3,  # Get 3x for filtering down
-        where=where_clause
+        where=where_clause,
+        # Stored vectors come back with the hits so deduplication needs no embedding call
+        include=["documents", "metadatas", "distances", "embeddings"]
     )
     
     docs = []
@@ -66,10 +158,11 @@ def retrieve_user_context(
     total_length = 0
     
     # Process results with similarity and recency scoring
-    for doc_text, meta, distance in zip(
+    for doc_text, meta, distance, embedding in zip(
         res['documents'][0],
         res['metadatas'][0],
-        res['distances'][0]
+        res['distances'][0],
+        res['embeddings'][0]
     ):
         # Convert distance to similarity (ChromaDB uses cosine distance)
         # Distance: 0 = identical, 2 = opposite
@@ -109,7 +202,8 @@ def retrieve_user_context(
             "meta": meta,
             "similarity": similarity,
             "recency_score": recency_score,
-            "combined_score": combined_score
+            "combined_score": combined_score,
+            "embedding": embedding
         })
         total_length += len(doc_text)
     
@@ -120,6 +214,10 @@ def retrieve_user_context(
     if deduplicate and len(docs) > 1:
         docs = _deduplicate_context(docs)
     
+    # Vectors are only needed for deduplication - keep them out of the returned docs
+    for doc in docs:
+        doc.pop('embedding', None)
+    
     # Rerank documents for better relevance (if reranker is available and enabled)
     if use_reranking:
         docs = _rerank_documents(query, docs, top_k=k * 2)  # Rerank more than needed
@@ -129,13 +227,93 @@ def retrieve_user_context(
     docs = _include_adjacent_chunks(docs, user_id, max_context_length, total_length)
     
     # Return top k most relevant documents
-    return docs[:k]
+    docs = docs[:k]
+    _store_retrieval(cache_key, generation, docs)
+    return docs
+
+
+_RETRIEVE_SIGNATURE = inspect.signature(retrieve_user_context)
+
+
+async def aretrieve_user_context(user_id: str, query: str, **kwargs):
+    """
+    Async version of retrieve_user_context for async routes.
+    Embeds the query on the async Gemini client, then runs the vector search,
+    deduplication and reranking in a worker thread so the event loop stays free.
+    Cache hits return before the query is embedded.
+    """
+    cached = _cached_retrieval_for(user_id, query, kwargs)
+    if cached is not None:
+        return cached
+    
+    q_emb = (await agemini_embedding([query]))[0]
+    return await asyncio.to_thread(
+        retrieve_user_context, user_id, query, query_embedding=q_emb, **kwargs
+    )
+
+
+def _cached_retrieval_for(user_id: str, query: str, kwargs: dict):
+    """Cached result for a retrieve_user_context call with these arguments, or None"""
+    bound = _RETRIEVE_SIGNATURE.bind(user_id, query, **kwargs)
+    bound.apply_defaults()
+    args = dict(bound.arguments)
+    args.pop('query_embedding', None)
+    return _get_cached_retrieval(_retrieval_cache_key(**args))
+
+
+async def aretrieve_many(user_id: str, retrievals: list) -> list:
+    """
+    Run every retrieval a request needs for one user together.
+    retrievals: [(query, kwargs for retrieve_user_context)].
+    Cache hits are answered first; the remaining queries are embedded in one
+    call and their searches run concurrently in worker threads (their rerank
+    requests share batches on the reranker service).
+    Returns one doc list per retrieval, in order. A document already returned by an
+    earlier retrieval is dropped from later ones.
+    The first retrieval is the request's primary one: if it fails (including the
+    shared embedding call), the error is raised as retrieve_user_context would.
+    A failed secondary retrieval returns [].
+    """
+    results = [None] * len(retrievals)
+    pending = []
+    for i, (query, kwargs) in enumerate(retrievals):
+        results[i] = _cached_retrieval_for(user_id, query, kwargs)
+        if results[i] is None:
+            pending.append(i)
+    
+    if pending:
+        try:
+            embeddings = await agemini_embedding([retrievals[i][0] for i in pending])
+            searches = await asyncio.gather(*(
+                asyncio.to_thread(
+                    retrieve_user_context, user_id, retrievals[i][0], query_embedding=q_emb, **retrievals[i][1]
+                )
+                for i, q_emb in zip(pending, embeddings)
+            ), return_exceptions=True)
+        except Exception as e:
+            searches = [e] * len(pending)
+        for i, docs in zip(pending, searches):
+            if isinstance(docs, Exception):
+                if i == 0:
+                    raise docs
+                print(f"Error retrieving context for '{retrievals[i][0][:50]}': {docs}")
+                docs = []
+            results[i] = docs
+    
+    # Combined result: each document appears once, in the first retrieval that found it
+    seen = set()
+    for docs in results:
+        docs[:] = [d for d in docs if d['text'] not in seen]
+        seen.update(d['text'] for d in docs)
+    return results
 
 
 def _rerank_documents(query: str, docs: list, top_k: int = 10) -> list:
     """
     Rerank retrieved documents using cross-encoder for better relevance.
     This improves retrieval quality by using a more sophisticated ranking model.
+    Scoring runs on the reranker service's worker thread within RERANK_TIMEOUT_MS;
+    if the model is unavailable or over budget, docs keep their vector-score order.
     
     Args:
         query: The user's query
@@ -148,19 +326,14 @@ def _rerank_documents(query: str, docs: list, top_k: int = 10) -> list:
     if not docs or len(docs) <= 1:
         return docs
     
-    reranker = _get_reranker()
-    
-    # If reranker is not available, return original docs
-    if reranker is False or reranker is None:
-        return docs
-    
     try:
-        # Create query-document pairs for reranking
-        pairs = [[query, doc['text']] for doc in docs]
-        
-        # Get relevance scores from cross-encoder
+        # Get relevance scores from cross-encoder for each query-document pair
         # Higher score = more relevant
-        scores = reranker.predict(pairs)
+        scores = rerank_scores(query, [doc['text'] for doc in docs])
+        
+        # If reranker is not available (or too slow right now), return original docs
+        if scores is None:
+            return docs
         
         # Combine documents with scores
         doc_scores = list(zip(docs, scores))
@@ -195,42 +368,32 @@ def _deduplicate_context(docs: list, similarity_threshold: float = 0.95):
     """
     Remove duplicate or very similar documents using embedding similarity.
     Prevents overcontext from redundant information.
+    Uses the vectors Chroma returned with each doc ('embedding'); only docs
+    without one are embedded here.
     """
     if len(docs) <= 1:
         return docs
     
-    # Get embeddings for all documents
-    texts = [d['text'] for d in docs]
-    embeddings = gemini_embedding(texts)
-    
-    unique_docs = [docs[0]]  # Always keep first (highest score)
-    
-    for i, doc in enumerate(docs[1:], 1):
-        is_duplicate = False
-        emb_i = np.array(embeddings[i])
-        
-        # Check similarity with already included documents
-        for unique_doc in unique_docs:
-            unique_idx = docs.index(unique_doc)
-            emb_unique = np.array(embeddings[unique_idx])
-            
-            # Calculate cosine similarity
-            dot_product = np.dot(emb_i, emb_unique)
-            norm_i = np.linalg.norm(emb_i)
-            norm_unique = np.linalg.norm(emb_unique)
-            
-            if norm_i > 0 and norm_unique > 0:
-                similarity = dot_product / (norm_i * norm_unique)
-                
-                # If very similar, skip this document
-                if similarity > similarity_threshold:
-                    is_duplicate = True
-                    break
-        
-        if not is_duplicate:
-            unique_docs.append(doc)
-    
-    return unique_docs
+    # Get embeddings for all documents (normally already attached by the query)
+    missing = [i for i, d in enumerate(docs) if d.get('embedding') is None]
+    if missing:
+        fresh = gemini_embedding([docs[i]['text'] for i in missing])
+        for i, emb in zip(missing, fresh):
+            docs[i]['embedding'] = emb
+    matrix = np.asarray([d['embedding'] for d in docs], dtype=np.float32)
+    
+    # Cosine similarity of every pair in one shot (zero vectors never match anything)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    unit = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+    similarity = unit @ unit.T
+    
+    # Greedy in score order: keep a doc unless it is too similar to one already kept
+    kept = [0]  # Always keep first (highest score)
+    for i in range(1, len(docs)):
+        if not (similarity[i, kept] > similarity_threshold).any():
+            kept.append(i)
+    
+    return [docs[i] for i in kept]
 
 
 def determine_optimal_k(user_message: str) -> int:
@@ -277,11 +440,58 @@ def determine_context_types(user_message: str) -> list:
     return ["context", "onboarding"]
 
 
+def invalidate_chunk_cache(user_id: str):
+    """Forget cached adjacent chunks for a user (call after adding or deleting their documents)"""
+    with _chunk_cache_lock:
+        for key in [key for key in _chunk_cache.keys() if key[0] == user_id]:
+            _chunk_cache.pop(key, None)
+
+
+def _fetch_chunks(user_id: str, chunk_ids: list) -> dict:
+    """
+    Fetch chunks by ID in a single collection.get, serving repeats from _chunk_cache.
+    Returns {chunk_id: (text, meta)} for the chunks that exist.
+    """
+    found = {}
+    to_fetch = []
+    generation = user_context_generation(user_id)
+    with _chunk_cache_lock:
+        for chunk_id in chunk_ids:
+            key = (user_id, generation, chunk_id)
+            if generation is not None and key in _chunk_cache:
+                if _chunk_cache[key] is not None:
+                    found[chunk_id] = _chunk_cache[key]
+            else:
+                to_fetch.append(chunk_id)
+    
+    if to_fetch:
+        try:
+            results = get_user_collection(user_id).get(ids=to_fetch, where={"user_id": user_id})
+        except Exception as e:
+            print(f"Error fetching adjacent chunks: {e}")
+            return found
+        fetched = {}
+        for chunk_id, text, meta in zip(
+            results.get('ids') or [],
+            results.get('documents') or [],
+            results.get('metadatas') or []
+        ):
+            fetched[chunk_id] = (text, meta or {})
+        if generation is not None:
+            with _chunk_cache_lock:
+                for chunk_id in to_fetch:
+                    # Remember misses too (e.g. the chunk after the last one)
+                    _chunk_cache[(user_id, generation, chunk_id)] = fetched.get(chunk_id)
+        found.update(fetched)
+    
+    return found
+
+
 def _include_adjacent_chunks(docs: list, user_id: str, max_context_length: int, current_length: int):
     """
     Include adjacent chunks from the same document for better context continuity.
     When a chunk from a multi-chunk document is retrieved, try to include its neighbors.
-    This is a simplified version that works with the chunks already retrieved.
+    All neighbor IDs are fetched up front in one query (see _fetch_chunks).
     """
     if not docs:
         return docs
@@ -305,6 +515,15 @@ def _include_adjacent_chunks(docs: list, user_id: str, max_context_length: int,
     enhanced_docs = list(standalone_docs)  # Start with non-chunked docs
     total_length = current_length
     
+    # Collect every previous/next chunk ID and fetch them together
+    neighbor_ids = []
+    for source_id, chunks_dict in chunked_docs.items():
+        for chunk_idx in chunks_dict:
+            if chunk_idx > 0:
+                neighbor_ids.append(f"{source_id}_chunk_{chunk_idx - 1}")
+            neighbor_ids.append(f"{source_id}_chunk_{chunk_idx + 1}")
+    neighbors = _fetch_chunks(user_id, list(dict.fromkeys(neighbor_ids))) if neighbor_ids else {}
+    
     # For each source document with chunks, try to include adjacent chunks
     for source_id, chunks_dict in chunked_docs.items():
         if not chunks_dict:
@@ -322,52 +541,28 @@ def _include_adjacent_chunks(docs: list, user_id: str, max_context_length: int,
                 enhanced_docs.append(doc)
                 total_length += len(doc['text'])
             
-            # Try to get previous chunk by ID
+            # Previous chunk first, then next
+            adjacent_ids = [f"{source_id}_chunk_{chunk_idx + 1}"]
             if chunk_idx > 0:
-                prev_chunk_id = f"{source_id}_chunk_{chunk_idx - 1}"
-                try:
-                    prev_results = collection.get(ids=[prev_chunk_id])
-                    if prev_results and 'documents' in prev_results and prev_results['documents']:
-                        prev_text = prev_results['documents'][0]
-                        prev_meta = prev_results.get('metadatas', [{}])[0] if prev_results.get('metadatas') else {}
-                        
-                        # Check if we can add it without exceeding limits
-                        if total_length + len(prev_text) <= max_context_length:
-                            prev_doc = {
-                                "text": prev_text,
-                                "meta": prev_meta,
-                                "similarity": 0.75,  # Slightly lower score for adjacent chunks
-                                "recency_score": 1.0,
-                                "combined_score": 0.75
-                            }
-                            if prev_doc not in enhanced_docs:
-                                enhanced_docs.append(prev_doc)
-                                total_length += len(prev_text)
-                except Exception:
-                    pass  # If chunk doesn't exist, skip
+                adjacent_ids.insert(0, f"{source_id}_chunk_{chunk_idx - 1}")
             
-            # Try to get next chunk by ID
-            next_chunk_id = f"{source_id}_chunk_{chunk_idx + 1}"
-            try:
-                next_results = collection.get(ids=[next_chunk_id])
-                if next_results and 'documents' in next_results and next_results['documents']:
-                    next_text = next_results['documents'][0]
-                    next_meta = next_results.get('metadatas', [{}])[0] if next_results.get('metadatas') else {}
-                    
-                    # Check if we can add it without exceeding limits
-                    if total_length + len(next_text) <= max_context_length:
-                        next_doc = {
-                            "text": next_text,
-                            "meta": next_meta,
-                            "similarity": 0.75,  # Slightly lower score for adjacent chunks
-                            "recency_score": 1.0,
-                            "combined_score": 0.75
-                        }
-                        if next_doc not in enhanced_docs:
-                            enhanced_docs.append(next_doc)
-                            total_length += len(next_text)
-            except Exception:
-                pass  # If chunk doesn't exist, skip
+            for adjacent_id in adjacent_ids:
+                if adjacent_id not in neighbors:
+                    continue  # Chunk doesn't exist
+                adjacent_text, adjacent_meta = neighbors[adjacent_id]
+                
+                # Check if we can add it without exceeding limits
+                if total_length + len(adjacent_text) <= max_context_length:
+                    adjacent_doc = {
+                        "text": adjacent_text,
+                        "meta": adjacent_meta,
+                        "similarity": 0.75,  # Slightly lower score for adjacent chunks
+                        "recency_score": 1.0,
+                        "combined_score": 0.75
+                    }
+                    if adjacent_doc not in enhanced_docs:
+                        enhanced_docs.append(adjacent_doc)
+                        total_length += len(adjacent_text)
             
             # Stop if we've exceeded context length
             if total_length >= max_context_length:
@@ -379,20 +574,6 @@ def _include_adjacent_chunks(docs: list, user_id: str, max_context_length: int,
     return enhanced_docs
 
 
-def summarize_long_context(context_text: str, max_length: int = 1000) -> str:
-    """
-    Summarize context if too long to avoid token bloat.
-    Uses intelligent truncation: keeps beginning and end, removes middle.
-    """
-    if len(context_text) <= max_length:
-        return context_text
-    
-    # For very long context, take first and last parts
-    # This preserves important context from both ends
-    half = max_length // 2
-    return f"{context_text[:half]}...\n[Context truncated for efficiency]\n...{context_text[-half:]}"
-
-
 def polish_context(context_docs: list, min_similarity: float = 0.65) -> list:
     """
     Polish and clean context documents to remove junk data and duplicates.
@@ -448,7 +629,7 @@ def polish_context(context_docs: list, min_similarity: float = 0.65) -> list:
     return polished
 
 
-def format_context_for_prompt(context_docs: list, user_profile: dict = None, completion_history: dict = None, max_length: int = 2500) -> str:
+def format_context_for_prompt(context_docs: list, user_profile: dict = None, completion_history: dict = None, max_tokens: int = 600) -> str:
     """
     Format context documents into a structured, polished prompt section.
     Organizes context into clear sections and removes redundant information.
@@ -457,7 +638,7 @@ def format_context_for_prompt(context_docs: list, user_profile: dict = None, com
         context_docs: List of polished context documents
         user_profile: User profile dictionary (optional)
         completion_history: Completion history dictionary (optional)
-        max_length: Maximum total context length in characters
+        max_tokens: Maximum total context length in tokens (see token_budget)
     
     Returns:
         Formatted context string ready for AI prompt
@@ -480,9 +661,9 @@ def format_context_for_prompt(context_docs: list, user_profile: dict = None, com
         
         if profile_parts:
             profile_section = "User Profile:\n" + "\n".join(profile_parts)
-            if total_length + len(profile_section) <= max_length:
+            if total_length + count_tokens(profile_section) <= max_tokens:
                 sections.append(profile_section)
-                total_length += len(profile_section)
+                total_length += count_tokens(profile_section)
     
     # Section 2: Task Completion History (if available)
     if completion_history:
@@ -499,30 +680,28 @@ def format_context_for_prompt(context_docs: list, user_profile: dict = None, com
         
         if history_parts:
             history_section = "Task Completion History:\n" + "\n".join(history_parts)
-            if total_length + len(history_section) <= max_length:
+            if total_length + count_tokens(history_section) <= max_tokens:
                 sections.append(history_section)
-                total_length += len(history_section)
+                total_length += count_tokens(history_section)
     
     # Section 3: Study Patterns and Context (from retrieved documents)
-    context_parts = []
+    candidates = []
     for doc in context_docs:
         text = doc.get('text', '').strip()
         if not text:
             continue
         
-        # Check if adding this would exceed limit
-        if total_length + len(text) + 50 > max_length:  # +50 for formatting
-            # Try to summarize remaining context
-            remaining = max_length - total_length - 100
-            if remaining > 200:
-                context_parts.append(f"[Additional context: {len(context_docs) - len(context_parts)} more relevant documents]")
-            break
-        
         # Add document with relevance indicator
         similarity = doc.get('similarity', 0)
         relevance = "High" if similarity > 0.8 else "Medium" if similarity > 0.65 else "Low"
-        context_parts.append(f"[{relevance} relevance] {text}")
-        total_length += len(text) + 50
+        candidates.append({"text": f"[{relevance} relevance] {text}"})
+    
+    # Greedily keep the best documents that fit (docs are sorted best first);
+    # reserve a few tokens for the section header and the note below
+    packed = pack_documents(candidates, max_tokens - total_length - 20)
+    context_parts = [doc['text'] for doc in packed]
+    if context_parts and len(packed) < len(candidates):
+        context_parts.append(f"[Additional context: {len(candidates) - len(packed)} more relevant documents]")
     
     if context_parts:
         context_section = "Study Patterns and Context:\n" + "\n\n".join(context_parts)
@@ -531,9 +710,9 @@ def format_context_for_prompt(context_docs: list, user_profile: dict = None, com
     # Join all sections
     formatted_context = "\n\n".join(sections)
     
-    # Final check: if still too long, summarize
-    if len(formatted_context) > max_length:
-        formatted_context = summarize_long_context(formatted_context, max_length)
+    # Final check: if still too long, cut at the token limit
+    if count_tokens(formatted_context) > max_tokens:
+        formatted_context = truncate_to_tokens(formatted_context, max_tokens)
     
     return formatted_context
 
@@ -614,11 +793,10 @@ def filter_syllabus_by_chapters(
     
     # Generate query embedding
     query_embedding = gemini_embedding([query])[0]
-    query_embedding_array = np.array(query_embedding)
     
     # Query ChromaDB for syllabus chunks
-    results = collection.query(
-        query_embeddings=[query_embedding_array],
+    results = get_user_collection(user_id).query(
+        query_embeddings=to_chroma_embeddings([query_embedding]),
         n_results=k * 2,  # Get more results to filter
         where=where_clause
     )